@@ -0,0 +1,63 @@
+import asyncio
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+POLL_INTERVAL = 0.02
+
+
+class ExecutorBusy(Exception):
+    pass
+
+
+class BoundedExecutor:
+    """
+    Thread pool for running blocking work from async views.
+
+    At most `max_workers + max_queued` calls are admitted at once; further
+    callers wait up to `wait_timeout` seconds for a slot and then get
+    ExecutorBusy, so a burst of slow work is pushed back to the client
+    instead of piling up unbounded in memory.
+    """
+
+    def __init__(self, name, max_workers, max_queued, wait_timeout):
+        self.name = name
+        self.wait_timeout = wait_timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        # A thread semaphore rather than an asyncio one, so the executor can be
+        # shared by whichever event loop is running the view
+        self._slots = threading.BoundedSemaphore(max_workers + max_queued)
+
+    async def run(self, func, *args, **kwargs):
+        deadline = time.monotonic() + self.wait_timeout
+        while not self._slots.acquire(blocking=False):
+            if time.monotonic() >= deadline:
+                raise ExecutorBusy(f"The {self.name} pool is busy, try again later")
+            await asyncio.sleep(POLL_INTERVAL)
+
+        try:
+            future = self._executor.submit(functools.partial(func, *args, **kwargs))
+        except BaseException:
+            self._slots.release()
+            raise
+        # Release when the work is really done, even if the awaiting request was cancelled
+        future.add_done_callback(lambda _: self._slots.release())
+        return await asyncio.wrap_future(future)
+
+
+# Separate pools so slow pandas/matplotlib work can't starve cheap file and metadata I/O
+compute_executor = BoundedExecutor(
+    'compute',
+    settings.ASYNC_COMPUTE_WORKERS,
+    settings.ASYNC_COMPUTE_QUEUE,
+    settings.ASYNC_QUEUE_TIMEOUT,
+)
+io_executor = BoundedExecutor(
+    'io',
+    settings.ASYNC_IO_WORKERS,
+    settings.ASYNC_IO_QUEUE,
+    settings.ASYNC_QUEUE_TIMEOUT,
+)
@@ -0,0 +1,23 @@
+import contextlib
+import os
+import uuid
+
+
+@contextlib.contextmanager
+def atomic_write(path, suffix=''):
+    """
+    Yields a temporary path next to `path` to write a file to, and moves it
+    into place once the block completes, so readers never see a partial file.
+    The name is unique to the call: several processes or threads may build the
+    same file at once, the last one to finish wins. `suffix` is kept at the end
+    of the name, for writers that append their own extension (np.savez).
+    On error the temporary file is removed and `path` is left untouched.
+    """
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp{suffix}"
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
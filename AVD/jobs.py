@@ -0,0 +1,340 @@
+import hashlib
+import heapq
+import itertools
+import json
+import threading
+import uuid
+from datetime import timedelta
+from typing import Literal
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from pydantic import BaseModel
+
+from file_upload.models import Job
+from .responses import JsonResponse, dumps
+
+PRIORITIES = {'high': 0, 'normal': 1, 'low': 2}
+POLL_INTERVAL = 0.5  # seconds between queue polls of the database backend
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class JobCancelled(Exception):
+    pass
+
+
+# Options of the endpoints that can run as background jobs
+class JobOptions(BaseModel):
+    mode: Literal['sync', 'async'] = 'sync'  # async returns a job id right away
+    priority: Literal['high', 'normal', 'low'] = 'normal'
+
+
+def parse_job_options(params):
+    return JobOptions(
+        mode=params.get('mode', '').strip() or 'sync',
+        priority=params.get('priority', '').strip() or 'normal',
+    )
+
+
+# Background jobs: long-running requests can be queued instead of being worked
+# on while the client waits. A job is a kind (a handler registered with
+# register()) and JSON parameters; JOB_WORKERS threads per process run queued
+# jobs by priority, then age, and the client polls for the status and result.
+# Submitting a job identical to one still queued or running returns that job.
+#
+# JOB_BACKEND 'memory' keeps jobs in the process, so it suits a single server
+# process. 'database' keeps them in the Job table (SQLite by default): every
+# process can submit, run and report jobs, and queued jobs survive restarts.
+# Finished jobs are kept JOB_RESULT_TTL seconds.
+#
+# With the database backend, jobs running longer than JOB_TIMEOUT seconds (or
+# whose process died) are marked failed. A worker thread can't be interrupted,
+# so the work itself stops at its next report_progress() call, and keeps its
+# worker busy until then. Plot renders are also bounded by RENDER_TIMEOUT.
+_handlers = {}
+_current = threading.local()
+
+
+def register(kind, handler):
+    # `handler(params)` returns the job's JSON result; errors with a `status` attribute keep it
+    _handlers[kind] = handler
+
+
+def report_progress(fraction):
+    # Lets a handler report how far along it is; does nothing outside a job.
+    # Raises JobCancelled once the job is no longer running (it timed out), to stop its work.
+    job_id = getattr(_current, 'job_id', None)
+    if job_id is not None and not get_job_queue().store.set_progress(job_id, fraction):
+        raise JobCancelled("The job timed out")
+
+
+def job_key(kind, params, owner_token):
+    payload = json.dumps([kind, params, owner_token], sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _json_result(result):
+    # Same encoding as the JSON responses, so results stored in the database read back identically
+    return json.loads(dumps(result))
+
+
+class MemoryJobStore:
+    def __init__(self, max_queued, result_ttl):
+        self.max_queued = max_queued
+        self.result_ttl = result_ttl
+        self._jobs = {}  # job_id -> job dict
+        self._in_flight = {}  # key -> job_id of the queued or running job
+        self._queue = []  # heap of (priority, sequence, job_id)
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+    def submit(self, kind, params, owner_token, priority):
+        key = job_key(kind, params, owner_token)
+        with self._condition:
+            self._purge()
+            job_id = self._in_flight.get(key)
+            if job_id is not None:
+                return dict(self._jobs[job_id])
+            if len(self._queue) >= self.max_queued:
+                raise JobQueueFull("The job queue is full, try again later")
+
+            job = {
+                'job_id': uuid.uuid4().hex, 'key': key, 'kind': kind, 'params': params,
+                'owner_token': owner_token, 'priority': priority, 'sequence': next(self._sequence),
+                'status': 'queued', 'progress': 0.0, 'result': None, 'error': '', 'error_status': None,
+                'created_at': timezone.now(), 'started_at': None, 'finished_at': None,
+            }
+            self._jobs[job['job_id']] = job
+            self._in_flight[key] = job['job_id']
+            heapq.heappush(self._queue, (priority, job['sequence'], job['job_id']))
+            self._condition.notify()
+            return dict(job)
+
+    def claim(self, timeout):
+        with self._condition:
+            if not self._queue:
+                self._condition.wait(timeout)
+            if not self._queue:
+                return None
+            _, _, job_id = heapq.heappop(self._queue)
+            job = self._jobs[job_id]
+            job.update(status='running', started_at=timezone.now())
+            return job_id, job['kind'], job['params']
+
+    def set_progress(self, job_id, fraction):
+        # False when the job is no longer running
+        with self._condition:
+            job = self._jobs[job_id]
+            if job['status'] != 'running':
+                return False
+            job['progress'] = fraction
+            return True
+
+    def finish(self, job_id, result=None, error='', error_status=None):
+        with self._condition:
+            job = self._jobs[job_id]
+            job.update(result=result, error=error, error_status=error_status, finished_at=timezone.now())
+            if error:
+                job['status'] = 'failed'
+            else:
+                job.update(status='done', progress=1.0)
+            self._in_flight.pop(job['key'], None)
+
+    def get(self, job_id):
+        with self._condition:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job = dict(job)
+            if job['status'] == 'queued':
+                job['position'] = sum(
+                    1 for priority, sequence, _ in self._queue if (priority, sequence) < (job['priority'], job['sequence'])
+                )
+            return job
+
+    def _purge(self):
+        cutoff = timezone.now() - timedelta(seconds=self.result_ttl)
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job['finished_at'] is not None and job['finished_at'] < cutoff]:
+            del self._jobs[job_id]
+
+
+class DatabaseJobStore:
+    def __init__(self, max_queued, result_ttl, timeout):
+        self.max_queued = max_queued
+        self.result_ttl = result_ttl
+        self.timeout = timeout
+        self._wakeup = threading.Event()
+
+    @staticmethod
+    def _as_dict(job):
+        return {
+            'job_id': job.job_id, 'key': job.key, 'kind': job.kind, 'params': job.params,
+            'owner_token': job.owner_token, 'priority': job.priority, 'status': job.status,
+            'progress': job.progress, 'result': job.result, 'error': job.error,
+            'error_status': job.error_status, 'created_at': job.created_at,
+            'started_at': job.started_at, 'finished_at': job.finished_at,
+        }
+
+    def _expire(self):
+        # Jobs whose worker process died would otherwise stay running, blocking coalesced requests
+        now = timezone.now()
+        Job.objects.filter(status='running', started_at__lt=now - timedelta(seconds=self.timeout)).update(
+            status='failed', error='The job timed out or its worker stopped', error_status=500, finished_at=now,
+        )
+        Job.objects.filter(finished_at__lt=now - timedelta(seconds=self.result_ttl)).delete()
+
+    def submit(self, kind, params, owner_token, priority):
+        key = job_key(kind, params, owner_token)
+        self._expire()
+        with transaction.atomic():
+            job = Job.objects.filter(key=key, status__in=('queued', 'running')).first()
+            if job is None:
+                if Job.objects.filter(status='queued').count() >= self.max_queued:
+                    raise JobQueueFull("The job queue is full, try again later")
+                job = Job.objects.create(
+                    job_id=uuid.uuid4().hex, key=key, kind=kind, params=params,
+                    owner_token=owner_token, priority=priority,
+                )
+        self._wakeup.set()
+        return self._as_dict(job)
+
+    def claim(self, timeout):
+        job = Job.objects.filter(status='queued').order_by('priority', 'created_at', 'id').first()
+        # Another worker, possibly in another process, may claim the same job first
+        if job is not None and Job.objects.filter(pk=job.pk, status='queued').update(
+                status='running', started_at=timezone.now()):
+            return job.job_id, job.kind, job.params
+
+        self._wakeup.wait(timeout)
+        self._wakeup.clear()
+        return None
+
+    def set_progress(self, job_id, fraction):
+        # False when the job is no longer running
+        return Job.objects.filter(job_id=job_id, status='running').update(progress=fraction) > 0
+
+    def finish(self, job_id, result=None, error='', error_status=None):
+        fields = {'result': result, 'error': error, 'error_status': error_status, 'finished_at': timezone.now()}
+        if error:
+            fields['status'] = 'failed'
+        else:
+            fields.update(status='done', progress=1.0)
+        Job.objects.filter(job_id=job_id, status='running').update(**fields)
+
+    def get(self, job_id):
+        self._expire()
+        job = Job.objects.filter(job_id=job_id).first()
+        if job is None:
+            return None
+        status = self._as_dict(job)
+        if job.status == 'queued':
+            ahead = Job.objects.filter(status='queued', priority__lt=job.priority).count()
+            ahead += Job.objects.filter(
+                status='queued', priority=job.priority, created_at__lt=job.created_at,
+            ).count()
+            status['position'] = ahead
+        return status
+
+
+class JobQueue:
+    def __init__(self, store, workers):
+        self.store = store
+        self.workers = workers
+        self._started = False
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._started:
+                return
+            for index in range(self.workers):
+                threading.Thread(target=self._work, name=f'job-{index}', daemon=True).start()
+            self._started = True
+
+    def _work(self):
+        while True:
+            try:
+                claimed = self.store.claim(POLL_INTERVAL)
+            except Exception:
+                # e.g. the database is locked by another writer; try again shortly
+                claimed = None
+            finally:
+                close_old_connections()
+            if claimed is not None:
+                self._run(*claimed)
+
+    def _run(self, job_id, kind, params):
+        _current.job_id = job_id
+        try:
+            handler = _handlers.get(kind)
+            if handler is None:
+                raise LookupError(f"No handler for '{kind}' jobs")
+            self.store.finish(job_id, result=_json_result(handler(params)))
+        except Exception as e:
+            # Jobs that timed out were already failed, finishing them changes nothing
+            self.store.finish(job_id, error=str(e) or type(e).__name__, error_status=getattr(e, 'status', 500))
+        finally:
+            _current.job_id = None
+            close_old_connections()
+
+    def submit(self, kind, params, owner_token, priority='normal'):
+        self._ensure_started()
+        return self.store.submit(kind, params, owner_token, PRIORITIES[priority])
+
+    def get(self, job_id, owner_token):
+        # Jobs are only visible to the token that submitted them
+        self._ensure_started()
+        job = self.store.get(job_id)
+        if job is None or job['owner_token'] != owner_token:
+            return None
+        return job
+
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            max_queued = getattr(settings, 'JOB_MAX_QUEUED', 100)
+            result_ttl = getattr(settings, 'JOB_RESULT_TTL', 3600)
+            if getattr(settings, 'JOB_BACKEND', 'database') == 'memory':
+                store = MemoryJobStore(max_queued, result_ttl)
+            else:
+                store = DatabaseJobStore(max_queued, result_ttl, getattr(settings, 'JOB_TIMEOUT', 600))
+            _job_queue = JobQueue(store, getattr(settings, 'JOB_WORKERS', 2))
+        return _job_queue
+
+
+def public_status(job):
+    # The public view of a job, with its result or error once finished
+    status = {
+        'job_id': job['job_id'],
+        'kind': job['kind'],
+        'status': job['status'],
+        'progress': job['progress'],
+        'created_at': job['created_at'],
+        'started_at': job['started_at'],
+        'finished_at': job['finished_at'],
+    }
+    if 'position' in job:
+        status['position'] = job['position']  # queued jobs that run first
+    if job['status'] == 'done':
+        status['result'] = job['result']
+    elif job['status'] == 'failed':
+        status['error'] = job['error']
+        status['error_status'] = job['error_status']
+    return status
+
+
+def submit_job(kind, params, owner_token, priority='normal'):
+    # Response of an endpoint called with mode=async: the job to poll at file/jobs/<job_id>/
+    job = get_job_queue().submit(kind, params, owner_token, priority)
+    return JsonResponse(public_status(job), status=202)
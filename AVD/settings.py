@@ -39,6 +39,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'corsheaders',
+    'file_upload',
 ]
 
 MIDDLEWARE = [
@@ -81,6 +82,13 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Wait for concurrent uploads/removals instead of failing with "database is locked"
+            'timeout': 20,
+            # Atomic blocks take the write lock up front, so one that reads before writing
+            # (like submitting a job) waits for it instead of failing
+            'transaction_mode': 'IMMEDIATE',
+        },
     }
 }
 
@@ -125,3 +133,94 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Parsed dataset cache
+# Upper bound on the memory used by cached DataFrames (per process)
+
+DATASET_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+
+# Uploads
+# Largest accepted upload in bytes, enforced while the file is streamed (None disables the limit)
+
+MAX_UPLOAD_SIZE = 10 * 1024 * 1024 * 1024
+
+# Resumable uploads: default and largest chunk size, and how long an unfinished session is kept (seconds)
+
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+MAX_UPLOAD_CHUNK_SIZE = 64 * 1024 * 1024
+UPLOAD_SESSION_TTL = 24 * 60 * 60
+
+# Uploads may be sent gzip, bz2 or zstd compressed and are decompressed as they arrive.
+# Stored files are compressed in seekable frames: 'zstd' (gzip when the zstandard
+# package isn't installed), 'gzip', or None to store CSVs uncompressed
+
+STORAGE_COMPRESSION = 'zstd'
+
+# Whole-file CSV parses (conversion to the columnar sidecar, CSV fallback loads): 'pyarrow'
+# uses pyarrow's multi-threaded reader with CSV_PARSE_THREADS threads (None: one per core),
+# 'c' pandas' single-threaded C engine
+
+CSV_ENGINE = 'pyarrow'
+CSV_PARSE_THREADS = None
+
+
+# Row-offset index: every ROW_INDEX_STRIDE-th row's byte offset is stored, so a page
+# read parses at most ROW_INDEX_STRIDE - 1 extra rows
+
+ROW_INDEX_STRIDE = 1000
+
+
+# Async views
+# Route the file/analytics endpoints to their async versions (for ASGI servers such as uvicorn).
+# Blocking work runs in bounded thread pools; callers wait up to ASYNC_QUEUE_TIMEOUT seconds
+# for a slot and then get a 503.
+
+ASYNC_VIEWS = False
+ASYNC_COMPUTE_WORKERS = 4
+ASYNC_COMPUTE_QUEUE = 16
+ASYNC_IO_WORKERS = 8
+ASYNC_IO_QUEUE = 64
+ASYNC_QUEUE_TIMEOUT = 5
+
+
+# Plot rendering
+# Number of render worker processes (0 renders in the request process) and the
+# per-render timeout in seconds, after which the worker is replaced
+
+RENDER_POOL_SIZE = 2
+RENDER_TIMEOUT = 30
+
+# Disk budget for rendered plots (uploaded_files/.plot_cache/), least recently used evicted first
+
+PLOT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# Batch endpoint (file/batch/): threads running the operations of a batch, and the batch size limit
+
+BATCH_WORKERS = 4
+BATCH_MAX_OPERATIONS = 50
+
+# Rows read and serialized at a time by streamed row/column exports (response_format=ndjson|csv)
+
+STREAM_CHUNK_ROWS = 10000
+
+# Column statistics (file/column_stats/): threads sketching chunks in parallel, and rows per chunk
+
+STATS_WORKERS = 4
+STATS_CHUNK_ROWS = 256 * 1024
+
+# Background jobs
+# describe, aggregate_info and visualize accept mode=async (and priority=high|normal|low): they
+# return a job id right away and JOB_WORKERS threads per process do the work; poll
+# file/jobs/<job_id>/?token=... for the status and result. JOB_BACKEND 'database' keeps jobs in
+# the Job table, shared by every server process; 'memory' keeps them in the process that took
+# the request, for single-process servers. With the database backend running jobs are failed
+# after JOB_TIMEOUT seconds; their work stops at its next progress report, not right away.
+# Finished jobs are kept JOB_RESULT_TTL seconds.
+
+JOB_BACKEND = 'database'
+JOB_WORKERS = 2
+JOB_MAX_QUEUED = 100
+JOB_TIMEOUT = 600
+JOB_RESULT_TTL = 3600
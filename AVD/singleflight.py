@@ -0,0 +1,52 @@
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    """
+    Deduplicates concurrent work: while a call for a key is running, other
+    calls for the same key wait for it and get its result (or its exception)
+    instead of doing the work again. Nothing is kept once the call returns,
+    so this is not a cache; it only collapses a burst of identical requests
+    into one computation. Callers must treat shared results as read-only.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}  # key -> Future of the running call
+        self.calls = 0
+        self.shared = 0
+
+    def do(self, key, func, *args, **kwargs):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+                self.calls += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def stats(self):
+        with self._lock:
+            return {"calls": self.calls, "shared": self.shared, "in_flight": len(self._calls)}
+
+
+# Process-wide; keys start with the kind of work so different callers can't collide.
+# Server processes don't share it, but the sidecars they write make later calls cheap.
+single_flight = SingleFlight()
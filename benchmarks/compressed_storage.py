@@ -0,0 +1,97 @@
+"""
+Compare reading an uploaded CSV stored as it is with reading it from the
+compressed seekable storage (file_upload/compression.py): disk size, raw read
+throughput, a full parse and random pages of rows through the row index.
+
+    python benchmarks/compressed_storage.py [rows]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'AVD.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+from file_upload.compression import compress_file, open_data, zstandard  # noqa: E402
+from file_upload.rowindex import build_row_index, read_rows  # noqa: E402
+
+REPEAT = 3
+PAGES = 200
+PAGE_ROWS = 50
+READ_SIZE = 1024 * 1024
+
+
+def best_of(func):
+    timings = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def read_all(path):
+    with open_data(path) as f:
+        while f.read(READ_SIZE):
+            pass
+
+
+def parse(path):
+    with open_data(path) as f:
+        pd.read_csv(f)
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        'id': np.arange(rows),
+        'value': rng.normal(size=rows),
+        'ratio': rng.random(rows).round(4),
+        'label': rng.choice(['alpha', 'beta', 'gamma'], rows),
+        'when': pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 10 ** 6, rows), unit='s'),
+    })
+    columns = df.columns.tolist()
+    starts = rng.integers(0, rows - PAGE_ROWS, PAGES)
+
+    directory = tempfile.mkdtemp()
+    try:
+        raw_path = os.path.join(directory, 'raw')
+        df.to_csv(raw_path, index=False)
+        paths = {'raw': raw_path}
+        for codec in ('zstd', 'gzip'):
+            if codec == 'zstd' and zstandard is None:
+                print("zstandard not installed, skipping zstd")
+                continue
+            paths[codec] = os.path.join(directory, codec)
+            shutil.copyfile(raw_path, paths[codec])
+            start = time.perf_counter()
+            compress_file(paths[codec], codec)
+            print(f"{codec} compression: {time.perf_counter() - start:.2f}s")
+
+        csv_size = os.path.getsize(raw_path)
+        print(f"{rows} rows, {csv_size / 1e6:.1f}MB of CSV, best of {REPEAT}")
+        print(f"{'storage':<8}{'size':>10}{'ratio':>8}{'read':>12}{'parse':>10}{'pages':>12}")
+        for name, path in paths.items():
+            build_row_index(path)
+            read_time = best_of(lambda: read_all(path))
+            parse_time = best_of(lambda: parse(path))
+            page_time = best_of(lambda: [read_rows(path, int(s), int(s) + PAGE_ROWS, columns) for s in starts])
+            size = os.path.getsize(path)
+            print(f"{name:<8}{size / 1e6:>8.1f}MB{csv_size / size:>7.1f}x{csv_size / read_time / 1e6:>8.0f}MB/s"
+                  f"{parse_time:>9.2f}s{page_time / PAGES * 1000:>10.2f}ms")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Cold loads of an uploaded CSV: pandas' single-threaded C engine against the
+pyarrow reader of file_upload/parsing.py at several thread counts, for the
+whole file, for the two columns a plot reads, and for the full conversion to
+the columnar sidecar (schema inference included).
+
+    python benchmarks/csv_parsing.py [rows] [max threads]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'AVD.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+import pyarrow as pa  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+from file_upload import parsing  # noqa: E402
+from file_upload.columnar import remove_columnar, write_columnar  # noqa: E402
+from file_upload.compression import open_data  # noqa: E402
+from file_upload.schema import remove_schema  # noqa: E402
+
+REPEAT = 3
+PLOT_COLUMNS = ['value', 'label']
+
+
+def best_of(func):
+    timings = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def parse(path, columns=None):
+    with open_data(path) as f:
+        parsing.parse_csv(f, columns)
+
+
+def convert(path):
+    # Cold: nothing derived from the file exists yet
+    remove_columnar(path)
+    remove_schema(path)
+    write_columnar(path)
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000_000
+    max_threads = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        'id': np.arange(rows),
+        'value': rng.normal(size=rows),
+        'ratio': rng.random(rows).round(4),
+        'count': rng.integers(0, 1000, rows),
+        'label': rng.choice(['alpha', 'beta', 'gamma'], rows),
+        'note': rng.choice(['ok', 'check "this", later', ''], rows),
+        'when': (pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 10 ** 7, rows), unit='s')).astype(str),
+    })
+
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'data')
+        df.to_csv(path, index=False)
+        print(f"{rows} rows, {os.path.getsize(path) / 1e6:.0f}MB, {os.cpu_count()} cores, best of {REPEAT}")
+        print(f"{'engine':<14}{'all columns':>16}{'2 columns':>16}{'conversion':>16}")
+
+        threads = [1]
+        while threads[-1] * 2 <= max_threads:
+            threads.append(threads[-1] * 2)
+        if threads[-1] != max_threads:
+            threads.append(max_threads)
+
+        engines = [('c', 'pandas C', None)] + [('pyarrow', f'pyarrow x{count}', count) for count in threads]
+        baseline = None
+        for engine, name, count in engines:
+            settings.CSV_ENGINE = engine
+            if count:
+                pa.set_cpu_count(count)
+            timings = [best_of(lambda: parse(path)), best_of(lambda: parse(path, PLOT_COLUMNS)),
+                       best_of(lambda: convert(path))]
+            baseline = baseline or timings
+            print(f"{name:<14}" + "".join(
+                f"{timing:>9.2f}s {base / timing:>4.1f}x" for timing, base in zip(timings, baseline)
+            ))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
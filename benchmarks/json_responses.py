@@ -0,0 +1,80 @@
+"""
+Compare the previous response path (to_dict/tolist + django.http.JsonResponse)
+with AVD.responses on payloads shaped like the analytics endpoints.
+
+    python benchmarks/json_responses.py [rows]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'AVD.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+from django.http import JsonResponse as DjangoJsonResponse  # noqa: E402
+
+from AVD import responses  # noqa: E402
+from AVD.responses import JsonResponse, frame_columns, frame_records  # noqa: E402
+
+REPEAT = 5
+
+
+def best_of(func):
+    timings = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        'id': np.arange(rows),
+        'value': rng.normal(size=rows),
+        'ratio': rng.random(rows),
+        'label': rng.choice(['alpha', 'beta', 'gamma'], rows),
+    })
+    # Missing values, which the stdlib encoder writes as invalid NaN
+    df.loc[::97, 'ratio'] = np.nan
+
+    cases = {
+        # name: (previous path, new path)
+        'describe': (
+            lambda: DjangoJsonResponse(df.describe().to_dict()),
+            lambda: JsonResponse(df.describe().to_dict()),
+        ),
+        'row range': (
+            lambda: DjangoJsonResponse({'rows': df.to_dict(orient='records')}),
+            lambda: JsonResponse({'rows': frame_records(df)}),
+        ),
+        'single column': (
+            lambda: DjangoJsonResponse({'value': df['value'].tolist()}),
+            lambda: JsonResponse({'value': df['value'].to_numpy()}),
+        ),
+        'column range': (
+            lambda: DjangoJsonResponse({'columns': df[['value', 'ratio']].to_dict()}),
+            lambda: JsonResponse({'columns': frame_columns(df[['value', 'ratio']])}),
+        ),
+    }
+
+    encoder = 'orjson' if responses.orjson is not None else 'stdlib (orjson not installed)'
+    print(f"{rows} rows, best of {REPEAT}, AVD.responses using {encoder}")
+    print(f"{'payload':<16}{'previous':>12}{'new':>12}{'speedup':>10}{'size':>12}")
+    for name, (previous, new) in cases.items():
+        previous_time, new_time = best_of(previous), best_of(new)
+        size = len(new().content)
+        print(f"{name:<16}{previous_time * 1000:>10.1f}ms{new_time * 1000:>10.1f}ms"
+              f"{previous_time / new_time:>9.1f}x{size / 1e6:>10.1f}MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+import json
+import os
+
+import numpy as np
+from pandas.api.types import is_bool_dtype, is_numeric_dtype
+
+from AVD.files import atomic_write
+from AVD.singleflight import single_flight
+from file_upload.cache import file_version
+from file_upload.columnar import read_dataset
+
+MAX_BINS = 500
+KDE_POINTS = 200
+# The KDE is computed by smoothing a fine histogram instead of summing one
+# kernel per row, so it costs O(rows) whatever the dataset size
+KDE_GRID = 1024
+KDE_TRUNCATE = 4  # kernel is cut off at this many bandwidths
+
+
+# Plot aggregates live next to the data as "<random_name>.aggregates.json":
+# histogram bins and a KDE curve per numeric column, and the correlation
+# matrix of the numeric columns. Like the profile they are tagged with the
+# data file's mtime/size and rebuilt when it changes. Used by the render
+# workers for unfiltered histograms and heatmaps, and by the data endpoint.
+def aggregates_path(file_path):
+    return f"{file_path}.aggregates.json"
+
+
+def kde_curve(values):
+    # Gaussian KDE with Scott's bandwidth (as seaborn uses), evaluated over the data range
+    n = len(values)
+    std = values.std(ddof=1) if n > 1 else 0.0
+    low, high = float(values.min()), float(values.max())
+    if not std > 0 or high == low:
+        return None
+
+    bandwidth = std * n ** (-1 / 5)
+    counts, edges = np.histogram(values, bins=KDE_GRID, range=(low, high))
+    step = edges[1] - edges[0]
+    half_width = min(int(np.ceil(KDE_TRUNCATE * bandwidth / step)), KDE_GRID)
+    offsets = np.arange(-half_width, half_width + 1) * step / bandwidth
+    kernel = np.exp(-0.5 * offsets ** 2) / np.sqrt(2 * np.pi)
+    density = np.convolve(counts, kernel)[half_width:half_width + KDE_GRID] / (n * bandwidth)
+
+    centers = (edges[:-1] + edges[1:]) / 2
+    x = np.linspace(low, high, KDE_POINTS)
+    return {"x": x.tolist(), "density": np.interp(x, centers, density).tolist()}
+
+
+def column_histogram(column_data):
+    values = column_data.to_numpy(dtype=np.float64, na_value=np.nan)
+    values = values[np.isfinite(values)]
+    if not len(values):
+        return None
+
+    # Same bin rule as seaborn's default, with a cap so the sidecar stays small
+    edges = np.histogram_bin_edges(values, bins='auto')
+    if len(edges) - 1 > MAX_BINS:
+        edges = np.histogram_bin_edges(values, bins=MAX_BINS)
+    counts, edges = np.histogram(values, bins=edges)
+    return {
+        "count": int(len(values)),
+        "edges": edges.tolist(),
+        "counts": counts.tolist(),
+        "kde": kde_curve(values),
+    }
+
+
+def correlation_matrix(df):
+    numerical_df = df.select_dtypes(include='number')
+    correlation = numerical_df.corr()
+    # NaN (e.g. constant columns) isn't valid JSON
+    matrix = correlation.to_numpy()
+    return {
+        "columns": correlation.columns.tolist(),
+        "matrix": [[None if np.isnan(value) else float(value) for value in row] for row in matrix],
+    }
+
+
+def build_aggregates(file_path):
+    df = read_dataset(file_path)
+    histograms = {}
+    for column in df.columns:
+        if is_numeric_dtype(df[column]) and not is_bool_dtype(df[column]):
+            histogram = column_histogram(df[column])
+            if histogram is not None:
+                histograms[column] = histogram
+
+    aggregates = {
+        "source_version": list(file_version(file_path)),
+        "histograms": histograms,
+        "correlation": correlation_matrix(df),
+    }
+
+    with atomic_write(aggregates_path(file_path)) as tmp_path:
+        with open(tmp_path, 'w') as aggregates_file:
+            json.dump(aggregates, aggregates_file)
+    return aggregates
+
+
+def load_aggregates(file_path):
+    path = aggregates_path(file_path)
+    if os.path.exists(path):
+        with open(path, 'r') as aggregates_file:
+            aggregates = json.load(aggregates_file)
+        if aggregates.get("source_version") == list(file_version(file_path)):
+            return aggregates
+
+    return single_flight.do(('aggregates', file_path, file_version(file_path)), build_aggregates, file_path)
+
+
+def remove_aggregates(file_path):
+    path = aggregates_path(file_path)
+    if os.path.exists(path):
+        os.remove(path)
@@ -0,0 +1,97 @@
+import os
+from pydantic import ValidationError
+from django.views.decorators.csrf import csrf_exempt
+from AVD.jobs import JobQueueFull, parse_job_options, submit_job
+from AVD.responses import JsonResponse
+from AVD.executors import ExecutorBusy, compute_executor, io_executor
+from file_upload.models import UserFile
+from file_info.operations import OperationError
+from .plot_cache import plot_cache
+from .views import (
+    PlotDataRequest, image_response, parse_visualization_request, plot_data, visualization_job,
+    visualize,
+)
+
+# Async version of the visualization view; loading and rendering run in the compute pool.
+
+
+# Helper function to validate ownership and file existence
+async def validate_file(token, file_name):
+    user_file = await UserFile.objects.filter(random_name=file_name, owner_token=token).select_related('blob').afirst()
+    if user_file is None:
+        return None, JsonResponse({'error': 'File not found or unauthorized access'}, status=403)
+
+    # The name is an alias; identical uploads share one stored file
+    file_path = user_file.path
+    if not await io_executor.run(os.path.exists, file_path):
+        return None, JsonResponse({'error': 'File does not exist'}, status=404)
+
+    return file_path, None
+
+
+@csrf_exempt
+async def visualize_data(request):
+    if request.method in ('GET', 'POST'):
+        try:
+            data = parse_visualization_request(request)
+            options = parse_job_options(request.POST if request.method == 'POST' else request.GET)
+
+            # Validate file existence and ownership
+            file_path, error = await validate_file(data.token, data.file_name)
+            if error:
+                return error
+
+            if options.mode == 'async':
+                params = visualization_job(data)
+                return await io_executor.run(submit_job, 'visualize', params, data.token, options.priority)
+
+            # Conditional requests only apply to GET; POST always renders
+            if_none_match = request.headers.get('If-None-Match', '') if request.method == 'GET' else ''
+            return image_response(data, *await compute_executor.run(visualize, file_path, data, if_none_match))
+        except OperationError as e:
+            return JsonResponse({'error': str(e)}, status=e.status)
+        except (ExecutorBusy, JobQueueFull) as e:
+            return JsonResponse({'error': str(e)}, status=503)
+        except ValidationError as e:
+            return JsonResponse({'error': e.errors()}, status=400)
+        except Exception as e:
+            return JsonResponse({'error': str(e)}, status=500)
+
+    return JsonResponse({'error': 'Invalid request method'}, status=405)
+
+
+@csrf_exempt
+async def visualization_data(request):
+    if request.method == 'POST':
+        try:
+            data = PlotDataRequest(
+                token=request.POST['token'],
+                file_name=request.POST['file_name'],
+                plot_type=request.POST['plot_type'],
+                column_x=request.POST.get('column_x', None)
+            )
+
+            # Validate file existence and ownership
+            file_path, error = await validate_file(data.token, data.file_name)
+            if error:
+                return error
+
+            return JsonResponse(await compute_executor.run(plot_data, file_path, data))
+        except OperationError as e:
+            return JsonResponse({'error': str(e)}, status=e.status)
+        except ExecutorBusy as e:
+            return JsonResponse({'error': str(e)}, status=503)
+        except ValidationError as e:
+            return JsonResponse({'error': e.errors()}, status=400)
+        except Exception as e:
+            return JsonResponse({'error': str(e)}, status=500)
+
+    return JsonResponse({'error': 'Invalid request method'}, status=405)
+
+
+@csrf_exempt
+async def plot_cache_stats(request):
+    if request.method == 'GET':
+        return JsonResponse(plot_cache.stats())
+
+    return JsonResponse({'error': 'Invalid request method'}, status=405)
@@ -0,0 +1,116 @@
+import numpy as np
+import pandas as pd
+
+# Reductions applied before drawing large inputs, so render time depends on the
+# size of the picture rather than the number of rows. Pure NumPy/pandas: this
+# module is imported by the render workers.
+
+# Line plots are decimated to about this many points per line
+LINE_POINTS = 2000
+# Above this many points per line, a min/max pass runs before LTTB
+LINE_PREFETCH = 20 * LINE_POINTS
+
+# Scatter plots with more rows than this are drawn as a binned density
+SCATTER_DENSITY_THRESHOLD = 100_000
+DENSITY_BINS = (400, 250)
+
+# Scatter plots that can't be binned (non-numeric axes or a categorical hue) are sampled
+SCATTER_SAMPLE_ROWS = 50_000
+
+
+def minmax_indices(y, n_buckets):
+    # Keep the lowest and highest point of each equal-width bucket, which preserves spikes
+    n = len(y)
+    size = -(-n // n_buckets)
+    if size <= 2:
+        return np.arange(n)
+
+    full = n // size * size
+    blocks = y[:full].reshape(-1, size)
+    offsets = np.arange(0, full, size)
+    indices = [offsets + blocks.argmin(axis=1), offsets + blocks.argmax(axis=1)]
+    if full < n:
+        tail = y[full:]
+        indices.append(np.array([full + tail.argmin(), full + tail.argmax()]))
+    indices.append(np.array([0, n - 1]))
+    return np.unique(np.concatenate(indices))
+
+
+def lttb_indices(x, y, n_out):
+    # Largest-Triangle-Three-Buckets: from each bucket keep the point forming the
+    # largest triangle with the previously kept point and the next bucket's average.
+    # x must be sorted. One NumPy pass per bucket, so the cost is O(len(x)).
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = (edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else (n - 1, n)
+        avg_x, avg_y = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+
+        area = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a])
+        )
+        a = start + int(area.argmax())
+        selected[i + 1] = a
+    return selected
+
+
+def _as_float(series):
+    # Datetimes are decimated on their integer timestamps; NaT becomes NaN, like other missing values
+    if pd.api.types.is_datetime64_any_dtype(series):
+        values = series.to_numpy(dtype='datetime64[ns]')
+        return np.where(np.isnat(values), np.nan, values.astype(np.int64).astype(np.float64))
+    return series.to_numpy(dtype=np.float64)
+
+
+def is_decimatable(series):
+    return (pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series)) or \
+        pd.api.types.is_datetime64_any_dtype(series)
+
+
+def decimate_line(df, column_x, column_y, points=LINE_POINTS):
+    # Rows of one line reduced to about `points` rows, sorted by x
+    df = df[[column_x, column_y]].dropna()
+    if len(df) <= points:
+        return df.sort_values(column_x, kind='stable')
+
+    df = df.sort_values(column_x, kind='stable')
+    x, y = _as_float(df[column_x]), _as_float(df[column_y])
+    keep = np.arange(len(df))
+    if len(df) > LINE_PREFETCH:
+        keep = minmax_indices(y, LINE_PREFETCH // 2)
+        x, y = x[keep], y[keep]
+    keep = keep[lttb_indices(x, y, points)]
+    return df.iloc[keep]
+
+
+def density_grid(x, y, weights=None, bins=DENSITY_BINS):
+    # Row counts per cell, or the mean of `weights` per cell; empty cells are masked
+    x, y = _as_float(x), _as_float(y)
+    finite = np.isfinite(x) & np.isfinite(y)
+    if weights is not None:
+        weights = _as_float(weights)
+        finite &= np.isfinite(weights)
+        weights = weights[finite]
+    x, y = x[finite], y[finite]
+
+    counts, x_edges, y_edges = np.histogram2d(x, y, bins=bins)
+    if weights is None:
+        grid = counts
+    else:
+        sums, _, _ = np.histogram2d(x, y, bins=[x_edges, y_edges], weights=weights)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            grid = sums / counts
+    return np.ma.masked_where(counts == 0, grid), x_edges, y_edges
+
+
+def sample_rows(df, rows=SCATTER_SAMPLE_ROWS):
+    # Fixed seed so the same request draws the same picture
+    return df.sample(n=rows, random_state=0) if len(df) > rows else df
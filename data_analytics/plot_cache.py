@@ -0,0 +1,123 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+from django.conf import settings
+
+UPLOAD_DIR = "uploaded_files"
+PLOT_CACHE_DIR = os.path.join(UPLOAD_DIR, ".plot_cache")
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+# Eviction frees space down to this share of the limit, so a full cache isn't rescanned on every put
+EVICT_TO = 0.9
+
+
+def plot_key(dataset_sha256, params):
+    # Blank and missing parameters are the same request
+    normalized = {name: value for name, value in params.items() if value not in (None, '')}
+    payload = json.dumps(normalized, sort_keys=True)
+    return hashlib.sha256(f"{dataset_sha256}:{payload}".encode()).hexdigest()
+
+
+# Rendered plots on local disk, addressed by the dataset's content hash and the
+# normalized plot parameters: "<dir>/<dataset sha256>/<plot key>". The total
+# size is bounded; least recently used entries (by mtime, refreshed on every
+# hit) are evicted first. The plot key doubles as the response ETag.
+# The total is kept as a running count, and the directory is only scanned
+# when it goes over the limit (or isn't known yet), which also picks up the
+# entries other server processes wrote since.
+class PlotCache:
+    def __init__(self, directory=PLOT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._bytes = None  # Size of the entries as of the last scan plus this process' writes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _path(self, dataset_sha256, key):
+        return os.path.join(self.directory, dataset_sha256, key)
+
+    def get(self, dataset_sha256, key):
+        path = self._path(dataset_sha256, key)
+        try:
+            with open(path, 'rb') as entry:
+                data = entry.read()
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, dataset_sha256, key, data):
+        directory = os.path.join(self.directory, dataset_sha256)
+        os.makedirs(directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=directory, prefix='.tmp-', delete=False) as entry:
+            entry.write(data)
+        path = self._path(dataset_sha256, key)
+        try:
+            replaced = os.stat(path).st_size
+        except FileNotFoundError:
+            replaced = 0
+        os.replace(entry.name, path)
+
+        with self._lock:
+            if self._bytes is not None:
+                self._bytes += len(data) - replaced
+            over = self._bytes is None or self._bytes > self.max_bytes
+        if over:
+            self._evict()
+
+    def purge(self, dataset_sha256):
+        shutil.rmtree(os.path.join(self.directory, dataset_sha256), ignore_errors=True)
+        with self._lock:
+            self._bytes = None  # Recounted on the next put
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            for dataset_dir in os.scandir(self.directory):
+                if not dataset_dir.is_dir():
+                    continue
+                for entry in os.scandir(dataset_dir.path):
+                    if entry.name.startswith('.tmp-'):
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+            total = sum(size for _, size, _ in entries)
+            if total <= self.max_bytes:
+                self._bytes = total
+                return
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes * EVICT_TO:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                self.evictions += 1
+            self._bytes = total
+
+
+plot_cache = PlotCache(max_bytes=getattr(settings, 'PLOT_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES))
@@ -0,0 +1,311 @@
+import atexit
+import multiprocessing
+import queue
+import threading
+from io import BytesIO
+
+from file_upload.columnar import read_dataset
+from file_upload.filters import filtered_dataset, parse_filter
+from .aggregates import load_aggregates
+from .decimate import (
+    LINE_POINTS, SCATTER_DENSITY_THRESHOLD, decimate_line, density_grid, is_decimatable, sample_rows,
+)
+
+# Plots are rendered in a pool of worker processes. Each worker imports
+# matplotlib/seaborn once, draws on its own Figure/Agg canvas (never the
+# global pyplot state) and drops the figure as soon as the PNG is written.
+# Workers load the columns they need themselves from the memory-mapped
+# sidecar, so the DataFrame is never pickled between processes.
+# Large scatter and line inputs are reduced before drawing (see decimate.py),
+# unfiltered histograms and heatmaps are drawn from precomputed aggregates.
+# This module must not import Django models: it is imported by spawned workers.
+
+
+class RenderTimeout(Exception):
+    pass
+
+
+class RenderBusy(Exception):
+    pass
+
+
+class RenderError(Exception):
+    pass
+
+
+# Function to draw a plot and return it as image bytes (png, svg or webp).
+# With `aggregates`, histograms and heatmaps don't need `df`.
+def generate_plot(df, plot_type, column_x=None, column_y=None, column_z=None, image_format='png',
+                  aggregates=None):
+    import seaborn as sns
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(10, 6))
+    FigureCanvasAgg(fig)
+    ax = fig.subplots()
+
+    # Histogram plot
+    if plot_type == 'histogram':
+        if aggregates is not None:
+            draw_binned_histogram(ax, aggregates['histograms'][column_x], column_x)
+        else:
+            sns.histplot(df[column_x], kde=True, ax=ax)
+        ax.set_title(f"Histogram of {column_x}")
+
+    # Scatter plot with optional third variable for color or size
+    elif plot_type == 'scatter':
+        if len(df) > SCATTER_DENSITY_THRESHOLD:
+            draw_large_scatter(fig, ax, df, column_x, column_y, column_z)
+        elif column_z:  # Use the third variable for color or size
+            sns.scatterplot(x=df[column_x], y=df[column_y], hue=df[column_z], palette='viridis', ax=ax)
+            ax.set_title(f"Scatter plot of {column_x} vs {column_y} colored by {column_z}")
+        else:
+            sns.scatterplot(x=df[column_x], y=df[column_y], ax=ax)
+            ax.set_title(f"Scatter plot of {column_x} vs {column_y}")
+
+    # Bar plot with optional third variable for color
+    elif plot_type == 'bar':
+        if column_z:  # Use the third variable for color
+            sns.barplot(x=df[column_x], y=df[column_y], hue=df[column_z], ax=ax)
+            ax.set_title(f"Bar plot of {column_x} vs {column_y} grouped by {column_z}")
+        else:
+            sns.barplot(x=df[column_x], y=df[column_y], ax=ax)
+            ax.set_title(f"Bar plot of {column_x} vs {column_y}")
+
+    # Line plot with optional third variable for color
+    elif plot_type == 'line':
+        if len(df) > LINE_POINTS and is_decimatable(df[column_x]) and is_decimatable(df[column_y]):
+            draw_decimated_line(ax, df, column_x, column_y, column_z)
+        elif column_z:  # Use the third variable for color
+            sns.lineplot(x=df[column_x], y=df[column_y], hue=df[column_z], ax=ax)
+            ax.set_title(f"Line plot of {column_x} vs {column_y} colored by {column_z}")
+        else:
+            sns.lineplot(x=df[column_x], y=df[column_y], ax=ax)
+            ax.set_title(f"Line plot of {column_x} vs {column_y}")
+
+    # Heatmap for correlation, only numerical data considered
+    elif plot_type == 'heatmap':
+        if aggregates is not None:
+            correlation = correlation_frame(aggregates['correlation'])
+        else:
+            # Select only numerical columns for correlation matrix
+            numerical_df = df.select_dtypes(include='number')
+            correlation = numerical_df.corr()
+        sns.heatmap(correlation, annot=True, cmap='coolwarm', ax=ax)
+        ax.set_title("Correlation Heatmap")
+
+    # Encode the canvas; webp goes through Pillow
+    buf = BytesIO()
+    try:
+        fig.savefig(buf, format=image_format)
+        return buf.getvalue()
+    finally:
+        buf.close()
+        fig.clear()
+
+
+def draw_binned_histogram(ax, histogram, column_x):
+    import numpy as np
+    import seaborn as sns
+
+    # Same drawing as histplot(kde=True), from stored bin counts and KDE density
+    edges = np.asarray(histogram['edges'])
+    color = sns.color_palette()[0]
+    # histplot(kde=True) lightens the bars
+    sns.histplot(x=edges[:-1], weights=histogram['counts'], bins=histogram['edges'], color=color, alpha=.5, ax=ax)
+    if histogram['kde'] is not None:
+        # Density scaled to counts, as histplot does
+        scale = histogram['count'] * np.diff(edges).mean()
+        ax.plot(histogram['kde']['x'], np.asarray(histogram['kde']['density']) * scale, color=color)
+    ax.set_xlabel(column_x)
+
+
+def correlation_frame(correlation):
+    import pandas as pd
+
+    columns = correlation['columns']
+    return pd.DataFrame(correlation['matrix'], index=columns, columns=columns, dtype=float)
+
+
+def draw_large_scatter(fig, ax, df, column_x, column_y, column_z=None):
+    import seaborn as sns
+    from matplotlib.colors import LogNorm
+
+    rows = len(df)
+    numeric_z = column_z and is_decimatable(df[column_z])
+    if is_decimatable(df[column_x]) and is_decimatable(df[column_y]) and (not column_z or numeric_z):
+        # Rasterize: row counts per cell, or the mean of the third variable per cell
+        weights = df[column_z] if column_z else None
+        grid, x_edges, y_edges = density_grid(df[column_x], df[column_y], weights)
+        if column_z:
+            mesh = ax.pcolormesh(x_edges, y_edges, grid.T, cmap='viridis')
+            fig.colorbar(mesh, ax=ax, label=f"Mean {column_z}")
+            ax.set_title(f"Scatter plot of {column_x} vs {column_y} colored by {column_z} ({rows} rows, binned)")
+        else:
+            mesh = ax.pcolormesh(x_edges, y_edges, grid.T, cmap='viridis', norm=LogNorm())
+            fig.colorbar(mesh, ax=ax, label="Rows")
+            ax.set_title(f"Scatter plot of {column_x} vs {column_y} ({rows} rows, binned)")
+        ax.set_xlabel(column_x)
+        ax.set_ylabel(column_y)
+        return
+
+    # Categorical axes or hue can't be binned, draw a sample instead
+    sample = sample_rows(df)
+    if column_z:
+        sns.scatterplot(x=sample[column_x], y=sample[column_y], hue=sample[column_z], palette='viridis', ax=ax)
+        ax.set_title(f"Scatter plot of {column_x} vs {column_y} colored by {column_z} ({len(sample)} of {rows} rows)")
+    else:
+        sns.scatterplot(x=sample[column_x], y=sample[column_y], ax=ax)
+        ax.set_title(f"Scatter plot of {column_x} vs {column_y} ({len(sample)} of {rows} rows)")
+
+
+def draw_decimated_line(ax, df, column_x, column_y, column_z=None):
+    import pandas as pd
+    import seaborn as sns
+
+    # Each line is sorted and reduced to a bounded number of points, which are
+    # then drawn as they are (no per-x aggregation or confidence band)
+    if column_z:
+        lines = [
+            decimate_line(group, column_x, column_y).assign(**{column_z: value})
+            for value, group in df.groupby(column_z, sort=True)
+        ]
+        reduced = pd.concat(lines) if lines else df[[column_x, column_y, column_z]].iloc[:0]
+        sns.lineplot(data=reduced, x=column_x, y=column_y, hue=column_z, estimator=None, sort=False, ax=ax)
+        ax.set_title(f"Line plot of {column_x} vs {column_y} colored by {column_z}")
+    else:
+        reduced = decimate_line(df, column_x, column_y)
+        sns.lineplot(data=reduced, x=column_x, y=column_y, estimator=None, sort=False, ax=ax)
+        ax.set_title(f"Line plot of {column_x} vs {column_y}")
+
+
+def render_plot(file_path, columns, plot_type, column_x=None, column_y=None, column_z=None, filter_data=None,
+                image_format='png'):
+    # Unfiltered histograms and heatmaps don't need the rows
+    if not filter_data and plot_type in ('histogram', 'heatmap'):
+        aggregates = load_aggregates(file_path)
+        if plot_type == 'heatmap' or column_x in aggregates['histograms']:
+            return generate_plot(None, plot_type, column_x, column_y, column_z, image_format, aggregates)
+
+    # filter_data was validated by the view; only matching rows are read
+    if filter_data:
+        df = filtered_dataset(file_path, parse_filter(filter_data), columns)
+    else:
+        df = read_dataset(file_path, columns)
+    return generate_plot(df, plot_type, column_x, column_y, column_z, image_format)
+
+
+def _warm_up():
+    import matplotlib
+    matplotlib.use('Agg')
+    import seaborn  # noqa: F401
+    from matplotlib.backends import backend_agg  # noqa: F401
+
+
+def _worker_main(conn):
+    _warm_up()
+    while True:
+        try:
+            args = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+        try:
+            conn.send((True, render_plot(*args)))
+        except Exception as e:
+            conn.send((False, str(e)))
+
+
+class RenderPool:
+    """
+    Fixed-size pool of render processes. A render that exceeds `timeout`
+    seconds gets its worker killed and replaced, so one pathological plot
+    can't hold a worker (or the others) hostage. Callers wait up to
+    `timeout` seconds for a free worker before getting RenderBusy.
+    With size 0 plots are rendered in the calling process.
+    """
+
+    def __init__(self, size, timeout):
+        self.size = size
+        self.timeout = timeout
+        self._context = multiprocessing.get_context('spawn')
+        self._idle = queue.Queue()
+        self._workers = []
+        self._lock = threading.Lock()
+        self._started = False
+
+    def _start_worker(self):
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        process.start()
+        child_conn.close()
+        worker = (process, parent_conn)
+        self._workers.append(worker)
+        return worker
+
+    def _stop_worker(self, worker):
+        process, conn = worker
+        process.kill()
+        process.join()
+        conn.close()
+        self._workers.remove(worker)
+
+    def _ensure_started(self):
+        with self._lock:
+            if not self._started:
+                for _ in range(self.size):
+                    self._idle.put(self._start_worker())
+                self._started = True
+
+    def render(self, *args):
+        if self.size == 0:
+            return render_plot(*args)
+
+        self._ensure_started()
+        try:
+            worker = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise RenderBusy("All render workers are busy, try again later")
+
+        try:
+            process, conn = worker
+            conn.send(args)
+            if not conn.poll(self.timeout):
+                raise RenderTimeout(f"Rendering took longer than {self.timeout} seconds")
+            ok, result = conn.recv()
+        except (RenderTimeout, EOFError, OSError):
+            # Replace the stuck or dead worker
+            with self._lock:
+                self._stop_worker(worker)
+                worker = self._start_worker()
+            raise
+        finally:
+            self._idle.put(worker)
+
+        if not ok:
+            raise RenderError(result)
+        return result
+
+    def close(self):
+        with self._lock:
+            for worker in list(self._workers):
+                self._stop_worker(worker)
+            self._started = False
+            self._idle = queue.Queue()
+
+
+_render_pool = None
+_render_pool_lock = threading.Lock()
+
+
+def get_render_pool():
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            from django.conf import settings
+            _render_pool = RenderPool(
+                getattr(settings, 'RENDER_POOL_SIZE', 2),
+                getattr(settings, 'RENDER_TIMEOUT', 30),
+            )
+            atexit.register(_render_pool.close)
+        return _render_pool
@@ -1,3 +1,163 @@
-from django.test import TestCase
+import os
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+from django.test import SimpleTestCase, override_settings
+
+from file_upload.models import UserFile
+from file_upload.tests import AsyncViewTestCase, UploadDirTestCase, async_urlpatterns
+from . import async_views, urls
+from .decimate import decimate_line, density_grid, lttb_indices, minmax_indices
+from .plot_cache import PlotCache
+
+# Served in place of the project's URLs by AsyncViewTests
+urlpatterns = async_urlpatterns("", urls, async_views)
+
+
+class AnalyticsTestCase(UploadDirTestCase):
+    CSV = "x,y,label\n" + "".join(f"{i},{(i * 7) % 11},{'ab'[i % 2]}\n" for i in range(200))
+
+    def setUp(self):
+        super().setUp()
+        response = self.upload(self.CSV.encode())
+        self.assertEqual(response.status_code, 200)
+        self.file_name = response.json()["random_name"]
+
+    def visualize(self, **fields):
+        return self.client.post("/visualize/", {"token": "token", "file_name": self.file_name, **fields})
+
+
+@override_settings(RENDER_POOL_SIZE=0)
+class VisualizeTests(AnalyticsTestCase):
+    def test_binary_plot_with_etag(self):
+        response = self.visualize(plot_type="histogram", column_x="x", response_type="binary")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "image/png")
+        self.assertTrue(response.content.startswith(b"\x89PNG"))
+
+        # Conditional requests are GETs, with the parameters in the query string
+        cached = self.client.get("/visualize/", {
+            "token": "token", "file_name": self.file_name, "plot_type": "histogram", "column_x": "x",
+            "response_type": "binary",
+        }, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(cached.status_code, 304)
+
+    def test_unknown_column(self):
+        response = self.visualize(plot_type="histogram", column_x="missing")
+        self.assertEqual(response.status_code, 400)
+
+    def test_progress_reported_around_render(self):
+        with mock.patch("data_analytics.views.report_progress") as report_progress:
+            self.assertEqual(self.visualize(plot_type="scatter", column_x="x", column_y="y").status_code, 200)
+        self.assertEqual([call.args[0] for call in report_progress.call_args_list], [0.1, 0.9])
+
+
+class DecimateTests(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.y = rng.normal(size=10000)
+        self.y[1234], self.y[8765] = 50, -50  # Spikes any reduction must keep
+
+    def test_minmax_keeps_extremes_in_order(self):
+        keep = minmax_indices(self.y, 100)
+        self.assertLessEqual(len(keep), 2 * 100 + 2)
+        self.assertTrue((np.diff(keep) > 0).all())
+        self.assertEqual([keep[0], keep[-1]], [0, len(self.y) - 1])
+        self.assertIn(1234, keep)
+        self.assertIn(8765, keep)
+        np.testing.assert_array_equal(minmax_indices(self.y[:150], 100), np.arange(150))
+
+    def test_lttb_keeps_extremes_in_order(self):
+        x = np.arange(len(self.y), dtype=float)
+        keep = lttb_indices(x, self.y, 500)
+        self.assertEqual(len(keep), 500)
+        self.assertTrue((np.diff(keep) > 0).all())
+        self.assertEqual([keep[0], keep[-1]], [0, len(self.y) - 1])
+        self.assertIn(1234, keep)
+        self.assertIn(8765, keep)
+        np.testing.assert_array_equal(lttb_indices(x[:100], self.y[:100], 500), np.arange(100))
+
+    def test_decimated_line_sorted_by_x(self):
+        df = pd.DataFrame({"x": np.arange(len(self.y))[::-1], "y": self.y})
+        reduced = decimate_line(df, "x", "y", points=300)
+        self.assertEqual(len(reduced), 300)
+        self.assertTrue(reduced["x"].is_monotonic_increasing)
+        self.assertEqual(reduced["y"].max(), 50)
+        self.assertEqual(reduced["y"].min(), -50)
+
+    def test_density_grid_drops_missing_dates(self):
+        x = pd.Series(pd.to_datetime(["2024-01-01", None, "2024-01-03", "2024-01-05"]))
+        y = pd.Series([1.0, 2.0, np.nan, 4.0])
+        grid, x_edges, y_edges = density_grid(x, y, bins=(4, 3))
+        self.assertEqual(x_edges[0], pd.Timestamp("2024-01-01").value)
+        self.assertEqual(x_edges[-1], pd.Timestamp("2024-01-05").value)
+        self.assertEqual(grid.sum(), 2)  # The rows without a date or a y value are left out
+
+
+class PlotCacheTests(UploadDirTestCase):
+    def test_evicts_least_recently_used_when_over_budget(self):
+        cache = PlotCache("plots", max_bytes=1000)
+        for index in range(3):
+            cache.put("dataset", f"plot{index}", b"x" * 300)
+            os.utime(cache._path("dataset", f"plot{index}"), (index, index))
+        self.assertIsNotNone(cache.get("dataset", "plot0"))  # Now the most recently used
+
+        cache.put("dataset", "plot3", b"x" * 300)
+        self.assertIsNone(cache.get("dataset", "plot1"))
+        self.assertIsNotNone(cache.get("dataset", "plot0"))
+        self.assertEqual(cache.evictions, 1)
+
+    def test_directory_scanned_only_when_over_budget(self):
+        cache = PlotCache("plots", max_bytes=1000)
+        with mock.patch.object(cache, "_evict", wraps=cache._evict) as evict:
+            for index in range(3):
+                cache.put("dataset", f"plot{index}", b"x" * 300)
+            cache.put("dataset", "plot0", b"x" * 300)  # Replacing an entry doesn't grow the total
+            self.assertEqual(evict.call_count, 1)  # The first put counts what's on disk
+            cache.put("dataset", "plot3", b"x" * 300)
+            self.assertEqual(evict.call_count, 2)
+
+    def test_purge_drops_dataset_entries(self):
+        cache = PlotCache("plots", max_bytes=1000)
+        cache.put("dataset", "plot", b"x" * 600)
+        cache.purge("dataset")
+        cache.put("other", "plot", b"x" * 600)
+        self.assertEqual(cache.evictions, 0)
+        self.assertIsNotNone(cache.get("other", "plot"))
+
+
+@override_settings(RENDER_POOL_SIZE=0)
+class AsyncViewTests(AsyncViewTestCase):
+    ASYNC_URLCONF = __name__
+
+    def setUp(self):
+        super().setUp()
+        self.file_name = self.upload(AnalyticsTestCase.CSV.encode()).json()["random_name"]
+
+    def fields(self, token="token", **fields):
+        return {"token": token, "file_name": self.file_name, **fields}
+
+    def test_matches_sync_views(self):
+        for method in ["get", "post"]:
+            with self.subTest(method=method):
+                fields = self.fields(plot_type="histogram", column_x="x", response_type="binary")
+                response = self.assert_async_matches(method, "/visualize/", fields, status=200)
+                self.assertEqual(response["Content-Type"], "image/png")
+                fields = self.fields(plot_type="histogram", column_x="missing")
+                self.assert_async_matches(method, "/visualize/", fields, status=400)
+                fields = self.fields(token="other", plot_type="histogram", column_x="x")
+                self.assert_async_matches(method, "/visualize/", fields, status=403)
+
+        self.assert_async_matches("post", "/visualize/data/", self.fields(plot_type="heatmap"), status=200)
+        fields = self.fields(plot_type="histogram", column_x="label")
+        self.assert_async_matches("post", "/visualize/data/", fields, status=400)
+        self.assert_async_matches("post", "/visualize/data/", self.fields(plot_type="pie"), status=400)
+        self.assert_async_matches("post", "/visualize/data/", self.fields(token="other", plot_type="heatmap"), status=403)
+        self.assert_async_matches("put", "/visualize/", status=405)
+
+    def test_missing_file(self):
+        os.remove(UserFile.objects.get(random_name=self.file_name).path)
+        fields = self.fields(plot_type="histogram", column_x="x")
+        self.assert_async_matches("post", "/visualize/", fields, status=404)
+        self.assert_async_matches("post", "/visualize/data/", self.fields(plot_type="heatmap"), status=404)
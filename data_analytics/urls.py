@@ -1,6 +1,12 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views as sync_views
+
+# Async versions of the views are used when running under ASGI
+views = async_views if settings.ASYNC_VIEWS else sync_views
 
 urlpatterns = [
-    path('visualize/', views.visualize_data, name='visualize_data')
+    path('visualize/', views.visualize_data, name='visualize_data'),
+    path('visualize/data/', views.visualization_data, name='visualization_data'),
+    path('visualize/cache_stats/', views.plot_cache_stats, name='plot_cache_stats'),
 ]
@@ -1,17 +1,28 @@
-from pydantic import BaseModel, Field
-from typing import Optional
-import json
-import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-from io import BytesIO
-from django.http import JsonResponse
+from pydantic import BaseModel, Field, ValidationError
+from typing import Literal, Optional
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
 from django.views.decorators.csrf import csrf_exempt
 import base64
 import os
+from AVD.jobs import JobQueueFull, parse_job_options, report_progress, submit_job
+from AVD.responses import JsonResponse
+from AVD.singleflight import single_flight
+from file_upload.models import UserFile
+from file_upload.columnar import read_column_names
+from file_upload.filters import FilterError, check_filter, column_kinds, filter_key, parse_filter
+from file_upload.profile import load_profile
+from file_info.operations import OperationError
+from .aggregates import load_aggregates
+from .plot_cache import plot_cache, plot_key
+from .render import RenderBusy, RenderTimeout, get_render_pool
 
-UPLOAD_DIR = "uploaded_files"
-USER_FILES_PATH = os.path.join(UPLOAD_DIR, "user_files.json")
+CONTENT_TYPES = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+    'webp': 'image/webp',
+}
 
 
 # Pydantic model for request validation
@@ -22,116 +33,231 @@ class VisualizationRequest(BaseModel):
     column_x: Optional[str] = None
     column_y: Optional[str] = None
     column_z: Optional[str] = None  # Additional optional column for 3rd variable
-    filter_data: Optional[str] = None  # Optional filter for query
+    filter_data: Optional[str] = None  # Optional JSON row filter, see file_upload/filters.py
+    image_format: Literal['png', 'svg', 'webp'] = 'png'
+    response_type: Literal['json', 'binary'] = 'json'  # base64 in JSON, or the raw image bytes
 
 
 # Helper function to validate ownership and file existence
 def validate_file(token, file_name):
-    with open(USER_FILES_PATH, 'r') as user_files_file:
-        user_files = json.load(user_files_file)
-
-    if token not in user_files or file_name not in user_files[token]:
+    user_file = UserFile.objects.filter(random_name=file_name, owner_token=token).select_related('blob').first()
+    if user_file is None:
         return None, JsonResponse({'error': 'File not found or unauthorized access'}, status=403)
 
-    file_path = os.path.join(UPLOAD_DIR, file_name)
+    # The name is an alias; identical uploads share one stored file
+    file_path = user_file.path
     if not os.path.exists(file_path):
         return None, JsonResponse({'error': 'File does not exist'}, status=404)
 
     return file_path, None
 
-# '/visualize' endpoint
-# Function to generate a plot and return it as base64 image
-def generate_plot(df, plot_type, column_x=None, column_y=None, column_z=None, filter_data=None):
-    if filter_data:
-        df = df.query(filter_data)
-
-    plt.figure(figsize=(10, 6))
-
-    # Histogram plot
-    if plot_type == 'histogram':
-        sns.histplot(df[column_x], kde=True)
-        plt.title(f"Histogram of {column_x}")
-
-    # Scatter plot with optional third variable for color or size
-    elif plot_type == 'scatter':
-        if column_z:  # Use the third variable for color or size
-            sns.scatterplot(x=df[column_x], y=df[column_y], hue=df[column_z], palette='viridis')
-            plt.title(f"Scatter plot of {column_x} vs {column_y} colored by {column_z}")
-        else:
-            sns.scatterplot(x=df[column_x], y=df[column_y])
-            plt.title(f"Scatter plot of {column_x} vs {column_y}")
-
-    # Bar plot with optional third variable for color
-    elif plot_type == 'bar':
-        if column_z:  # Use the third variable for color
-            sns.barplot(x=df[column_x], y=df[column_y], hue=df[column_z])
-            plt.title(f"Bar plot of {column_x} vs {column_y} grouped by {column_z}")
-        else:
-            sns.barplot(x=df[column_x], y=df[column_y])
-            plt.title(f"Bar plot of {column_x} vs {column_y}")
-
-    # Line plot with optional third variable for color
-    elif plot_type == 'line':
-        if column_z:  # Use the third variable for color
-            sns.lineplot(x=df[column_x], y=df[column_y], hue=df[column_z])
-            plt.title(f"Line plot of {column_x} vs {column_y} colored by {column_z}")
-        else:
-            sns.lineplot(x=df[column_x], y=df[column_y])
-            plt.title(f"Line plot of {column_x} vs {column_y}")
-
-    # Heatmap for correlation, only numerical data considered
-    elif plot_type == 'heatmap':
-        # Select only numerical columns for correlation matrix
-        numerical_df = df.select_dtypes(include='number')
-        correlation = numerical_df.corr()
-        sns.heatmap(correlation, annot=True, cmap='coolwarm')
-        plt.title("Correlation Heatmap")
-
-    # Convert plot to PNG and then to base64
-    buf = BytesIO()
-    plt.savefig(buf, format='png')
-    buf.seek(0)
-    img_str = base64.b64encode(buf.read()).decode('utf-8')
-    buf.close()
-    
-    return img_str
+# Helper function to read the visualization parameters from the form, or from the
+# query string for GET requests (so browsers and CDNs can cache binary images).
+# Blank optional fields are treated as missing, so equivalent requests share a cached plot.
+def parse_visualization_request(request):
+    params = request.POST if request.method == 'POST' else request.GET
+
+    def optional(name):
+        return params.get(name, '').strip() or None
+
+    return VisualizationRequest(
+        token=params['token'],
+        file_name=params['file_name'],
+        plot_type=params['plot_type'],
+        column_x=optional('column_x'),
+        column_y=optional('column_y'),
+        column_z=optional('column_z'),  # Optional third column
+        filter_data=optional('filter_data'),
+        image_format=params.get('image_format') or 'png',
+        response_type=params.get('response_type') or 'json'
+    )
+
+
+# Strong ETag of a response; the JSON and binary forms are different representations
+def plot_etag(key, response_type):
+    return f'"{key}"' if response_type == 'binary' else f'"{key}.json"'
+
+
+def visualization_job(data):
+    # Parameters of the background job rendering this plot (see file_info/jobs.py);
+    # its result is the image in base64 with its ETag
+    operation = {'op': 'visualize', **data.model_dump(exclude={'token', 'file_name', 'response_type'})}
+    return {'token': data.token, 'file_name': data.file_name, 'operation': operation}
+
+
+# Load the columns a plot needs and render it, shared by the sync and async views.
+# Returns the image bytes and their cache key, which the ETag is built from. When the
+# client's If-None-Match already names the plot, nothing is read and the image is None.
+def visualize(file_path, data, if_none_match=''):
+    filter_spec = None
+    if data.filter_data:
+        try:
+            filter_spec = parse_filter(data.filter_data)
+        except FilterError as e:
+            raise OperationError(str(e))
+        data.filter_data = filter_key(filter_spec)
+
+    # Rendered plots are cached by dataset content and normalized parameters
+    user_file = UserFile.objects.get(random_name=data.file_name)
+    dataset_sha256 = user_file.ensure_sha256(file_path)
+    key = plot_key(dataset_sha256, {
+        "plot_type": data.plot_type,
+        "column_x": data.column_x,
+        "column_y": data.column_y,
+        "column_z": data.column_z,
+        "filter_data": data.filter_data,
+        "image_format": data.image_format,
+    })
+    etags = parse_etags(if_none_match)
+    if '*' in etags or plot_etag(key, data.response_type) in etags:
+        return None, key
+
+    image = plot_cache.get(dataset_sha256, key)
+    if image is not None:
+        return image, key
+
+    # Check if columns are valid
+    columns = read_column_names(file_path)
+    for column in (data.column_x, data.column_y, data.column_z):
+        if column and column not in columns:
+            raise OperationError(f'{column} is not a valid column in the dataset')
+    if filter_spec is not None:
+        try:
+            check_filter(filter_spec, column_kinds(load_profile(file_path)))
+        except FilterError as e:
+            raise OperationError(str(e))
+
+    # Read only the plotted columns; heatmaps correlate the numerical ones
+    if data.plot_type == 'heatmap':
+        kinds = column_kinds(load_profile(file_path))
+        needed = [column for column, kind in kinds.items() if kind == 'number'] or None
+    else:
+        needed = [c for c in (data.column_x, data.column_y, data.column_z) if c]
+
+    # Generate the plot based on user preferences, in the render pool.
+    # Identical requests arriving while it renders wait for this render.
+    # The worker loads the columns and draws the plot in one step, so a
+    # job's progress only moves when the work is handed over and when it's back.
+    report_progress(0.1)
+    try:
+        image = single_flight.do(('plot', key), render_plot, file_path, needed, data, dataset_sha256, key)
+    except RenderBusy as e:
+        raise OperationError(str(e), status=503)
+    except RenderTimeout as e:
+        raise OperationError(str(e), status=504)
+    report_progress(0.9)
+    return image, key
+
+
+def render_plot(file_path, needed, data, dataset_sha256, key):
+    image = get_render_pool().render(
+        file_path, needed, data.plot_type, data.column_x, data.column_y, data.column_z, data.filter_data,
+        data.image_format
+    )
+    plot_cache.put(dataset_sha256, key, image)
+    return image
+
+
+# Helper function to wrap a rendered plot in the requested response
+def image_response(data, image, key):
+    etag = plot_etag(key, data.response_type)
+    if image is None:
+        response = HttpResponseNotModified()
+    elif data.response_type == 'binary':
+        # The encoded canvas bytes as they are
+        response = HttpResponse(image, content_type=CONTENT_TYPES[data.image_format])
+    else:
+        # Return the image as base64
+        response = JsonResponse({'image': base64.b64encode(image).decode('utf-8')})
+    response['ETag'] = etag
+    # Responses may be stored, but are revalidated since the file can be removed
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+# Pydantic model for the plot data request
+class PlotDataRequest(BaseModel):
+    token: str
+    file_name: str
+    plot_type: Literal['histogram', 'heatmap']
+    column_x: Optional[str] = None
+
+
+# The precomputed data behind a histogram or heatmap, so the frontend can draw it itself
+def plot_data(file_path, data):
+    aggregates = load_aggregates(file_path)
+    if data.plot_type == 'heatmap':
+        return {'correlation': aggregates['correlation']}
+
+    histogram = aggregates['histograms'].get(data.column_x)
+    if histogram is None:
+        raise OperationError(f'{data.column_x} is not a numerical column in the dataset')
+    return {'column': data.column_x, 'histogram': histogram}
 
 
 # View for generating different types of visualizations
 @csrf_exempt
 def visualize_data(request):
-    if request.method == 'POST':
+    if request.method in ('GET', 'POST'):
         try:
-            token = request.POST['token']
-            file_name = request.POST['file_name']
-            plot_type = request.POST['plot_type']
-            column_x = request.POST.get('column_x', None)
-            column_y = request.POST.get('column_y', None)
-            column_z = request.POST.get('column_z', None)  # Optional third column
-            filter_data = request.POST.get('filter_data', None)
+            data = parse_visualization_request(request)
+            options = parse_job_options(request.POST if request.method == 'POST' else request.GET)
 
             # Validate file existence and ownership
-            file_path, error = validate_file(token, file_name)
+            file_path, error = validate_file(data.token, data.file_name)
             if error:
                 return error
 
-            # Read the CSV file
-            df = pd.read_csv(file_path)
+            if options.mode == 'async':
+                return submit_job('visualize', visualization_job(data), data.token, options.priority)
 
-            # Check if columns are valid
-            if column_x and column_x not in df.columns:
-                return JsonResponse({'error': f'{column_x} is not a valid column in the dataset'}, status=400)
-            if column_y and column_y not in df.columns:
-                return JsonResponse({'error': f'{column_y} is not a valid column in the dataset'}, status=400)
-            if column_z and column_z not in df.columns:
-                return JsonResponse({'error': f'{column_z} is not a valid column in the dataset'}, status=400)
+            # Conditional requests only apply to GET; POST always renders
+            if_none_match = request.headers.get('If-None-Match', '') if request.method == 'GET' else ''
+            return image_response(data, *visualize(file_path, data, if_none_match))
+        except OperationError as e:
+            return JsonResponse({'error': str(e)}, status=e.status)
+        except JobQueueFull as e:
+            return JsonResponse({'error': str(e)}, status=503)
+        except ValidationError as e:
+            return JsonResponse({'error': e.errors()}, status=400)
+        except Exception as e:
+            return JsonResponse({'error': str(e)}, status=500)
+
+    return JsonResponse({'error': 'Invalid request method'}, status=405)
 
-            # Generate the plot based on user preferences
-            img_str = generate_plot(df, plot_type, column_x, column_y, column_z, filter_data)
 
-            # Return the image as base64
-            return JsonResponse({'image': img_str})
+# View returning histogram bins/KDE or the correlation matrix as JSON
+@csrf_exempt
+def visualization_data(request):
+    if request.method == 'POST':
+        try:
+            data = PlotDataRequest(
+                token=request.POST['token'],
+                file_name=request.POST['file_name'],
+                plot_type=request.POST['plot_type'],
+                column_x=request.POST.get('column_x', None)
+            )
+
+            # Validate file existence and ownership
+            file_path, error = validate_file(data.token, data.file_name)
+            if error:
+                return error
+
+            return JsonResponse(plot_data(file_path, data))
+        except OperationError as e:
+            return JsonResponse({'error': str(e)}, status=e.status)
+        except ValidationError as e:
+            return JsonResponse({'error': e.errors()}, status=400)
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=500)
 
     return JsonResponse({'error': 'Invalid request method'}, status=405)
+
+
+# Rendered plot cache counters, used to tune PLOT_CACHE_MAX_BYTES
+@csrf_exempt
+def plot_cache_stats(request):
+    if request.method == 'GET':
+        return JsonResponse(plot_cache.stats())
+
+    return JsonResponse({'error': 'Invalid request method'}, status=405)
@@ -0,0 +1,218 @@
+import json
+import os
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from pydantic import ValidationError
+from django.views.decorators.csrf import csrf_exempt
+from AVD.jobs import JobQueueFull, get_job_queue, parse_job_options, public_status, submit_job
+from AVD.responses import JsonResponse
+from AVD.singleflight import single_flight
+from AVD.executors import ExecutorBusy, compute_executor, io_executor
+from file_upload.models import UserFile
+from file_upload.cache import dataset_cache
+from . import operations
+from .batch import parse_operations, run_batch
+from .operations import OperationError
+from .views import FileOperationRequest, parse_line_column_request
+
+# Async versions of the file_info views. Ownership checks use the async ORM,
+# profile reads go to the I/O pool and dataset loads/statistics to the compute pool.
+
+
+# Helper function to validate ownership and file existence
+async def validate_file(token, file_name):
+    user_file = await UserFile.objects.filter(random_name=file_name, owner_token=token).select_related('blob').afirst()
+    if user_file is None:
+        return None, JsonResponse({'error': 'File not found or unauthorized access'}, status=403)
+
+    # The name is an alias; identical uploads share one stored file
+    file_path = user_file.path
+    if not await io_executor.run(os.path.exists, file_path):
+        return None, JsonResponse({'error': 'File does not exist'}, status=404)
+
+    return file_path, None
+
+
+# Produce each chunk of a streamed export in the compute pool, off the event loop
+async def stream_chunks(chunks):
+    while True:
+        chunk = await compute_executor.run(next, chunks, None)
+        if chunk is None:
+            return
+        yield chunk
+
+
+# Shared body of the endpoints that take a token and a file name.
+# Endpoints given a `job` name also accept mode=async, see AVD/jobs.py.
+async def run_file_operation(request, executor, operation, safe=True, job=None):
+    if request.method == 'POST':
+        try:
+            data = FileOperationRequest(
+                token=request.POST['token'],
+                file_name=request.POST['file_name']
+            )
+            options = parse_job_options(request.POST) if job else None
+            file_path, error = await validate_file(data.token, data.file_name)
+            if error:
+                return error
+
+            if options and options.mode == 'async':
+                params = {'token': data.token, 'file_name': data.file_name, 'operation': {'op': job}}
+                return await io_executor.run(submit_job, job, params, data.token, options.priority)
+            return JsonResponse(await executor.run(operation, file_path), safe=safe)
+        except (ExecutorBusy, JobQueueFull) as e:
+            return JsonResponse({'error': str(e)}, status=503)
+        except ValidationError as e:
+            return JsonResponse({'error': e.errors()}, status=400)
+        except Exception as e:
+            return JsonResponse({'error': str(e)}, status=500)
+
+    return JsonResponse({'error': 'Invalid request method'}, status=405)
+
+
+@csrf_exempt
+async def describe_csv(request):
+    return await run_file_operation(request, io_executor, operations.describe, job='describe')
+
+
+@csrf_exempt
+async def head_csv(request):
+    return await run_file_operation(request, io_executor, operations.head, safe=False)
+
+
+@csrf_exempt
+async def column_names(request):
+    return await run_file_operation(request, io_executor, operations.columns)
+
+
+@csrf_exempt
+async def shape_csv(request):
+    return await run_file_operation(request, io_executor, operations.shape)
+
+
+@csrf_exempt
+async def aggregate_csv_info(request):
+    return await run_file_operation(request, io_executor, operations.aggregate_info, job='aggregate_info')
+
+
+@csrf_exempt
+async def memory_usage(request):
+    return await run_file_operation(request, io_executor, operations.memory_usage)
+
+
+@csrf_exempt
+async def get_rows_or_columns(request):
+    if request.method == 'POST':
+        try:
+            data = parse_line_column_request(request)
+            file_path, error = await validate_file(data.token, data.file_name)
+            if error:
+                return error
+
+            if data.response_format != 'json':
+                chunks = await compute_executor.run(
+                    operations.stream_rows_or_columns, file_path, data.number, data.is_column, data.range_end,
+                    data.filter_data, data.response_format, settings.STREAM_CHUNK_ROWS
+                )
+                return StreamingHttpResponse(
+                    stream_chunks(chunks), content_type=operations.STREAM_CONTENT_TYPES[data.response_format]
+                )
+
+            payload = await compute_executor.run(
+                operations.rows_or_columns, file_path, data.number, data.is_column, data.range_end, data.filter_data
+            )
+            return JsonResponse(payload)
+        except OperationError as e:
+            return JsonResponse({'error': str(e)}, status=e.status)
+        except ExecutorBusy as e:
+            return JsonResponse({'error': str(e)}, status=503)
+        except ValidationError as e:
+            return JsonResponse({'error': e.errors()}, status=400)
+        except Exception as e:
+            return JsonResponse({'error': str(e)}, status=500)
+
+    return JsonResponse({'error': 'Invalid request method'}, status=405)
+
+
+@csrf_exempt
+async def column_statistics(request):
+    if request.method == 'POST':
+        try:
+            data = parse_line_column_request(request)
+            file_path, error = await validate_file(data.token, data.file_name)
+            if error:
+                return error
+
+            payload = await compute_executor.run(
+                operations.column_statistics, file_path, data.number, data.is_column
+            )
+            return JsonResponse(payload)
+        except OperationError as e:
+            return JsonResponse({'error': str(e)}, status=e.status)
+        except ExecutorBusy as e:
+            return JsonResponse({'error': str(e)}, status=503)
+        except ValidationError as e:
+            return JsonResponse({'error': e.errors()}, status=400)
+        except Exception as e:
+            return JsonResponse({'error': str(e)}, status=500)
+
+    return JsonResponse({'error': 'Invalid request method'}, status=405)
+
+
+@csrf_exempt
+async def batch_operations(request):
+    if request.method == 'POST':
+        try:
+            data = FileOperationRequest(
+                token=request.POST['token'],
+                file_name=request.POST['file_name']
+            )
+            operations_list = parse_operations(request.POST['operations'])
+            file_path, error = await validate_file(data.token, data.file_name)
+            if error:
+                return error
+
+            payload = await compute_executor.run(
+                run_batch, file_path, data.token, data.file_name, operations_list
+            )
+            return JsonResponse(payload)
+        except OperationError as e:
+            return JsonResponse({'error': str(e)}, status=e.status)
+        except json.JSONDecodeError as e:
+            return JsonResponse({'error': f'operations is not valid JSON: {e}'}, status=400)
+        except ExecutorBusy as e:
+            return JsonResponse({'error': str(e)}, status=503)
+        except ValidationError as e:
+            return JsonResponse({'error': e.errors()}, status=400)
+        except Exception as e:
+            return JsonResponse({'error': str(e)}, status=500)
+
+    return JsonResponse({'error': 'Invalid request method'}, status=405)
+
+
+@csrf_exempt
+async def cache_stats(request):
+    if request.method == 'GET':
+        # Coalesced requests show up as "shared" calls
+        return JsonResponse({**dataset_cache.stats(), "single_flight": single_flight.stats()})
+
+    return JsonResponse({'error': 'Invalid request method'}, status=405)
+
+
+@csrf_exempt
+async def job_status(request, job_id):
+    if request.method == 'GET':
+        try:
+            job = await io_executor.run(get_job_queue().get, job_id, request.GET['token'])
+            if job is None:
+                return JsonResponse({'error': 'Job not found'}, status=404)
+
+            return JsonResponse(public_status(job))
+        except ExecutorBusy as e:
+            return JsonResponse({'error': str(e)}, status=503)
+        except KeyError:
+            return JsonResponse({'error': 'Missing token'}, status=400)
+        except Exception as e:
+            return JsonResponse({'error': str(e)}, status=500)
+
+    return JsonResponse({'error': 'Invalid request method'}, status=405)
@@ -0,0 +1,168 @@
+import base64
+import json
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Literal, Optional, Union
+
+from django.conf import settings
+from pydantic import BaseModel, ValidationError
+
+from data_analytics.views import PlotDataRequest, VisualizationRequest, plot_data, visualize
+from file_upload.cache import load_dataset
+from file_upload.columnar import read_column_names
+from . import operations
+from .operations import OperationError
+
+# Operations a batch may contain, named like the endpoints they stand for
+OPERATION_NAMES = (
+    'describe', 'head', 'columns', 'shape', 'aggregate_info', 'memory_usage',
+    'get_rows_or_columns', 'column_stats', 'visualize', 'visualize_data',
+)
+
+batch_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'BATCH_WORKERS', 4),
+    thread_name_prefix='batch',
+)
+
+
+# Pydantic model for one operation of a batch; the fields are those of the matching endpoint
+class BatchOperation(BaseModel):
+    op: Literal[OPERATION_NAMES]
+    number: Optional[int] = None
+    is_column: bool = False
+    range_end: Optional[int] = None
+    filter_data: Optional[Union[str, dict]] = None
+    plot_type: Optional[str] = None
+    column_x: Optional[str] = None
+    column_y: Optional[str] = None
+    column_z: Optional[str] = None
+    image_format: str = 'png'
+
+
+def parse_operations(text):
+    operations_list = json.loads(text)
+    if not isinstance(operations_list, list):
+        raise OperationError('operations must be a JSON list')
+    max_operations = getattr(settings, 'BATCH_MAX_OPERATIONS', 50)
+    if len(operations_list) > max_operations:
+        raise OperationError(f'A batch may have at most {max_operations} operations')
+    return operations_list
+
+
+def parse_operation(entry):
+    if not isinstance(entry, dict):
+        raise OperationError('Each operation must be a JSON object')
+    operation = BatchOperation(**entry)
+    # Filters may be given inline instead of as a JSON string
+    if isinstance(operation.filter_data, dict):
+        operation.filter_data = json.dumps(operation.filter_data)
+    if operation.op in ('get_rows_or_columns', 'column_stats') and operation.number is None:
+        raise OperationError(f"'{operation.op}' needs a number")
+    return operation
+
+
+def plan_columns(file_path, parsed):
+    # Union of the columns the column reads (filtered or not) need, so they share one load.
+    # The other operations don't parse the file: describe, head, columns, shape,
+    # memory_usage, aggregate_info and visualize_data answer from the sidecars
+    # built at upload, row reads seek through the row index or take the matching
+    # rows from the columnar copy, column_stats uses the stored sketches, and
+    # plots come from the plot cache or the render pool.
+    column_list = None
+    needed = []
+    for operation in parsed:
+        if not isinstance(operation, BatchOperation) or operation.op != 'get_rows_or_columns' \
+                or not operation.is_column:
+            continue
+        column_list = column_list or read_column_names(file_path)
+        if operation.range_end is not None:
+            needed.extend(column_list[operation.number:operation.range_end])
+        elif -len(column_list) <= operation.number < len(column_list):
+            needed.append(column_list[operation.number])
+    return list(dict.fromkeys(needed))
+
+
+def run_operation(file_path, token, file_name, operation, frame):
+    if operation.op == 'describe':
+        return operations.describe(file_path)
+    if operation.op == 'head':
+        return operations.head(file_path)
+    if operation.op == 'columns':
+        return operations.columns(file_path)
+    if operation.op == 'shape':
+        return operations.shape(file_path)
+    if operation.op == 'aggregate_info':
+        return operations.aggregate_info(file_path)
+    if operation.op == 'memory_usage':
+        return operations.memory_usage(file_path)
+    if operation.op == 'get_rows_or_columns':
+        return operations.rows_or_columns(
+            file_path, operation.number, operation.is_column, operation.range_end, operation.filter_data, frame
+        )
+    if operation.op == 'column_stats':
+        return operations.column_statistics(file_path, operation.number, operation.is_column)
+
+    if operation.op == 'visualize_data':
+        data = PlotDataRequest(token=token, file_name=file_name, plot_type=operation.plot_type,
+                               column_x=operation.column_x)
+        return plot_data(file_path, data)
+
+    data = VisualizationRequest(
+        token=token,
+        file_name=file_name,
+        plot_type=operation.plot_type,
+        column_x=operation.column_x,
+        column_y=operation.column_y,
+        column_z=operation.column_z,
+        filter_data=operation.filter_data,
+        image_format=operation.image_format,
+    )
+    image, key = visualize(file_path, data)
+    return {'image': base64.b64encode(image).decode('utf-8'), 'etag': key}
+
+
+def failed(error):
+    future = Future()
+    future.set_exception(error)
+    return future
+
+
+def outcome(future):
+    # Each operation succeeds or fails on its own, like the endpoint it stands for
+    try:
+        return {'status': 200, 'result': future.result()}
+    except OperationError as e:
+        return {'status': e.status, 'error': str(e)}
+    except ValidationError as e:
+        return {'status': 400, 'error': e.errors()}
+    except Exception as e:
+        return {'status': 500, 'error': str(e)}
+
+
+def run_batch(file_path, token, file_name, operations_list):
+    """
+    Run a batch of operations against one file. Operations are validated
+    first, the columns needed by column reads are loaded once (see
+    plan_columns), then the operations run in parallel. Results are returned
+    in request order.
+    """
+    parsed = []
+    for entry in operations_list:
+        try:
+            parsed.append(parse_operation(entry))
+        except (OperationError, ValidationError) as e:
+            parsed.append(e)
+
+    needed = plan_columns(file_path, parsed)
+    frame = load_dataset(file_path, needed) if needed else None
+
+    futures = [
+        batch_executor.submit(run_operation, file_path, token, file_name, operation, frame)
+        if isinstance(operation, BatchOperation) else failed(operation)
+        for operation in parsed
+    ]
+
+    results = []
+    for entry, future in zip(operations_list, futures):
+        op = entry.get('op') if isinstance(entry, dict) else None
+        results.append({'op': op, **outcome(future)})
+    return {'results': results}
@@ -0,0 +1,24 @@
+import os
+
+from AVD.jobs import register
+from file_upload.models import UserFile
+from .batch import BatchOperation, run_operation
+from .operations import OperationError
+
+# Endpoints that accept mode=async, queued as background jobs (see AVD/jobs.py)
+JOB_OPERATIONS = ('describe', 'aggregate_info', 'visualize')
+
+
+def run_operation_job(params):
+    # `params` are {"token", "file_name", "operation"}, the operation holding the fields
+    # of the batch operation of that name. Ownership was checked when the job was submitted; the file may have been removed since
+    user_file = UserFile.objects.filter(random_name=params['file_name']).select_related('blob').first()
+    if user_file is None or not os.path.exists(user_file.path):
+        raise OperationError('File does not exist', status=404)
+    file_path = user_file.path
+    operation = BatchOperation(**params['operation'])
+    return run_operation(file_path, params['token'], params['file_name'], operation, None)
+
+
+for name in JOB_OPERATIONS:
+    register(name, run_operation_job)
@@ -0,0 +1,261 @@
+import functools
+
+import numpy as np
+
+from AVD.responses import dumps, frame_columns, frame_records
+from AVD.singleflight import single_flight
+from file_upload.cache import load_dataset
+from file_upload.columnar import (
+    ensure_columnar, file_version, iter_dataset, load_schema, read_column_names, read_dataset_rows,
+    read_dataset_slice,
+)
+from file_upload.filters import FilterError, check_filter, column_kinds, filter_mask, parse_filter
+from file_upload.profile import load_profile
+from file_upload.rowindex import iter_rows, read_rows
+from file_upload.schema import csv_read_options, memory_report
+from .statistics import load_statistics, summarize
+
+STREAM_CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+# Raised by operations for invalid requests, turned into an error response by the views
+class OperationError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+# The work behind each file_info endpoint, taking a validated file path and
+# returning the JSON payload. Shared by the sync and async views and the batch
+# endpoint, which passes `frame`: the needed columns, already loaded once.
+
+
+def coalesced(operation):
+    # Identical calls on the same version of a file that run at the same time
+    # share one computation (see AVD/singleflight.py). Calls given a loaded
+    # frame, which isn't hashable, always run on their own.
+    @functools.wraps(operation)
+    def wrapper(file_path, *args, **kwargs):
+        key = (operation.__name__, file_path, file_version(file_path), args, tuple(sorted(kwargs.items())))
+        try:
+            hash(key)
+        except TypeError:
+            return operation(file_path, *args, **kwargs)
+        return single_flight.do(key, operation, file_path, *args, **kwargs)
+    return wrapper
+
+
+def select_columns(file_path, columns, frame=None):
+    if frame is not None and all(column in frame.columns for column in columns):
+        return frame[columns]
+    return load_dataset(file_path, columns)
+
+
+def select_rows(file_path, positions, columns, frame=None):
+    # Like select_columns, for the rows at `positions` (the frame is indexed by position)
+    if frame is not None and all(column in frame.columns for column in columns):
+        return frame[columns].iloc[positions]
+    return read_dataset_rows(file_path, positions, columns)
+
+
+def row_bounds(profile, start, stop):
+    # [start, stop) of a row range given with slice semantics
+    start, stop, _ = slice(start, stop).indices(profile['shape'][0])
+    return start, max(start, stop)
+
+
+# Pages of rows come from the columnar copy when there is one, so they are typed
+# like every other read (a category keeps its values, e.g. booleans with blanks,
+# where parsing the CSV with the schema would give their text). Without it only
+# the requested rows are parsed, seeking to them through the row-offset index.
+def read_row_page(file_path, profile, start, stop):
+    if ensure_columnar(file_path) is not None:
+        return read_dataset_slice(file_path, *row_bounds(profile, start, stop))
+    return read_rows(file_path, start, stop, profile['columns'], csv_read_options(load_schema(file_path)))
+
+
+def iter_row_pages(file_path, profile, start, stop, chunk_rows):
+    if ensure_columnar(file_path) is not None:
+        start, stop = row_bounds(profile, start, stop)
+        return (
+            read_dataset_slice(file_path, offset, min(offset + chunk_rows, stop))
+            for offset in range(start, stop, chunk_rows)
+        )
+    read_options = csv_read_options(load_schema(file_path))
+    return iter_rows(file_path, start, stop, profile['columns'], read_options, chunk_rows)
+
+
+def describe(file_path):
+    return load_profile(file_path)['describe']
+
+
+def head(file_path):
+    return load_profile(file_path)['head']
+
+
+def columns(file_path):
+    return {'columns': load_profile(file_path)['columns']}
+
+
+def shape(file_path):
+    return {'shape': load_profile(file_path)['shape']}
+
+
+def memory_usage(file_path):
+    # Bytes each column takes loaded with its compact dtype, and with pandas' default one
+    return memory_report(load_schema(file_path))
+
+
+def aggregate_info(file_path):
+    # Served from the profile precomputed at upload
+    profile = load_profile(file_path)
+    return {
+        "describe": profile['describe'],
+        "head": profile['head'],
+        "columns": profile['columns'],
+        "shape": profile['shape']
+    }
+
+
+@coalesced
+def rows_or_columns(file_path, number, is_column, range_end=None, filter_data=None, frame=None):
+    if filter_data:
+        return filtered_rows_or_columns(file_path, number, is_column, range_end, filter_data, frame)
+
+    if is_column:
+        # Only load the requested columns
+        column_list = read_column_names(file_path)
+        if range_end is None:
+            column = column_list[number]
+            df = select_columns(file_path, [column], frame)
+            # Arrays are encoded directly by the response layer
+            return {column: df[column].to_numpy()}
+        else:
+            df = select_columns(file_path, column_list[number:range_end], frame)
+            return {f"columns_{number}_to_{range_end}": frame_columns(df)}
+
+    # Only the requested rows are read, see read_row_page
+    profile = load_profile(file_path)
+    if range_end is None:
+        row_count = profile['shape'][0]
+        row = number + row_count if number < 0 else number
+        if not 0 <= row < row_count:
+            raise OperationError('Invalid row index.')
+        df = read_row_page(file_path, profile, row, row + 1)
+        return {row: df.iloc[0].to_dict()}
+
+    df = read_row_page(file_path, profile, number, range_end)
+    return {f"rows_{number}_to_{range_end}": frame_records(df)}
+
+
+def filtered_rows_or_columns(file_path, number, is_column, range_end, filter_data, frame=None):
+    # Same responses as rows_or_columns, over the rows matching the filter only.
+    # Rows are numbered within the matches and keyed by their position in the file.
+    try:
+        spec = parse_filter(filter_data)
+        check_filter(spec, column_kinds(load_profile(file_path)))
+    except FilterError as e:
+        raise OperationError(str(e))
+    positions = np.flatnonzero(filter_mask(file_path, spec))
+
+    if is_column:
+        column_list = read_column_names(file_path)
+        if range_end is None:
+            column = column_list[number]
+            df = select_rows(file_path, positions, [column], frame)
+            # Arrays are encoded directly by the response layer
+            return {column: df[column].to_numpy()}
+        else:
+            df = select_rows(file_path, positions, column_list[number:range_end], frame)
+            return {f"columns_{number}_to_{range_end}": frame_columns(df)}
+
+    if range_end is None:
+        if not -len(positions) <= number < len(positions):
+            raise OperationError('Invalid row index.')
+        df = read_dataset_rows(file_path, positions[[number]])
+        return {int(df.index[0]): df.iloc[0].to_dict()}
+
+    df = read_dataset_rows(file_path, positions[number:range_end])
+    return {f"rows_{number}_to_{range_end}": frame_records(df)}
+
+
+def stream_rows_or_columns(file_path, number, is_column, range_end=None, filter_data=None,
+                           response_format='ndjson', chunk_rows=10000):
+    """
+    The rows a rows_or_columns request selects, as NDJSON (one object per row)
+    or CSV. Requests are checked up front; the returned generator then reads
+    and serializes `chunk_rows` rows at a time, so memory stays bounded
+    whatever the range. Column requests stream the selected columns row by row.
+    """
+    if filter_data:
+        try:
+            spec = parse_filter(filter_data)
+            check_filter(spec, column_kinds(load_profile(file_path)))
+        except FilterError as e:
+            raise OperationError(str(e))
+
+    if is_column:
+        column_list = read_column_names(file_path)
+        selected = [column_list[number]] if range_end is None else column_list[number:range_end]
+    else:
+        selected = None
+
+    if filter_data:
+        positions = np.flatnonzero(filter_mask(file_path, spec))
+        if not is_column:
+            if range_end is None:
+                if not -len(positions) <= number < len(positions):
+                    raise OperationError('Invalid row index.')
+                positions = positions[[number]]
+            else:
+                positions = positions[number:range_end]
+        chunks = (
+            read_dataset_rows(file_path, positions[offset:offset + chunk_rows], selected)
+            for offset in range(0, len(positions), chunk_rows)
+        )
+    elif is_column:
+        chunks = iter_dataset(file_path, selected, chunk_rows)
+    else:
+        profile = load_profile(file_path)
+        if range_end is None:
+            row_count = profile['shape'][0]
+            row = number + row_count if number < 0 else number
+            if not 0 <= row < row_count:
+                raise OperationError('Invalid row index.')
+            chunks = iter_row_pages(file_path, profile, row, row + 1, chunk_rows)
+        else:
+            chunks = iter_row_pages(file_path, profile, number, range_end, chunk_rows)
+
+    return serialize_chunks(chunks, response_format)
+
+
+def serialize_chunks(chunks, response_format):
+    header = True
+    for chunk in chunks:
+        if response_format == 'csv':
+            yield chunk.to_csv(index=False, header=header)
+            header = False
+        else:
+            # Same encoding as the JSON responses; unlike DataFrame.to_json it keeps floats exact
+            yield b''.join(dumps(record) + b'\n' for record in frame_records(chunk))
+
+
+@coalesced
+def column_statistics(file_path, number, is_column=True):
+    column_list = read_column_names(file_path)
+
+    # Ensure the request is for a column
+    if not is_column:
+        raise OperationError('This endpoint only handles column statistics.')
+
+    if number >= len(column_list):
+        raise OperationError('Invalid column index.')
+
+    # Computed in chunks and kept up to date incrementally, see statistics.py.
+    # Past ten thousand distinct values the median, and past a thousand unique/freq, are estimates.
+    column_name = column_list[number]
+    accumulators = load_statistics(file_path, [column_name])[column_name]
+    return {f"column_{column_name}_statistics": summarize(accumulators)}
@@ -0,0 +1,267 @@
+import base64
+
+import numpy as np
+import pandas as pd
+
+# Mergeable accumulators behind the column statistics. Each one summarizes a
+# chunk of a column in bounded memory, and two summaries merge into the
+# summary of both chunks, so columns are processed chunk by chunk (in
+# parallel) and the state of processed rows is kept for appended data.
+# Every accumulator round-trips through to_dict()/from_dict() (JSON-safe).
+
+# Centroids of the t-digest are bounded by about DIGEST_COMPRESSION / 2
+DIGEST_COMPRESSION = 1000
+# Distinct values a t-digest keeps as they are, with their counts, before it
+# starts grouping them: quantiles are exact until a column has more than this
+DIGEST_EXACT_VALUES = 10000
+# HyperLogLog uses 2 ** HLL_PRECISION registers, for a standard error of about 0.8%
+HLL_PRECISION = 14
+# Distinct values tracked exactly by the heavy-hitter summary
+HEAVY_HITTERS = 1024
+
+
+class Moments:
+    """
+    Count, mean, variance (Welford/Chan), min and max of a numeric column.
+    """
+
+    def __init__(self, count=0, mean=0.0, m2=0.0, minimum=None, maximum=None):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+        self.minimum = minimum
+        self.maximum = maximum
+
+    def update(self, values):
+        if len(values):
+            mean = float(values.mean())
+            self.merge(Moments(len(values), mean, float(((values - mean) ** 2).sum()),
+                               float(values.min()), float(values.max())))
+
+    def merge(self, other):
+        if not other.count:
+            return
+        if not self.count:
+            self.__dict__.update(other.__dict__)
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta ** 2 * self.count * other.count / count
+        self.count = count
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+
+    def std(self):
+        # Sample standard deviation, as pandas computes it
+        return (self.m2 / (self.count - 1)) ** 0.5 if self.count > 1 else float('nan')
+
+    def to_dict(self):
+        return {"count": self.count, "mean": self.mean, "m2": self.m2,
+                "min": self.minimum, "max": self.maximum}
+
+    @classmethod
+    def from_dict(cls, state):
+        return cls(state["count"], state["mean"], state["m2"], state["min"], state["max"])
+
+
+class TDigest:
+    """
+    Merging t-digest for quantiles. While a column has at most `exact_values`
+    distinct values they are all kept with their counts, and quantiles are
+    exact (interpolated like pandas' quantile). Past that, values are grouped
+    into centroids that are small near the tails and at most
+    ~pi / compression of the rank wide in the middle, and quantiles are
+    estimates interpolated between centroid centers: off by a small fraction of
+    the rank (well under 1% in the middle), not necessarily one of the values.
+    """
+
+    def __init__(self, compression=DIGEST_COMPRESSION, means=None, weights=None, exact=True,
+                 exact_values=DIGEST_EXACT_VALUES):
+        self.compression = compression
+        self.exact_values = exact_values
+        self.means = np.asarray(means if means is not None else [], dtype=np.float64)
+        self.weights = np.asarray(weights if weights is not None else [], dtype=np.float64)
+        self.exact = exact  # Points are still the distinct values themselves
+
+    def update(self, values):
+        if len(values):
+            self._compress(values, np.ones(len(values)), True)
+
+    def merge(self, other):
+        if len(other.means):
+            self._compress(other.means, other.weights, other.exact)
+
+    def _compress(self, means, weights, exact):
+        means = np.concatenate([self.means, means])
+        weights = np.concatenate([self.weights, weights])
+        self.exact = self.exact and exact
+        if self.exact:
+            # Equal values become one point, counted by its weight
+            means, inverse = np.unique(means, return_inverse=True)
+            weights = np.bincount(inverse, weights=weights)
+            if len(means) <= self.exact_values:
+                self.means, self.weights = means, weights
+                return
+            self.exact = False
+        else:
+            order = np.argsort(means, kind='stable')
+            means, weights = means[order], weights[order]
+        if len(means) <= self.compression:
+            self.means, self.weights = means, weights
+            return
+
+        # Group consecutive points by the integer part of the k1 scale at their
+        # rank, so each centroid spans less than one unit of k
+        cumulative = np.cumsum(weights)
+        total = cumulative[-1]
+        q = (cumulative - weights / 2) / total
+        k = np.floor(self.compression / (2 * np.pi) * np.arcsin(2 * q - 1))
+        starts = np.flatnonzero(np.r_[True, k[1:] != k[:-1]])
+
+        self.weights = np.add.reduceat(weights, starts)
+        self.means = np.add.reduceat(means * weights, starts) / self.weights
+
+    def quantile(self, q, minimum, maximum):
+        if not len(self.means):
+            return float('nan')
+        cumulative = np.cumsum(self.weights)
+        total = cumulative[-1]
+        if self.exact:
+            # The values at the ranks around q * (count - 1), as pandas' linear interpolation
+            rank = q * (total - 1)
+            lower, upper = self.means[np.searchsorted(cumulative, [np.floor(rank), np.ceil(rank)], side='right')]
+            return float(lower + (rank - np.floor(rank)) * (upper - lower))
+        centers = cumulative - self.weights / 2
+        # The exact extremes pin both ends
+        positions = np.r_[0.0, centers, total]
+        values = np.r_[minimum, self.means, maximum]
+        return float(np.interp(q * total, positions, values))
+
+    def to_dict(self):
+        return {"compression": self.compression, "means": self.means.tolist(), "weights": self.weights.tolist(),
+                "exact": self.exact, "exact_values": self.exact_values}
+
+    @classmethod
+    def from_dict(cls, state):
+        # States saved before exact digests are read as estimates
+        return cls(state["compression"], state["means"], state["weights"], state.get("exact", False),
+                   state.get("exact_values", DIGEST_EXACT_VALUES))
+
+
+class HyperLogLog:
+    """
+    Distinct count estimate from 64-bit value hashes.
+    """
+
+    def __init__(self, precision=HLL_PRECISION, registers=None):
+        self.precision = precision
+        self.registers = registers if registers is not None else np.zeros(1 << precision, dtype=np.uint8)
+
+    def update(self, hashes):
+        if not len(hashes):
+            return
+        rest_bits = 64 - self.precision
+        buckets = (hashes >> np.uint64(rest_bits)).astype(np.intp)
+        rest = hashes & np.uint64((1 << rest_bits) - 1)
+        # Position of the first set bit in the remaining bits; exact in float64 as rest < 2 ** 53
+        _, bit_length = np.frexp(rest.astype(np.float64))
+        ranks = (rest_bits - bit_length + 1).astype(np.uint8)
+        np.maximum.at(self.registers, buckets, ranks)
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def estimate(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting is more accurate for small cardinalities
+            estimate = m * np.log(m / zeros)
+        return int(round(estimate))
+
+    def to_dict(self):
+        return {"precision": self.precision, "registers": base64.b64encode(self.registers.tobytes()).decode()}
+
+    @classmethod
+    def from_dict(cls, state):
+        registers = np.frombuffer(base64.b64decode(state["registers"]), dtype=np.uint8).copy()
+        return cls(state["precision"], registers)
+
+
+class HeavyHitters:
+    """
+    Space-saving summary of the most frequent values. Counts of tracked values
+    are upper bounds, off by at most `floor`, which also bounds the count of any
+    untracked value. While floor is 0 the summary holds every distinct value
+    with its exact count. `total` counts every value summarized (nulls aside).
+    """
+
+    def __init__(self, capacity=HEAVY_HITTERS, counts=None, floor=0, total=0):
+        self.capacity = capacity
+        self.counts = counts if counts is not None else {}
+        self.floor = floor
+        self.total = total
+
+    def update(self, value_counts):
+        # `value_counts` is a chunk's pd.Series.value_counts(), most frequent first
+        floor = int(value_counts.iloc[self.capacity]) if len(value_counts) > self.capacity else 0
+        top = value_counts.iloc[:self.capacity]
+        self.merge(HeavyHitters(
+            self.capacity, dict(zip(plain_values(top.index), top.tolist())), floor, int(value_counts.sum())
+        ))
+
+    def merge(self, other):
+        counts = {
+            value: self.counts.get(value, self.floor) + other.counts.get(value, other.floor)
+            for value in {**self.counts, **other.counts}
+        }
+        self.floor += other.floor
+        if self.total is not None:
+            self.total = None if other.total is None else self.total + other.total
+        if len(counts) > self.capacity:
+            ranked = sorted(counts.items(), key=lambda item: item[1], reverse=True)
+            self.floor = max(self.floor, ranked[self.capacity][1])
+            counts = dict(ranked[:self.capacity])
+        self.counts = counts
+
+    def exact(self):
+        return self.floor == 0
+
+    def top(self):
+        if not self.counts:
+            return None, 0
+        value = max(self.counts, key=self.counts.get)
+        return value, self.counts[value]
+
+    def to_dict(self):
+        return {"capacity": self.capacity, "counts": list(self.counts.items()), "floor": self.floor,
+                "total": self.total}
+
+    @classmethod
+    def from_dict(cls, state):
+        # The total is unknown (None) in states saved before it was counted
+        return cls(state["capacity"], {value: count for value, count in state["counts"]}, state["floor"],
+                   state.get("total"))
+
+
+def plain_values(index):
+    # JSON-safe values, dates written like the JSON responses write them
+    if pd.api.types.is_datetime64_any_dtype(index):
+        return [value.isoformat() for value in index]
+    return index.tolist()
+
+
+def value_hashes(index):
+    # 64-bit hashes of distinct values, equal for equal values whatever the dtype width
+    if isinstance(index.dtype, pd.CategoricalDtype):
+        index = index.astype(index.categories.dtype)
+    if pd.api.types.is_datetime64_any_dtype(index):
+        return pd.util.hash_array(index.to_numpy(dtype='datetime64[ns]').view(np.int64))
+    if pd.api.types.is_bool_dtype(index):
+        return pd.util.hash_array(index.to_numpy(dtype=np.uint8))
+    if pd.api.types.is_numeric_dtype(index):
+        return pd.util.hash_array(index.to_numpy(dtype=np.float64))
+    return pd.util.hash_array(index.to_numpy(dtype=object))
@@ -0,0 +1,230 @@
+import hashlib
+import json
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+from AVD.files import atomic_write
+from file_upload.columnar import file_version, iter_dataset, load_schema, read_shape
+from .sketches import HeavyHitters, HyperLogLog, Moments, TDigest, value_hashes
+
+# Bytes at each end of the data file fingerprinting the processed rows
+FINGERPRINT_BYTES = 64 * 1024
+
+ACCUMULATORS = {
+    'moments': Moments,
+    'digest': TDigest,
+    'distinct': HyperLogLog,
+    'heavy_hitters': HeavyHitters,
+}
+
+# The sketching kernels (sorting, hashing, reductions) run in NumPy and pandas
+# with the GIL released, so threads use several cores without copying chunks
+STATS_WORKERS = getattr(settings, 'STATS_WORKERS', 4)
+stats_executor = ThreadPoolExecutor(max_workers=STATS_WORKERS, thread_name_prefix='stats')
+
+
+# Column statistics are computed by one pass over the dataset in chunks of
+# STATS_CHUNK_ROWS rows, each summarized by mergeable accumulators (see
+# sketches.py) on stats_executor and merged in order. Memory is bounded by a
+# few chunks in flight, whatever the file size. Numeric columns get moments
+# and a t-digest, the others a HyperLogLog and a heavy-hitter summary.
+#
+# Accumulators are saved as "<random_name>.stats.json", per column, along with
+# the number of rows processed and a fingerprint of the file's first and last
+# bytes at that point. When the file has since grown and still starts with the
+# fingerprinted bytes, only the appended rows are processed.
+def statistics_path(file_path):
+    return f"{file_path}.stats.json"
+
+
+def column_kind(dtype):
+    # From a schema dtype (see file_upload/schema.py)
+    if dtype.startswith(('int', 'float')):
+        return 'number'
+    if dtype in ('bool', 'datetime'):
+        return dtype
+    return 'text'
+
+
+def new_accumulators(kind):
+    if kind == 'number':
+        return {'moments': Moments(), 'digest': TDigest()}
+    return {'distinct': HyperLogLog(), 'heavy_hitters': HeavyHitters()}
+
+
+def sketch_chunk(df, kinds):
+    sketches = {}
+    for column, kind in kinds.items():
+        accumulators = new_accumulators(kind)
+        series = df[column]
+        if kind == 'number':
+            values = series.to_numpy(dtype=np.float64, na_value=np.nan)
+            values = values[~np.isnan(values)]
+            accumulators['moments'].update(values)
+            accumulators['digest'].update(values)
+        else:
+            counts = series.value_counts()
+            counts = counts[counts > 0]  # unused categories
+            # Duplicates don't change a HyperLogLog, so only distinct values are hashed
+            accumulators['distinct'].update(value_hashes(counts.index))
+            accumulators['heavy_hitters'].update(counts)
+        sketches[column] = accumulators
+    return sketches
+
+
+def _bounded_map(function, items, limit):
+    # Like executor.map, but only reads `limit` items ahead, so chunks aren't all loaded at once
+    pending = deque()
+    for item in items:
+        pending.append(stats_executor.submit(function, item))
+        if len(pending) >= limit:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def scan(file_path, kinds, start=0):
+    # Accumulators of the `kinds` columns over the rows from `start` on
+    merged = {column: new_accumulators(kind) for column, kind in kinds.items()}
+    if not kinds:
+        return merged
+
+    chunks = iter_dataset(file_path, list(kinds), getattr(settings, 'STATS_CHUNK_ROWS', 256 * 1024), start)
+    for sketches in _bounded_map(lambda df: sketch_chunk(df, kinds), chunks, 2 * STATS_WORKERS):
+        for column, accumulators in sketches.items():
+            for name, accumulator in accumulators.items():
+                merged[column][name].merge(accumulator)
+    return merged
+
+
+def fingerprint(file_path, size):
+    with open(file_path, 'rb') as f:
+        head = f.read(min(size, FINGERPRINT_BYTES))
+        f.seek(max(0, size - FINGERPRINT_BYTES))
+        tail = f.read(size - f.tell())
+    return hashlib.sha256(head + tail).hexdigest(), tail.endswith(b'\n')
+
+
+def _read_state(file_path):
+    path = statistics_path(file_path)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as stats_file:
+        return json.load(stats_file)
+
+
+def _write_state(file_path, state):
+    with atomic_write(statistics_path(file_path)) as tmp_path:
+        with open(tmp_path, 'w') as stats_file:
+            json.dump(state, stats_file)
+
+
+def _appended_rows(file_path, state, size):
+    # Rows already processed when the file only had rows appended since, else None
+    if size <= state["source_size"]:
+        return None
+    digest, ends_with_newline = fingerprint(file_path, state["source_size"])
+    if digest != state["fingerprint"] or not ends_with_newline:
+        return None
+    return state["rows"]
+
+
+def load_statistics(file_path, columns):
+    """
+    Accumulators of each of `columns`, bringing the saved state up to date:
+    nothing is read when it matches the file, only the new rows when rows were
+    appended, and columns missing from the state are read in full.
+    """
+    version = file_version(file_path)
+    kinds = {column: column_kind(dtype) for column, dtype in load_schema(file_path)["dtypes"].items()}
+    rows = read_shape(file_path)[0]
+
+    state = _read_state(file_path)
+    saved, processed = {}, 0
+    if state is not None:
+        if state["source_version"] == list(version):
+            processed = state["rows"]
+        else:
+            processed = _appended_rows(file_path, state, version[1]) or 0
+    if processed:
+        saved = {
+            column: {name: ACCUMULATORS[name].from_dict(value) for name, value in entry["accumulators"].items()}
+            for column, entry in state["columns"].items()
+            # A column whose type changed with the new rows is processed again
+            if kinds.get(column) == entry["kind"]
+        }
+
+    if saved and processed < rows:
+        appended = scan(file_path, {column: kinds[column] for column in saved}, processed)
+        for column, accumulators in appended.items():
+            for name, accumulator in accumulators.items():
+                saved[column][name].merge(accumulator)
+
+    missing = {column: kinds[column] for column in columns if column not in saved}
+    saved.update(scan(file_path, missing))
+
+    if processed < rows or missing:
+        _write_state(file_path, {
+            "source_version": list(version),
+            "source_size": version[1],
+            "rows": rows,
+            "fingerprint": fingerprint(file_path, version[1])[0],
+            "columns": {
+                column: {
+                    "kind": kinds[column],
+                    "accumulators": {name: accumulator.to_dict() for name, accumulator in accumulators.items()},
+                }
+                for column, accumulators in saved.items()
+            },
+        })
+    return {column: saved[column] for column in columns}
+
+
+def summarize(accumulators):
+    """
+    The statistics column_statistics reports, from a column's accumulators.
+    The median is exact up to DIGEST_EXACT_VALUES distinct values and a
+    t-digest estimate past that (see sketches.py). unique and freq are exact
+    up to HEAVY_HITTERS distinct values; past that unique is a HyperLogLog
+    estimate (about 0.8% off, never above the number of values) and freq an
+    upper bound.
+    """
+    if 'moments' in accumulators:
+        moments, digest = accumulators['moments'], accumulators['digest']
+        if not moments.count:
+            nan = float('nan')
+            return {"mean": nan, "median": nan, "std_dev": nan, "min": nan, "max": nan, "count": 0}
+        return {
+            "mean": moments.mean,
+            "median": digest.quantile(0.5, moments.minimum, moments.maximum),
+            "std_dev": moments.std(),
+            "min": moments.minimum,
+            "max": moments.maximum,
+            "count": moments.count,
+        }
+
+    heavy_hitters = accumulators['heavy_hitters']
+    top, freq = heavy_hitters.top()
+    if heavy_hitters.exact():
+        # Every distinct value fits in the heavy-hitter summary
+        unique = len(heavy_hitters.counts)
+    else:
+        unique = accumulators['distinct'].estimate()
+        if heavy_hitters.total is not None:
+            unique = min(unique, heavy_hitters.total)
+    return {
+        "unique": unique,
+        "top": top,
+        "freq": freq,
+    }
+
+
+def remove_statistics(file_path):
+    path = statistics_path(file_path)
+    if os.path.exists(path):
+        os.remove(path)
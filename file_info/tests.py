@@ -1,3 +1,463 @@
-from django.test import TestCase
+import io
+import json
+import os
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+from django.test import SimpleTestCase, override_settings
+from django.utils import timezone
+from file_upload import async_views as upload_async_views, urls as upload_urls
+
+from AVD import jobs
+from file_upload.models import Job, UserFile
+from file_upload.tests import AsyncViewTestCase, UploadDirTestCase, async_urlpatterns
+from . import async_views, batch, urls
+from .sketches import HeavyHitters, HyperLogLog, Moments, TDigest, value_hashes
+from .statistics import new_accumulators, sketch_chunk, summarize
+
+
+# Served in place of the project's URLs by AsyncViewTests; uploads go through the sync view
+urlpatterns = async_urlpatterns("file/", urls, async_views)
+
+
+class FileInfoTestCase(UploadDirTestCase):
+    def setUp(self):
+        super().setUp()
+        response = self.upload(self.CSV.encode())
+        self.assertEqual(response.status_code, 200)
+        self.file_name = response.json()["random_name"]
+
+    def post(self, endpoint, **fields):
+        return self.client.post(f"/file/{endpoint}/", {"token": "token", "file_name": self.file_name, **fields})
+
+
+@override_settings(ROW_INDEX_STRIDE=2)
+class RowSeekTests(FileInfoTestCase):
+    CSV = "a,b\n" + "".join(f"{i},v{i}\n" for i in range(7))
+
+    def get_row(self, number):
+        return self.post("get_rows_or_columns", number=number, is_column="false")
+
+    def test_single_rows(self):
+        for number, row in [(0, 0), (3, 3), (6, 6), (-1, 6), (-7, 0), (-4, 3)]:
+            with self.subTest(number=number):
+                response = self.get_row(number)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json(), {str(row): {"a": row, "b": f"v{row}"}})
+
+    def test_out_of_range_rows(self):
+        for number in [7, 100, -8]:
+            with self.subTest(number=number):
+                self.assertEqual(self.get_row(number).status_code, 400)
+
+    def test_row_ranges(self):
+        for number, range_end, expected in [(1, 4, [1, 2, 3]), (-3, -1, [4, 5]), (5, 100, [5, 6]), (4, 2, [])]:
+            with self.subTest(number=number, range_end=range_end):
+                response = self.post("get_rows_or_columns", number=number, range_end=range_end, is_column="false")
+                self.assertEqual(response.status_code, 200)
+                rows = response.json()[f"rows_{number}_to_{range_end}"]
+                self.assertEqual([row["a"] for row in rows], expected)
+
+    def test_streamed_rows(self):
+        response = self.post("get_rows_or_columns", number=-2, range_end=7, is_column="false",
+                             response_format="ndjson")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)["a"] for line in lines], [5, 6])
+
+
+class ParsedTextTests(FileInfoTestCase):
+    # Columns pyarrow would type differently from pandas; rows are read with the schema
+    CSV = (
+        "hex,big,time,when\n"
+        "0x10,12345678901234567890,12:00,2024-01-02T03:04:05\n"
+        "0x1f,22345678901234567890,13:30:00,2024-01-03T03:04:05.5\n"
+    )
+
+    def test_rows_keep_the_text(self):
+        response = self.post("get_rows_or_columns", number=0, range_end=2, is_column="false")
+        self.assertEqual(response.status_code, 200)
+        rows = response.json()["rows_0_to_2"]
+        self.assertEqual([row["hex"] for row in rows], ["0x10", "0x1f"])
+        self.assertEqual([row["time"] for row in rows], ["12:00", "13:30:00"])
+        self.assertEqual(rows[0]["big"], "12345678901234567890")  # Beyond uint64, text as with the pandas parse
+
+
+class BatchTests(FileInfoTestCase):
+    CSV = "a,b,c\n" + "".join(f"{i},{i * 0.5},{'xy'[i % 2]}\n" for i in range(20))
+    ODD = {"column": "c", "op": "eq", "value": "y"}
+
+    def batch(self, operations):
+        return self.post("batch", operations=json.dumps(operations))
+
+    def test_results_match_endpoints(self):
+        requests = [
+            ("shape", {}, {"op": "shape"}),
+            ("head", {}, {"op": "head"}),
+            ("describe", {}, {"op": "describe"}),
+            ("get_rows_or_columns", {"number": 1, "is_column": "true"},
+             {"op": "get_rows_or_columns", "number": 1, "is_column": True}),
+            ("get_rows_or_columns",
+             {"number": 0, "range_end": 2, "is_column": "true", "filter_data": json.dumps(self.ODD)},
+             {"op": "get_rows_or_columns", "number": 0, "range_end": 2, "is_column": True, "filter_data": self.ODD}),
+            ("get_rows_or_columns", {"number": 2, "range_end": 5, "is_column": "false"},
+             {"op": "get_rows_or_columns", "number": 2, "range_end": 5}),
+            ("column_stats", {"number": 2, "is_column": "true"}, {"op": "column_stats", "number": 2, "is_column": True}),
+        ]
+        response = self.batch([operation for _, _, operation in requests])
+        self.assertEqual(response.status_code, 200)
+        results = response.json()["results"]
+        self.assertEqual(len(results), len(requests))
+        for (endpoint, fields, operation), result in zip(requests, results):
+            with self.subTest(operation=operation):
+                self.assertEqual(result["op"], operation["op"])
+                self.assertEqual(result["status"], 200)
+                self.assertEqual(result["result"], self.post(endpoint, **fields).json())
+
+    def test_failures_stay_with_their_operation(self):
+        response = self.batch([
+            {"op": "shape"},
+            {"op": "unknown"},
+            "shape",
+            {"op": "column_stats"},
+            {"op": "get_rows_or_columns", "number": 50},
+            {"op": "get_rows_or_columns", "number": 0, "is_column": True,
+             "filter_data": {"column": "missing", "op": "is_null"}},
+            {"op": "columns"},
+        ])
+        self.assertEqual(response.status_code, 200)
+        results = response.json()["results"]
+        self.assertEqual([result["status"] for result in results], [200, 400, 400, 400, 400, 400, 200])
+        self.assertEqual([result["op"] for result in results][:3], ["shape", "unknown", None])
+        self.assertEqual(results[4]["error"], "Invalid row index.")
+        self.assertEqual(results[6]["result"], {"columns": ["a", "b", "c"]})
+
+        with mock.patch("file_info.batch.run_operation", side_effect=RuntimeError("boom")):
+            results = self.batch([{"op": "shape"}]).json()["results"]
+        self.assertEqual(results, [{"op": "shape", "status": 500, "error": "boom"}])
+
+    def test_column_reads_share_one_load(self):
+        operations = [
+            {"op": "get_rows_or_columns", "number": 0, "is_column": True},
+            {"op": "get_rows_or_columns", "number": 1, "range_end": 3, "is_column": True},
+            {"op": "get_rows_or_columns", "number": 0, "is_column": True, "filter_data": self.ODD},
+            {"op": "get_rows_or_columns", "number": 0, "is_column": False},
+            {"op": "column_stats", "number": 1, "is_column": True},
+        ]
+        with mock.patch("file_info.batch.load_dataset", wraps=batch.load_dataset) as shared, \
+                mock.patch("file_info.operations.load_dataset") as single, \
+                mock.patch("file_info.operations.read_dataset_rows") as rows:
+            results = self.batch(operations).json()["results"]
+        self.assertEqual([result["status"] for result in results], [200] * 5)
+        self.assertEqual(shared.call_count, 1)
+        self.assertEqual(shared.call_args.args[1], ["a", "b", "c"])
+        single.assert_not_called()
+        rows.assert_not_called()
+        self.assertEqual(results[2]["result"], {"a": list(range(1, 20, 2))})
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.post("batch", operations="[").status_code, 400)
+        self.assertEqual(self.batch({"op": "shape"}).status_code, 400)
+        with override_settings(BATCH_MAX_OPERATIONS=2):
+            self.assertEqual(self.batch([{"op": "shape"}] * 3).status_code, 400)
+        response = self.client.post("/file/batch/", {"token": "other", "file_name": self.file_name, "operations": "[]"})
+        self.assertEqual(response.status_code, 403)
+
+
+class RowSeekWithoutColumnarTests(RowSeekTests):
+    # Without the columnar copy pages are parsed from the CSV through the row index
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch("file_info.operations.ensure_columnar", return_value=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class BooleanWithBlanksTests(FileInfoTestCase):
+    # Stored as a category of booleans; pages of rows keep them booleans like the other reads
+    CSV = "a,f\n0,True\n1,\n2,False\n" + "".join(f"{i},True\n" for i in range(3, 23))
+
+    def test_rows_match_head(self):
+        head = self.post("head").json()
+        self.assertEqual([row["f"] for row in head[:3]], [True, None, False])
+
+        response = self.post("get_rows_or_columns", number=0, range_end=len(head), is_column="false")
+        self.assertEqual(response.json()[f"rows_0_to_{len(head)}"], head)
+        self.assertEqual(self.post("get_rows_or_columns", number=2, is_column="false").json(), {"2": head[2]})
+
+        response = self.post("get_rows_or_columns", number=0, range_end=len(head), is_column="false",
+                             response_format="ndjson")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], head)
+        self.assertEqual(self.post("get_rows_or_columns", number=1, is_column="true").json()["f"][:3],
+                         [True, None, False])
+
+
+class FilteredRowTests(FileInfoTestCase):
+    CSV = "a,b\n" + "".join(f"{i},{'xy'[i % 2]}\n" for i in range(10))
+    ODD = json.dumps({"column": "b", "op": "eq", "value": "y"})
+
+    def test_rows_numbered_within_matches(self):
+        response = self.post("get_rows_or_columns", number=-1, is_column="false", filter_data=self.ODD)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"9": {"a": 9, "b": "y"}})
+
+        response = self.post("get_rows_or_columns", number=1, range_end=3, is_column="false", filter_data=self.ODD)
+        self.assertEqual([row["a"] for row in response.json()["rows_1_to_3"]], [3, 5])
+
+    def test_invalid_filters_rejected(self):
+        for filter_data in ["{", '{"column": "missing", "op": "is_null"}', '{"column": "a", "op": "eq", "value": "1"}']:
+            with self.subTest(filter_data=filter_data):
+                response = self.post("get_rows_or_columns", number=0, is_column="false", filter_data=filter_data)
+                self.assertEqual(response.status_code, 400)
+
+
+class DateColumnTests(FileInfoTestCase):
+    CSV = "a,when\n1,2020-01-01T00:00:00\n2,2020-01-02T12:30:00\n3,\n"
+
+    def test_describe_is_numerical_only(self):
+        response = self.post("describe")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.json()), ["a"])
+
+    def test_dates_written_alike_by_every_endpoint(self):
+        head = self.post("head").json()
+        row = self.post("get_rows_or_columns", number=1, is_column="false").json()
+        info = self.post("aggregate_info").json()
+        self.assertEqual(head[1]["when"], "2020-01-02T12:30:00")
+        self.assertEqual(row["1"]["when"], "2020-01-02T12:30:00")
+        self.assertEqual(info["head"], head)
+        self.assertIsNone(head[2]["when"])
+
+
+def sketched(values, kind, chunks=4):
+    # Accumulators of a column summarized chunk by chunk, then merged, through a JSON round trip
+    merged = new_accumulators(kind)
+    for chunk in np.array_split(values, chunks):
+        for name, accumulator in sketch_chunk(pd.DataFrame({"v": chunk}), {"v": kind})["v"].items():
+            merged[name].merge(type(accumulator).from_dict(json.loads(json.dumps(accumulator.to_dict()))))
+    return merged
+
+
+class SketchTests(SimpleTestCase):
+    QUANTILES = [0, 0.1, 0.25, 0.5, 0.9, 1]
+
+    def test_moments_match_pandas(self):
+        values = np.random.default_rng(0).normal(5, 2, 10001)
+        summary = summarize(sketched(values, "number"))
+        series = pd.Series(values)
+        self.assertAlmostEqual(summary["mean"], series.mean(), places=10)
+        self.assertAlmostEqual(summary["std_dev"], series.std(), places=10)
+        self.assertEqual((summary["min"], summary["max"], summary["count"]), (series.min(), series.max(), 10001))
+
+    def test_exact_quantiles_up_to_exact_values(self):
+        rng = np.random.default_rng(1)
+        for values in [rng.integers(0, 100, 3000), rng.normal(size=5000), np.array([1, 1, 2]), np.array([7.5])]:
+            digest = sketched(values.astype(float), "number", chunks=min(3, len(values)))["digest"]
+            self.assertTrue(digest.exact)
+            for q in self.QUANTILES:
+                with self.subTest(size=len(values), q=q):
+                    self.assertEqual(digest.quantile(q, values.min(), values.max()), np.quantile(values, q))
+
+    def test_estimated_quantiles_within_rank_error(self):
+        values = np.random.default_rng(2).lognormal(size=200000)
+        digest = TDigest(exact_values=1000)
+        for chunk in np.array_split(values, 8):
+            part = TDigest(exact_values=1000)
+            part.update(chunk)
+            digest.merge(part)
+        self.assertFalse(digest.exact)
+        self.assertLessEqual(len(digest.means), digest.compression)
+        ordered = np.sort(values)
+        for q in self.QUANTILES[1:-1] + [0.01, 0.999]:
+            with self.subTest(q=q):
+                estimate = digest.quantile(q, values.min(), values.max())
+                rank = np.searchsorted(ordered, estimate) / len(values)
+                self.assertLess(abs(rank - q), 0.005)
+
+    def test_distinct_count_estimate(self):
+        for count in [100, 3000, 50000]:
+            values = pd.Index([f"value {i}" for i in range(count)])
+            with self.subTest(count=count):
+                hll = HyperLogLog()
+                hll.update(value_hashes(values))
+                self.assertLess(abs(hll.estimate() - count) / count, 0.03)
+
+                halves = HyperLogLog()
+                for half in (values[: count // 2], values[count // 4:]):  # Overlapping halves
+                    part = HyperLogLog()
+                    part.update(value_hashes(half))
+                    halves.merge(part)
+                self.assertEqual(halves.estimate(), hll.estimate())
+
+    def test_equal_values_hash_alike_across_widths(self):
+        np.testing.assert_array_equal(
+            value_hashes(pd.Index(np.array([1, 2], dtype=np.int8))), value_hashes(pd.Index([1.0, 2.0]))
+        )
+
+    def test_unique_never_above_value_count(self):
+        # All distinct: the HyperLogLog estimate is used and may overshoot
+        for count in range(2000, 4000, 97):
+            values = np.array([f"id-{i}" for i in range(count)], dtype=object)
+            values[::10] = None
+            with self.subTest(count=count):
+                summary = summarize(sketched(values, "text"))
+                present = count - len(values[::10])
+                self.assertLessEqual(summary["unique"], present)
+                self.assertLess(abs(summary["unique"] - present) / present, 0.03)
+
+    def test_heavy_hitters_bounds(self):
+        rng = np.random.default_rng(3)
+        values = np.concatenate([np.full(5000, "common"), np.char.mod("rare %d", rng.integers(0, 20000, 50000))])
+        rng.shuffle(values)
+        hitters = sketched(values, "text", chunks=10)["heavy_hitters"]
+        self.assertFalse(hitters.exact())
+        self.assertEqual(hitters.total, len(values))
+        true_counts = pd.Series(values).value_counts()
+        top, freq = hitters.top()
+        self.assertEqual(top, "common")
+        self.assertGreaterEqual(freq, 5000)
+        self.assertLessEqual(freq, 5000 + hitters.floor)
+        for value, count in hitters.counts.items():
+            self.assertGreaterEqual(count, true_counts[value])
+
+    def test_small_text_columns_are_exact(self):
+        summary = summarize(sketched(np.array(["a", "b", "a", None], dtype=object), "text", chunks=2))
+        self.assertEqual(summary, {"unique": 2, "top": "a", "freq": 2})
+
+    def test_summaries_of_old_states(self):
+        # States saved before the exact digest and the value total still load
+        digest = TDigest.from_dict({"compression": 1000, "means": [1.0, 2.0], "weights": [1.0, 1.0]})
+        self.assertFalse(digest.exact)
+        hitters = HeavyHitters.from_dict({"capacity": 1024, "counts": [["a", 1]], "floor": 0})
+        self.assertIsNone(hitters.total)
+        self.assertEqual(Moments.from_dict(Moments().to_dict()).count, 0)
+
+
+class ColumnStatisticsTests(FileInfoTestCase):
+    CSV = "n,t\n" + "".join(f"{(i * 37) % 101},{'aabbbc'[i % 6] if i % 5 else ''}\n" for i in range(3000))
+
+    def test_match_pandas(self):
+        expected = pd.read_csv(io.StringIO(self.CSV))
+        numbers = self.post("column_stats", number=0, is_column="true").json()["column_n_statistics"]
+        self.assertEqual(numbers["median"], expected.n.median())
+        self.assertAlmostEqual(numbers["mean"], expected.n.mean(), places=10)
+        self.assertAlmostEqual(numbers["std_dev"], expected.n.std(), places=10)
+        self.assertEqual(numbers["count"], 3000)
+
+        text = self.post("column_stats", number=1, is_column="true").json()["column_t_statistics"]
+        counts = expected.t.value_counts()
+        self.assertEqual(text, {"unique": 3, "top": counts.index[0], "freq": int(counts.iloc[0])})
+
+
+class JobTests(FileInfoTestCase):
+    CSV = "a,b\n1,x\n2,y\n"
+
+    def setUp(self):
+        super().setUp()
+        # Jobs run in the test thread: workers' connections wouldn't see the test's transaction
+        jobs._job_queue = None
+        self.addCleanup(setattr, jobs, "_job_queue", None)
+        patcher = mock.patch.object(jobs.JobQueue, "_ensure_started")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_queued(self):
+        queue = jobs.get_job_queue()
+        while (claimed := queue.store.claim(0)) is not None:
+            queue._run(*claimed)
+
+    def status(self, job_id, token="token"):
+        return self.client.get(f"/file/jobs/{job_id}/", {"token": token})
+
+    def test_async_describe(self):
+        for backend in ("memory", "database"):
+            with self.subTest(backend=backend), override_settings(JOB_BACKEND=backend):
+                jobs._job_queue = None
+                response = self.post("describe", mode="async")
+                self.assertEqual(response.status_code, 202)
+                job_id = response.json()["job_id"]
+                # Identical requests share the queued job
+                self.assertEqual(self.post("describe", mode="async").json()["job_id"], job_id)
+                self.assertEqual(self.status(job_id).json()["status"], "queued")
+                self.assertEqual(self.status(job_id, token="other").status_code, 404)
+
+                self.run_queued()
+                status = self.status(job_id).json()
+                self.assertEqual((status["status"], status["progress"]), ("done", 1.0))
+                self.assertEqual(status["result"], self.post("describe").json())
+
+    def test_status_needs_token(self):
+        response = self.client.get("/file/jobs/missing/")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"error": "Missing token"})
+
+    @override_settings(JOB_BACKEND="database", JOB_TIMEOUT=60)
+    def test_timed_out_job_stops_at_next_progress_report(self):
+        steps = []
+
+        def handler(params):
+            for step in range(3):
+                steps.append(step)
+                if step == 1:
+                    Job.objects.update(started_at=timezone.now() - timedelta(seconds=120))
+                    jobs.get_job_queue().store.get(job["job_id"])  # Expires it, as a status poll would
+                jobs.report_progress(step / 3)
+            return {}
+
+        jobs.register("slow", handler)
+        self.addCleanup(jobs._handlers.pop, "slow")
+        job = jobs.get_job_queue().submit("slow", {}, "token")
+        self.run_queued()
+
+        self.assertEqual(steps, [0, 1])
+        status = self.status(job["job_id"]).json()
+        self.assertEqual(status["status"], "failed")
+        self.assertEqual(status["error"], "The job timed out or its worker stopped")
+
+
+class AsyncViewTests(AsyncViewTestCase):
+    ASYNC_URLCONF = __name__
+    CSV = "a,b,c\n" + "".join(f"{i},{i * 0.5},{'xy'[i % 2]}\n" for i in range(20))
+
+    def setUp(self):
+        super().setUp()
+        self.file_name = self.upload(self.CSV.encode()).json()["random_name"]
+
+    def fields(self, token="token", **fields):
+        return {"token": token, "file_name": self.file_name, **fields}
+
+    def test_matches_sync_views(self):
+        for endpoint in ["describe", "head", "columns", "shape", "aggregate_info", "memory"]:
+            with self.subTest(endpoint=endpoint):
+                self.assert_async_matches("post", f"/file/{endpoint}/", self.fields(), status=200)
+                self.assert_async_matches("post", f"/file/{endpoint}/", self.fields(token="other"), status=403)
+                self.assert_async_matches("get", f"/file/{endpoint}/", status=405)
+
+        for endpoint in ["get_rows_or_columns", "column_stats"]:
+            with self.subTest(endpoint=endpoint):
+                fields = self.fields(number=1, is_column="true")
+                self.assert_async_matches("post", f"/file/{endpoint}/", fields, status=200)
+                fields = self.fields(number=50, is_column="false")
+                self.assert_async_matches("post", f"/file/{endpoint}/", fields, status=400)
+                fields = self.fields(token="other", number=1, is_column="true")
+                self.assert_async_matches("post", f"/file/{endpoint}/", fields, status=403)
+
+        fields = self.fields(number=1, range_end=5, is_column="false")
+        self.assert_async_matches("post", "/file/get_rows_or_columns/", fields, status=200)
+        fields = self.fields(number=0, range_end=5, is_column="false", response_format="csv")
+        self.assertEqual(self.assert_async_matches("post", "/file/get_rows_or_columns/", fields).status_code, 200)
+        operations = json.dumps([{"op": "shape"}, {"op": "column_stats", "number": 0, "is_column": True}])
+        self.assert_async_matches("post", "/file/batch/", self.fields(operations=operations), status=200)
+        self.assert_async_matches("post", "/file/batch/", self.fields(operations="["), status=400)
+        self.assert_async_matches("get", "/file/jobs/missing/", {"token": "token"}, status=404)
+        self.assert_async_matches("get", "/file/jobs/missing/", status=400)
+
+    def test_missing_file(self):
+        os.remove(UserFile.objects.get(random_name=self.file_name).path)
+        for endpoint in ["head", "get_rows_or_columns", "batch"]:
+            with self.subTest(endpoint=endpoint):
+                self.assert_async_matches(
+                    "post", f"/file/{endpoint}/", self.fields(number=0, is_column="false", operations="[]"), status=404
+                )
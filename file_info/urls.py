@@ -1,5 +1,9 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views as sync_views
+
+# Async versions of the views are used when running under ASGI
+views = async_views if settings.ASYNC_VIEWS else sync_views
 
 urlpatterns = [
     path('describe/', views.describe_csv, name='describe_csv'),
@@ -10,4 +14,8 @@ urlpatterns = [
     path('column_stats/', views.column_statistics, name='column_statistics'),
 
     path('aggregate_info/', views.aggregate_csv_info, name='aggregate_csv_info'),
+    path('memory/', views.memory_usage, name='memory_usage'),
+    path('batch/', views.batch_operations, name='batch_operations'),
+    path('cache_stats/', views.cache_stats, name='cache_stats'),
+    path('jobs/<str:job_id>/', views.job_status, name='job_status'),
 ]
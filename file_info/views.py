@@ -1,13 +1,19 @@
-import os
 import json
-import pandas as pd
-from typing import Optional
-from django.http import JsonResponse
+import os
+from typing import Literal, Optional
+from django.conf import settings
+from django.http import StreamingHttpResponse
 from pydantic import BaseModel, ValidationError
 from django.views.decorators.csrf import csrf_exempt
-
-UPLOAD_DIR = "uploaded_files"
-USER_FILES_PATH = os.path.join(UPLOAD_DIR, "user_files.json")
+from AVD.jobs import JobQueueFull, get_job_queue, parse_job_options, public_status, submit_job
+from AVD.responses import JsonResponse
+from AVD.singleflight import single_flight
+from file_upload.models import UserFile
+from file_upload.cache import dataset_cache
+from . import operations
+from . import jobs  # registers the background job handlers
+from .batch import parse_operations, run_batch
+from .operations import OperationError
 
 
 # Pydantic models for validation
@@ -20,23 +26,40 @@ class LineColumnRequest(FileOperationRequest):
     number: int  # Line/column number
     is_column: bool  # True for column, False for line
     range_end: Optional[int] = None  # Optional end for range selection
+    filter_data: Optional[str] = None  # Optional JSON row filter, see file_upload/filters.py
+    response_format: Literal['json', 'ndjson', 'csv'] = 'json'  # ndjson/csv are streamed
 
 
 # Helper function to validate ownership and file existence
 def validate_file(token, file_name):
-    with open(USER_FILES_PATH, 'r') as user_files_file:
-        user_files = json.load(user_files_file)
-
-    if token not in user_files or file_name not in user_files[token]:
+    user_file = UserFile.objects.filter(random_name=file_name, owner_token=token).select_related('blob').first()
+    if user_file is None:
         return None, JsonResponse({'error': 'File not found or unauthorized access'}, status=403)
 
-    file_path = os.path.join(UPLOAD_DIR, file_name)
+    # The name is an alias; identical uploads share one stored file
+    file_path = user_file.path
     if not os.path.exists(file_path):
         return None, JsonResponse({'error': 'File does not exist'}, status=404)
 
     return file_path, None
 
 
+# Helper function to parse the form fields shared by the row/column endpoints
+def parse_line_column_request(request):
+    range_end = request.POST.get('range_end', '').strip()
+    range_end = int(range_end) if range_end else None
+
+    return LineColumnRequest(
+        token=request.POST['token'],
+        file_name=request.POST['file_name'],
+        number=int(request.POST['number']),
+        is_column=request.POST['is_column'].lower() == 'true',
+        range_end=range_end,
+        filter_data=request.POST.get('filter_data', '').strip() or None,
+        response_format=request.POST.get('response_format', '').strip() or 'json'
+    )
+
+
 # Endpoint 1: .describe()
 @csrf_exempt
 def describe_csv(request):
@@ -46,12 +69,17 @@ def describe_csv(request):
                 token=request.POST['token'],
                 file_name=request.POST['file_name']
             )
+            options = parse_job_options(request.POST)
             file_path, error = validate_file(data.token, data.file_name)
             if error:
                 return error
 
-            df = pd.read_csv(file_path)
-            return JsonResponse(df.describe().to_dict())
+            if options.mode == 'async':
+                params = {'token': data.token, 'file_name': data.file_name, 'operation': {'op': 'describe'}}
+                return submit_job('describe', params, data.token, options.priority)
+            return JsonResponse(operations.describe(file_path))
+        except JobQueueFull as e:
+            return JsonResponse({'error': str(e)}, status=503)
         except ValidationError as e:
             return JsonResponse({'error': e.errors()}, status=400)
         except Exception as e:
@@ -73,8 +101,7 @@ def head_csv(request):
             if error:
                 return error
 
-            df = pd.read_csv(file_path)
-            return JsonResponse(df.head(5).to_dict(orient='records'), safe=False)
+            return JsonResponse(operations.head(file_path), safe=False)
         except ValidationError as e:
             return JsonResponse({'error': e.errors()}, status=400)
         except Exception as e:
@@ -96,8 +123,7 @@ def column_names(request):
             if error:
                 return error
 
-            df = pd.read_csv(file_path)
-            return JsonResponse({'columns': df.columns.tolist()})
+            return JsonResponse(operations.columns(file_path))
         except ValidationError as e:
             return JsonResponse({'error': e.errors()}, status=400)
         except Exception as e:
@@ -119,8 +145,7 @@ def shape_csv(request):
             if error:
                 return error
 
-            df = pd.read_csv(file_path)
-            return JsonResponse({'shape': df.shape})
+            return JsonResponse(operations.shape(file_path))
         except ValidationError as e:
             return JsonResponse({'error': e.errors()}, status=400)
         except Exception as e:
@@ -134,35 +159,25 @@ def shape_csv(request):
 def get_rows_or_columns(request):
     if request.method == 'POST':
         try:
-            range_end = request.POST.get('range_end', '').strip()
-            range_end = int(range_end) if range_end else None
-            
-            data = LineColumnRequest(
-                token=request.POST['token'],
-                file_name=request.POST['file_name'],
-                number=int(request.POST['number']),
-                is_column=request.POST['is_column'].lower() == 'true',
-                range_end=range_end
-            )
+            data = parse_line_column_request(request)
             file_path, error = validate_file(data.token, data.file_name)
             if error:
                 return error
 
-            df = pd.read_csv(file_path)
-            if data.is_column:
-                if data.range_end is None:
-                    return JsonResponse({df.columns[data.number]: df.iloc[:, data.number].tolist()})
-                else:
-                    return JsonResponse({
-                        f"columns_{data.number}_to_{data.range_end}": df.iloc[:, data.number:data.range_end].to_dict()
-                    })
-            else:
-                if data.range_end is None:
-                    return JsonResponse({df.index[data.number]: df.iloc[data.number].to_dict()})
-                else:
-                    return JsonResponse({
-                        f"rows_{data.number}_to_{data.range_end}": df.iloc[data.number:data.range_end].to_dict(orient='records')
-                    })
+            if data.response_format != 'json':
+                chunks = operations.stream_rows_or_columns(
+                    file_path, data.number, data.is_column, data.range_end, data.filter_data,
+                    data.response_format, settings.STREAM_CHUNK_ROWS
+                )
+                return StreamingHttpResponse(
+                    chunks, content_type=operations.STREAM_CONTENT_TYPES[data.response_format]
+                )
+
+            return JsonResponse(operations.rows_or_columns(
+                file_path, data.number, data.is_column, data.range_end, data.filter_data
+            ))
+        except OperationError as e:
+            return JsonResponse({'error': str(e)}, status=e.status)
         except ValidationError as e:
             return JsonResponse({'error': e.errors()}, status=400)
         except Exception as e:
@@ -181,23 +196,39 @@ def aggregate_csv_info(request):
                 token=request.POST['token'],
                 file_name=request.POST['file_name']
             )
+            options = parse_job_options(request.POST)
             file_path, error = validate_file(data.token, data.file_name)
             if error:
                 return error
 
-            # Read the CSV
-            df = pd.read_csv(file_path)
+            if options.mode == 'async':
+                params = {'token': data.token, 'file_name': data.file_name, 'operation': {'op': 'aggregate_info'}}
+                return submit_job('aggregate_info', params, data.token, options.priority)
+            return JsonResponse(operations.aggregate_info(file_path))
+        except JobQueueFull as e:
+            return JsonResponse({'error': str(e)}, status=503)
+        except ValidationError as e:
+            return JsonResponse({'error': e.errors()}, status=400)
+        except Exception as e:
+            return JsonResponse({'error': str(e)}, status=500)
+
+    return JsonResponse({'error': 'Invalid request method'}, status=405)
 
 
-            # Prepare the aggregated response
-            response = {
-                "describe": df.describe().to_dict(),
-                "head": df.head(5).to_dict(orient='records'),
-                "columns": df.columns.tolist(),
-                "shape": df.shape
-            }
+# Memory each column takes loaded with its compact dtype, next to pandas' default
+@csrf_exempt
+def memory_usage(request):
+    if request.method == 'POST':
+        try:
+            data = FileOperationRequest(
+                token=request.POST['token'],
+                file_name=request.POST['file_name']
+            )
+            file_path, error = validate_file(data.token, data.file_name)
+            if error:
+                return error
 
-            return JsonResponse(response)
+            return JsonResponse(operations.memory_usage(file_path))
         except ValidationError as e:
             return JsonResponse({'error': e.errors()}, status=400)
         except Exception as e:
@@ -210,56 +241,75 @@ def aggregate_csv_info(request):
 def column_statistics(request):
     if request.method == 'POST':
         try:
-            range_end = request.POST.get('range_end', '').strip()
-            range_end = int(range_end) if range_end else None
-            
-            data = LineColumnRequest(
+            data = parse_line_column_request(request)
+
+            file_path, error = validate_file(data.token, data.file_name)
+            if error:
+                return error
+
+            return JsonResponse(operations.column_statistics(file_path, data.number, data.is_column))
+
+        except OperationError as e:
+            return JsonResponse({'error': str(e)}, status=e.status)
+        except ValidationError as e:
+            return JsonResponse({'error': e.errors()}, status=400)
+        except Exception as e:
+            return JsonResponse({'error': str(e)}, status=500)
+
+    return JsonResponse({'error': 'Invalid request method'}, status=405)
+
+
+# Run several of the operations above against one file in a single request.
+# `operations` is a JSON list like [{"op": "column_stats", "number": 2, "is_column": true}, ...]
+@csrf_exempt
+def batch_operations(request):
+    if request.method == 'POST':
+        try:
+            data = FileOperationRequest(
                 token=request.POST['token'],
-                file_name=request.POST['file_name'],
-                number=int(request.POST['number']),
-                is_column=request.POST['is_column'].lower() == 'true',
-                range_end=range_end
+                file_name=request.POST['file_name']
             )
-            
+            operations_list = parse_operations(request.POST['operations'])
             file_path, error = validate_file(data.token, data.file_name)
             if error:
                 return error
 
-            df = pd.read_csv(file_path)
-
-            # Ensure the request is for a column
-            if not data.is_column:
-                return JsonResponse({'error': 'This endpoint only handles column statistics.'}, status=400)
-
-            if data.number >= len(df.columns):
-                return JsonResponse({'error': 'Invalid column index.'}, status=400)
-
-            column_data = df.iloc[:, data.number]
-
-            # Perform statistical analysis based on column type (numerical or categorical)
-            if column_data.dtype in ['int64', 'float64']:
-                # Numerical column analysis
-                stats = {
-                    "mean": float(column_data.mean()),  # Convert to float
-                    "median": float(column_data.median()),  # Convert to float
-                    "std_dev": float(column_data.std()),  # Convert to float
-                    "min": float(column_data.min()),  # Convert to float
-                    "max": float(column_data.max()),  # Convert to float
-                    "count": int(column_data.count())  # Convert to int
-                }
-            else:
-                # Categorical column analysis
-                stats = {
-                    "unique": int(column_data.nunique()),  # Convert to int
-                    "top": column_data.mode()[0],
-                    "freq": int(column_data.value_counts().iloc[0])  # Convert to int
-                }
-
-            return JsonResponse({f"column_{df.columns[data.number]}_statistics": stats})
-
+            return JsonResponse(run_batch(file_path, data.token, data.file_name, operations_list))
+        except OperationError as e:
+            return JsonResponse({'error': str(e)}, status=e.status)
+        except json.JSONDecodeError as e:
+            return JsonResponse({'error': f'operations is not valid JSON: {e}'}, status=400)
         except ValidationError as e:
             return JsonResponse({'error': e.errors()}, status=400)
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=500)
 
     return JsonResponse({'error': 'Invalid request method'}, status=405)
+
+
+# Parsed dataset cache counters, used to tune DATASET_CACHE_MAX_BYTES
+@csrf_exempt
+def cache_stats(request):
+    if request.method == 'GET':
+        # Coalesced requests show up as "shared" calls
+        return JsonResponse({**dataset_cache.stats(), "single_flight": single_flight.stats()})
+
+    return JsonResponse({'error': 'Invalid request method'}, status=405)
+
+
+# Status of a job queued with mode=async, with its result once done
+@csrf_exempt
+def job_status(request, job_id):
+    if request.method == 'GET':
+        try:
+            job = get_job_queue().get(job_id, request.GET['token'])
+            if job is None:
+                return JsonResponse({'error': 'Job not found'}, status=404)
+
+            return JsonResponse(public_status(job))
+        except KeyError:
+            return JsonResponse({'error': 'Missing token'}, status=400)
+        except Exception as e:
+            return JsonResponse({'error': str(e)}, status=500)
+
+    return JsonResponse({'error': 'Invalid request method'}, status=405)
@@ -1,3 +1,9 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import UserFile
+
+
+@admin.register(UserFile)
+class UserFileAdmin(admin.ModelAdmin):
+    list_display = ('random_name', 'original_name', 'owner_token', 'size', 'uploaded_at')
+    search_fields = ('random_name', 'original_name', 'owner_token')
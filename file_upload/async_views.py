@@ -0,0 +1,95 @@
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from AVD.executors import ExecutorBusy, compute_executor, io_executor
+from .models import UserFile
+from . import views
+
+# Async versions of the file_upload views. Listing and metadata lookups only
+# touch the database and use the async ORM; the views that read the request
+# body and write files run their sync version in a bounded pool.
+
+
+async def run_blocking(executor, view, request, *args, **kwargs):
+    try:
+        return await executor.run(view, request, *args, **kwargs)
+    except ExecutorBusy as e:
+        return JsonResponse({'error': str(e)}, status=503)
+
+
+@csrf_exempt
+async def upload_file(request):
+    # Parsing the upload and building the derived files is CPU heavy
+    return await run_blocking(compute_executor, views.upload_file, request)
+
+
+@csrf_exempt
+async def remove_file(request):
+    return await run_blocking(io_executor, views.remove_file, request)
+
+
+@csrf_exempt
+async def retreive_files(request):
+    if request.method == 'GET':
+        try:
+            # Validate incoming data
+            token = request.GET['token']
+
+            # Look up the user's files
+            files = [user_file.to_meta() async for user_file in UserFile.objects.filter(owner_token=token).order_by('id')]
+
+            # Check if the token owns any file
+            if not files:
+                return JsonResponse({'error': 'User not found'}, status=403)
+
+            return JsonResponse({'files': files})
+
+        except KeyError:
+            return JsonResponse({'error': 'Missing token'}, status=400)
+        except Exception as e:
+            return JsonResponse({'error': str(e)}, status=500)
+
+    return JsonResponse({'error': 'Invalid request method'}, status=405)
+
+
+@csrf_exempt
+async def get_file_info(request):
+    if request.method == 'GET':
+        try:
+            # Validate incoming data
+            token = request.GET['token']
+            file_name = request.GET['file_name']
+
+            # Check that the token owns the file
+            user_file = await UserFile.objects.filter(owner_token=token, random_name=file_name).afirst()
+            if user_file is None:
+                return JsonResponse({'error': 'File not found or unauthorized access'}, status=403)
+
+            return JsonResponse({'file_info': user_file.to_meta()})
+
+        except KeyError:
+            return JsonResponse({'error': 'Missing token or file_name'}, status=400)
+        except Exception as e:
+            return JsonResponse({'error': str(e)}, status=500)
+
+    return JsonResponse({'error': 'Invalid request method'}, status=405)
+
+
+@csrf_exempt
+async def create_upload_session(request):
+    return await run_blocking(io_executor, views.create_upload_session, request)
+
+
+@csrf_exempt
+async def upload_session_status(request, session_id):
+    return await run_blocking(io_executor, views.upload_session_status, request, session_id)
+
+
+@csrf_exempt
+async def upload_chunk(request, session_id, index):
+    return await run_blocking(io_executor, views.upload_chunk, request, session_id, index)
+
+
+@csrf_exempt
+async def complete_upload_session(request, session_id):
+    # Assembling and building the derived files is CPU heavy
+    return await run_blocking(compute_executor, views.complete_upload_session, request, session_id)
@@ -0,0 +1,38 @@
+import os
+
+from django.db.models import F
+
+from .models import BLOB_DIR, Blob
+
+# Uploads are stored once per content, as uploaded_files/blobs/<sha256>, with
+# their derived files (columnar copy, profile, row index...) next to them, so
+# identical uploads share them too. Each upload's UserFile row points at its
+# blob and the blob counts those references; the file is removed with the last one.
+#
+# Both functions must run inside a transaction: the blob row is locked while
+# its file is created or removed, so an upload can't reference a blob that a
+# concurrent removal is deleting.
+
+
+def acquire_blob(temp_path, sha256, size):
+    """
+    Reference the blob of an upload whose content was written to `temp_path`.
+    The file becomes the blob when there is none yet, otherwise it is dropped.
+    Returns the blob and whether its file was just stored.
+    """
+    blob, _ = Blob.objects.select_for_update().get_or_create(sha256=sha256, defaults={'size': size})
+    stored = not os.path.exists(blob.path)
+    if stored:
+        os.makedirs(BLOB_DIR, exist_ok=True)
+        os.replace(temp_path, blob.path)
+    else:
+        os.remove(temp_path)
+
+    Blob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+    return blob, stored
+
+
+def release_blob(blob):
+    # Drop one reference; True when it was the last one and the blob row was deleted
+    Blob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') - 1)
+    return Blob.objects.filter(pk=blob.pk, ref_count__lte=0).delete()[0] > 0
@@ -0,0 +1,92 @@
+import os
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from AVD.singleflight import single_flight
+
+from .columnar import file_version, read_dataset
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+# Process-wide LRU cache of parsed datasets, bounded by their in-memory size.
+# Entries are keyed by the stored file name and the projected columns, and
+# tagged with the file's mtime/size so a rewritten file is never served stale.
+# Cached DataFrames are shared between requests and must not be mutated.
+class DatasetCache:
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # (file_name, columns) -> (version, df, nbytes)
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, file_path, columns=None):
+        columns = list(dict.fromkeys(columns)) if columns else None
+        key = (os.path.basename(file_path), tuple(columns) if columns else None)
+        version = file_version(file_path)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        # Parse outside the lock so other datasets stay available meanwhile;
+        # concurrent misses for the same entry share one parse
+        df = single_flight.do(('dataset', key, version), read_dataset, file_path, columns)
+        nbytes = int(df.memory_usage(deep=True).sum())
+
+        with self._lock:
+            self._discard(key)
+            if nbytes <= self.max_bytes:
+                self._entries[key] = (version, df, nbytes)
+                self._bytes += nbytes
+                self._evict()
+        return df
+
+    def invalidate(self, file_name):
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == file_name]:
+                self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        # Aggregate counters only: the endpoint is public and file names are content digests
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._entries:
+            _, (_, _, nbytes) = self._entries.popitem(last=False)
+            self._bytes -= nbytes
+            self.evictions += 1
+
+
+dataset_cache = DatasetCache(getattr(settings, 'DATASET_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES))
+
+
+def load_dataset(file_path, columns=None):
+    return dataset_cache.get(file_path, columns)
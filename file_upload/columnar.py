@@ -0,0 +1,187 @@
+import os
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+except ImportError:  # pyarrow is optional, datasets are then read from the CSV
+    pa = None
+
+from AVD.files import atomic_write
+from AVD.singleflight import single_flight
+from .compression import open_data
+from .parsing import parse_csv
+from .schema import csv_read_options, infer_schema, read_schema, schema_path, write_schema
+
+# Columnar copies of uploaded CSVs live next to them as "<random_name>.arrow".
+# They are uncompressed Arrow IPC files holding a single record batch, opened
+# through a memory map: columns are read straight from the OS page cache, and
+# numeric columns become pandas/NumPy views on the mapped pages, so gunicorn
+# workers serving the same dataset share one physical copy.
+# Sidecars are produced at upload and rebuilt lazily whenever the CSV is newer,
+# so files uploaded before the sidecar existed are converted on first use.
+# They are written with the compact dtypes of the dataset's schema (see
+# schema.py), which is inferred in the same pass. Concurrent requests for a
+# file being converted wait for that one conversion (see AVD/singleflight.py).
+# Stored files may be compressed; the CSV is read through open_data (see compression.py).
+
+# Superseded Parquet sidecars, removed along with the file
+LEGACY_SUFFIXES = (".parquet",)
+
+# Source versions that failed to convert, so we don't retry on every request
+_unconvertible = set()
+
+
+def file_version(file_path):
+    stat = os.stat(file_path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def columnar_path(file_path):
+    return f"{file_path}.arrow"
+
+
+def build_schema(file_path):
+    # Inferred from pandas' default types for the whole file, parsed in parallel (see parsing.py)
+    with open_data(file_path) as f:
+        schema, df = infer_schema(parse_csv(f), file_version(file_path))
+    write_schema(file_path, schema)
+    return schema, df
+
+
+def load_schema(file_path):
+    # Written along with the columnar sidecar, or on its own without pyarrow
+    ensure_columnar(file_path)
+    schema = read_schema(file_path)
+    if schema is None or schema["source_version"] != list(file_version(file_path)):
+        schema, _ = single_flight.do(('schema', file_path, file_version(file_path)), build_schema, file_path)
+    return schema
+
+
+def write_columnar(file_path):
+    _, df = build_schema(file_path)
+    table = pa.Table.from_pandas(df, preserve_index=False).combine_chunks()
+
+    path = columnar_path(file_path)
+    with atomic_write(path) as tmp_path:
+        with pa.OSFile(tmp_path, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+    return path
+
+
+def ensure_columnar(file_path):
+    if pa is None:
+        return None
+
+    path = columnar_path(file_path)
+    source = os.stat(file_path)
+    if os.path.exists(path) and os.stat(path).st_mtime_ns >= source.st_mtime_ns \
+            and os.path.exists(schema_path(file_path)):
+        return path
+
+    version = (file_path, source.st_mtime_ns, source.st_size)
+    if version in _unconvertible:
+        return None
+    try:
+        return single_flight.do(('columnar',) + version, write_columnar, file_path)
+    except (pa.ArrowException, ValueError, TypeError):
+        _unconvertible.add(version)
+        return None
+
+
+def remove_columnar(file_path):
+    for path in [columnar_path(file_path)] + [f"{file_path}{suffix}" for suffix in LEGACY_SUFFIXES]:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def open_table(path):
+    # Zero-copy: the table's buffers point into the memory map
+    return pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+
+
+def read_dataset(file_path, columns=None):
+    path = ensure_columnar(file_path)
+    if path is None:
+        schema = load_schema(file_path)
+        with open_data(file_path) as f:
+            df = parse_csv(f, columns, schema)
+        return df[columns] if columns else df
+
+    table = open_table(path)
+    if columns:
+        table = table.select(columns)
+    # split_blocks keeps each column in its own block, so numeric columns
+    # without nulls stay views on the mapped file instead of being copied
+    return table.to_pandas(split_blocks=True)
+
+
+def read_dataset_rows(file_path, positions, columns=None):
+    # Rows at the given positions, indexed by those positions. From the memory map
+    # only the pages holding these rows are touched.
+    path = ensure_columnar(file_path)
+    if path is None:
+        df = read_dataset(file_path, columns).iloc[positions]
+    else:
+        table = open_table(path)
+        if columns:
+            table = table.select(columns)
+        df = table.take(positions).to_pandas(split_blocks=True)
+    df.index = pd.Index(positions)
+    return df
+
+
+def read_dataset_slice(file_path, start, stop, columns=None):
+    path = ensure_columnar(file_path)
+    if path is None:
+        return read_dataset(file_path, columns).iloc[start:stop]
+
+    table = open_table(path)
+    if columns:
+        table = table.select(columns)
+    return table.slice(start, stop - start).to_pandas(split_blocks=True)
+
+
+def iter_dataset(file_path, columns=None, chunk_rows=10000, start=0):
+    # The dataset from row `start` on, in DataFrames of at most `chunk_rows` rows
+    path = ensure_columnar(file_path)
+    if path is None:
+        options = csv_read_options(load_schema(file_path), columns)
+        skiprows = range(1, start + 1) if start else None
+        with open_data(file_path) as f:
+            for df in pd.read_csv(f, usecols=columns, chunksize=chunk_rows, skiprows=skiprows, **options):
+                yield df[columns] if columns else df
+        return
+
+    table = open_table(path)
+    if columns:
+        table = table.select(columns)
+    if start:
+        table = table.slice(start)
+    row = start
+    for batch in table.to_batches(max_chunksize=chunk_rows):
+        df = batch.to_pandas(split_blocks=True)
+        df.index = pd.RangeIndex(row, row + len(df))
+        row += len(df)
+        yield df
+
+
+def read_column_names(file_path):
+    path = ensure_columnar(file_path)
+    if path is None:
+        with open_data(file_path) as f:
+            return pd.read_csv(f, nrows=0).columns.tolist()
+
+    # Answered from the schema in the IPC footer
+    return pa.ipc.open_file(pa.memory_map(path, 'r')).schema.names
+
+
+def read_shape(file_path):
+    path = ensure_columnar(file_path)
+    if path is None:
+        with open_data(file_path) as f:
+            return parse_csv(f).shape
+
+    table = open_table(path)
+    return (table.num_rows, table.num_columns)
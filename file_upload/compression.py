@@ -0,0 +1,278 @@
+import bz2
+import io
+import os
+import struct
+import zlib
+from bisect import bisect_right
+
+import numpy as np
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from AVD.files import atomic_write
+
+try:
+    import zstandard
+except ImportError:  # zstandard is optional, gzip is used at rest and zstd uploads are refused
+    zstandard = None
+
+CODEC_MAGICS = {
+    'gzip': b'\x1f\x8b',
+    'bz2': b'BZh',
+    'zstd': b'\x28\xb5\x2f\xfd',
+}
+
+# Largest piece of decompressed upload held in memory at once; a small upload
+# can decompress to far more than MAX_UPLOAD_SIZE
+OUTPUT_SIZE = 1024 * 1024
+
+# Uncompressed bytes per frame of a stored file
+FRAME_SIZE = 256 * 1024
+ZSTD_LEVEL = 3
+GZIP_LEVEL = 1
+STORAGE_CODECS = ('zstd', 'gzip')
+
+# Seek table of the zstd seekable format: a skippable frame listing the
+# compressed and decompressed size of every frame, ending with a footer
+SKIPPABLE_MAGIC = 0x184D2A5E
+SEEKABLE_MAGIC = 0x8F92EAB1
+SKIPPABLE_HEADER = struct.Struct('<II')
+SEEK_TABLE_FOOTER = struct.Struct('<IBI')
+
+
+class CompressionError(Exception):
+    pass
+
+
+# Uploads may be sent compressed with gzip, bz2 or zstd (recognised by their
+# first bytes) and are decompressed as they stream in: stored files, sizes and
+# digests are always those of the CSV itself.
+def detect_codec(head):
+    for codec, magic in CODEC_MAGICS.items():
+        if head.startswith(magic):
+            return codec
+    return None
+
+
+class StreamDecompressor:
+    """
+    Decompresses a stream fed in pieces, including concatenated gzip members,
+    bz2 streams and zstd frames. The output goes to `write` in pieces of at
+    most OUTPUT_SIZE bytes as it's produced, however much a piece of input
+    expands to, so `write` can enforce a size limit by raising.
+    """
+
+    def __init__(self, codec, write):
+        if codec == 'zstd' and zstandard is None:
+            raise CompressionError("zstd-compressed uploads need the zstandard package")
+        self.codec = codec
+        self._write = write
+        self._decompressor = self._new()
+        self._pending = False  # The current member has started
+
+    def _new(self):
+        if self.codec == 'gzip':
+            return zlib.decompressobj(wbits=31)
+        if self.codec == 'bz2':
+            return bz2.BZ2Decompressor()
+        # The writer passes its output on whenever its buffer fills, across frames
+        return zstandard.ZstdDecompressor().stream_writer(_Sink(self._write), write_size=OUTPUT_SIZE)
+
+    def decompress(self, data):
+        if self.codec == 'zstd':
+            self._pending = self._pending or bool(data)
+            try:
+                self._decompressor.write(data)
+            except zstandard.ZstdError as e:
+                raise CompressionError(f"Invalid {self.codec} data: {e}")
+            return
+
+        while data:
+            self._pending = True
+            data = self._drain(data)
+            if self._decompressor.eof:
+                self._decompressor = self._new()
+                self._pending = False
+
+    def _drain(self, data):
+        # Decompress `data` in pieces of at most OUTPUT_SIZE bytes; returns
+        # the input following the end of the current member
+        decompressor = self._decompressor
+        while True:
+            try:
+                piece = decompressor.decompress(data, OUTPUT_SIZE)
+            except (zlib.error, OSError, EOFError, ValueError) as e:
+                raise CompressionError(f"Invalid {self.codec} data: {e}")
+            if piece:
+                self._write(piece)
+            if decompressor.eof:
+                return decompressor.unused_data
+            if self.codec == 'gzip':
+                # The input held back by the limit; a full piece may leave output pending too
+                data = decompressor.unconsumed_tail
+                if not data and len(piece) < OUTPUT_SIZE:
+                    return b''
+            else:
+                if decompressor.needs_input:
+                    return b''
+                data = b''
+
+    def finish(self):
+        # The zstd writer doesn't tell where frames end, so only gzip and bz2 are checked
+        if self.codec != 'zstd' and self._pending and not self._decompressor.eof:
+            raise CompressionError(f"The {self.codec} stream is truncated")
+
+
+class _Sink:
+    # Target of the zstd stream writer
+    def __init__(self, write):
+        self._write = write
+
+    def write(self, data):
+        self._write(data)
+        return len(data)
+
+
+# Stored files are compressed in independent frames of FRAME_SIZE bytes
+# followed by the seek table of the zstd seekable format, so a byte range of
+# the CSV (a page of rows, see rowindex.py) only decompresses the frames
+# holding it. With zstd the file is a standard seekable zstd file, readable by
+# the zstd tools; the gzip fallback uses gzip members in the same layout.
+# Files stored uncompressed read as they are.
+def storage_codec():
+    codec = getattr(settings, 'STORAGE_COMPRESSION', 'zstd')
+    if codec is not None and codec not in STORAGE_CODECS:
+        raise ImproperlyConfigured(f"STORAGE_COMPRESSION must be 'zstd', 'gzip' or None, not {codec!r}")
+    if codec == 'zstd' and zstandard is None:
+        return 'gzip'
+    return codec
+
+
+def _compress_frame(codec, data):
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    if codec == 'gzip':
+        compressor = zlib.compressobj(GZIP_LEVEL, wbits=31)
+        return compressor.compress(data) + compressor.flush()
+    raise ValueError(f"Unsupported storage codec: {codec!r}")
+
+
+def compress_file(path, codec):
+    # Replaces the file at `path` with its compressed form
+    sizes = []
+    with atomic_write(path) as tmp_path:
+        with open(path, 'rb') as source, open(tmp_path, 'wb') as target:
+            for block in iter(lambda: source.read(FRAME_SIZE), b''):
+                frame = _compress_frame(codec, block)
+                target.write(frame)
+                sizes.append((len(frame), len(block)))
+
+            entries = np.array(sizes, dtype='<u4').reshape(-1, 2).tobytes()
+            target.write(SKIPPABLE_HEADER.pack(SKIPPABLE_MAGIC, len(entries) + SEEK_TABLE_FOOTER.size))
+            target.write(entries)
+            target.write(SEEK_TABLE_FOOTER.pack(len(sizes), 0, SEEKABLE_MAGIC))
+
+
+def read_seek_table(f):
+    # (compressed sizes, decompressed sizes) of the frames, or None for an uncompressed file
+    end = f.seek(0, os.SEEK_END)
+    if end < SKIPPABLE_HEADER.size + SEEK_TABLE_FOOTER.size:
+        return None
+    f.seek(end - SEEK_TABLE_FOOTER.size)
+    frames, descriptor, magic = SEEK_TABLE_FOOTER.unpack(f.read(SEEK_TABLE_FOOTER.size))
+    entry_size = 12 if descriptor & 0x80 else 8  # Entries may carry a checksum
+    table_size = SKIPPABLE_HEADER.size + frames * entry_size + SEEK_TABLE_FOOTER.size
+    if magic != SEEKABLE_MAGIC or table_size > end:
+        return None
+
+    f.seek(end - table_size)
+    skippable_magic, _ = SKIPPABLE_HEADER.unpack(f.read(SKIPPABLE_HEADER.size))
+    if skippable_magic != SKIPPABLE_MAGIC:
+        return None
+    entries = np.frombuffer(f.read(frames * entry_size), dtype='<u4').reshape(frames, entry_size // 4)
+    return entries[:, 0].astype(np.int64), entries[:, 1].astype(np.int64)
+
+
+class SeekableReader(io.RawIOBase):
+    """
+    Read-only file over the decompressed content of a stored file, seeking by
+    decompressed offset. The last decompressed frame is kept for sequential reads.
+    """
+
+    def __init__(self, f, seek_table):
+        compressed, decompressed = seek_table
+        self._file = f
+        self._compressed_starts = np.concatenate(([0], np.cumsum(compressed))).tolist()
+        self._starts = np.concatenate(([0], np.cumsum(decompressed))).tolist()
+        self._size = self._starts[-1]
+        self._position = 0
+        self._frame_index = None
+        self._frame = b''
+        f.seek(0)
+        self._codec = detect_codec(f.read(4))
+        self._zstd = zstandard.ZstdDecompressor() if self._codec == 'zstd' else None
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            offset += self._size
+        if offset < 0:
+            raise ValueError("negative seek position")
+        self._position = offset
+        return offset
+
+    def _load_frame(self, index):
+        if index != self._frame_index:
+            start = self._compressed_starts[index]
+            self._file.seek(start)
+            data = self._file.read(self._compressed_starts[index + 1] - start)
+            if self._codec == 'zstd':
+                self._frame = self._zstd.decompress(data)
+            else:
+                self._frame = zlib.decompress(data, wbits=31)
+            self._frame_index = index
+        return self._frame
+
+    def readinto(self, buffer):
+        if self._position >= self._size:
+            return 0
+        index = bisect_right(self._starts, self._position) - 1
+        frame = self._load_frame(index)
+        offset = self._position - self._starts[index]
+        count = min(len(buffer), len(frame) - offset)
+        buffer[:count] = memoryview(frame)[offset:offset + count]
+        self._position += count
+        return count
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+def open_data(file_path):
+    # Binary file over the CSV content of a stored file, compressed or not
+    f = open(file_path, 'rb')
+    try:
+        seek_table = read_seek_table(f)
+    except BaseException:
+        f.close()
+        raise
+    if seek_table is None:
+        f.seek(0)
+        return f
+    return io.BufferedReader(SeekableReader(f, seek_table), buffer_size=FRAME_SIZE)
+
+
+def is_compressed(file_path):
+    with open(file_path, 'rb') as f:
+        return read_seek_table(f) is not None
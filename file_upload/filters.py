@@ -0,0 +1,395 @@
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from AVD.files import atomic_write
+from AVD.singleflight import single_flight
+from .cache import file_version
+from .columnar import ensure_columnar, load_schema, read_dataset, read_dataset_rows, read_dataset_slice, read_shape
+
+ZONE_ROWS = 64 * 1024
+MAX_FILTER_NODES = 64
+MAX_IN_VALUES = 1000
+MAX_CACHED_MASKS = 64
+
+COMPARISONS = {'eq', 'ne', 'lt', 'le', 'gt', 'ge'}
+SET_OPERATORS = {'in', 'not_in'}
+STRING_OPERATORS = {'contains', 'startswith', 'endswith'}
+NULL_OPERATORS = {'is_null', 'not_null'}
+OPERATORS = COMPARISONS | SET_OPERATORS | STRING_OPERATORS | NULL_OPERATORS | {'between'}
+
+# Row filters are JSON trees instead of pandas query strings, so callers can't
+# run arbitrary expressions. A condition is
+#     {"column": "price", "op": "gt", "value": 10}
+# and conditions combine with {"and": [...]}, {"or": [...]} and {"not": {...}}.
+# Null values only match is_null; every other condition is false for them.
+# Date columns are compared against ISO date strings, e.g. "2024-01-31".
+#
+# Filters are evaluated into boolean masks over the rows:
+# - only the columns a filter references are read;
+# - per-block min/max "zone maps" (<random_name>.zones.npz) skip blocks of
+#   ZONE_ROWS rows that can't match, so their pages of the memory-mapped
+#   sidecar are never touched;
+# - masks are cached bit-packed under <random_name>.masks/, keyed by the
+#   filter and the file's mtime/size, and shared by every process.
+
+
+class FilterError(ValueError):
+    pass
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _is_date(value):
+    if not isinstance(value, str):
+        return False
+    try:
+        pd.Timestamp(value)
+    except ValueError:
+        return False
+    return True
+
+
+def _is_scalar(value):
+    return isinstance(value, (str, bool, int, float))
+
+
+def _validate(node, counter):
+    counter[0] += 1
+    if counter[0] > MAX_FILTER_NODES:
+        raise FilterError(f"Filters may have at most {MAX_FILTER_NODES} conditions")
+    if not isinstance(node, dict):
+        raise FilterError("Each filter condition must be an object")
+
+    for combinator in ('and', 'or'):
+        if combinator in node:
+            children = node[combinator]
+            if len(node) != 1 or not isinstance(children, list) or not children:
+                raise FilterError(f"'{combinator}' takes a non-empty list of conditions")
+            return {combinator: [_validate(child, counter) for child in children]}
+
+    if 'not' in node:
+        if len(node) != 1:
+            raise FilterError("'not' takes a single condition")
+        return {'not': _validate(node['not'], counter)}
+
+    column, op = node.get('column'), node.get('op')
+    if not isinstance(column, str) or op not in OPERATORS:
+        raise FilterError(
+            f"Conditions need a 'column' and an 'op' among: {', '.join(sorted(OPERATORS))}"
+        )
+
+    value = node.get('value')
+    if op in NULL_OPERATORS:
+        return {'column': column, 'op': op}
+    if op in SET_OPERATORS:
+        if not isinstance(value, list) or not value or len(value) > MAX_IN_VALUES \
+                or not all(_is_scalar(v) for v in value):
+            raise FilterError(f"'{op}' takes a list of 1 to {MAX_IN_VALUES} values")
+    elif op == 'between':
+        if not isinstance(value, list) or len(value) != 2 or not all(_is_scalar(v) for v in value):
+            raise FilterError("'between' takes a list of two values")
+    elif op in STRING_OPERATORS:
+        if not isinstance(value, str):
+            raise FilterError(f"'{op}' takes a string value")
+    elif not _is_scalar(value):
+        raise FilterError(f"'{op}' takes a string, number or boolean value")
+    return {'column': column, 'op': op, 'value': value}
+
+
+def parse_filter(text):
+    try:
+        spec = json.loads(text)
+    except (TypeError, ValueError):
+        raise FilterError("The filter must be a JSON object, e.g. {\"column\": \"a\", \"op\": \"gt\", \"value\": 1}")
+    return _validate(spec, [0])
+
+
+def filter_key(spec):
+    # Equivalent spellings of a filter share cached masks and plots
+    return json.dumps(spec, sort_keys=True, separators=(',', ':'))
+
+
+def conditions(spec):
+    if 'and' in spec or 'or' in spec:
+        for child in spec.get('and') or spec.get('or'):
+            yield from conditions(child)
+    elif 'not' in spec:
+        yield from conditions(spec['not'])
+    else:
+        yield spec
+
+
+def referenced_columns(spec):
+    return list(dict.fromkeys(condition['column'] for condition in conditions(spec)))
+
+
+def column_kinds(profile):
+    kinds = {}
+    for column, column_profile in profile['column_profiles'].items():
+        dtype = column_profile['dtype']
+        if dtype == 'bool':
+            kinds[column] = 'bool'
+        elif dtype.startswith(('int', 'uint', 'float')):
+            kinds[column] = 'number'
+        elif dtype.startswith('datetime64'):
+            kinds[column] = 'date'
+        else:
+            kinds[column] = 'string'
+    return kinds
+
+
+def check_filter(spec, kinds):
+    # Reject unknown columns and values of the wrong type before touching any data
+    for condition in conditions(spec):
+        column, op = condition['column'], condition['op']
+        if column not in kinds:
+            raise FilterError(f"{column} is not a valid column in the dataset")
+        if op in NULL_OPERATORS:
+            continue
+
+        kind = kinds[column]
+        values = condition['value'] if isinstance(condition['value'], list) else [condition['value']]
+        if op in STRING_OPERATORS and kind != 'string':
+            raise FilterError(f"'{op}' only applies to text columns, {column} is {kind}")
+        if kind == 'number' and not all(_is_number(v) for v in values):
+            raise FilterError(f"{column} is numerical, '{op}' needs numbers")
+        if kind == 'bool' and (op not in ('eq', 'ne') and op not in SET_OPERATORS
+                               or not all(isinstance(v, bool) for v in values)):
+            raise FilterError(f"{column} is boolean, only eq/ne/in/not_in with true or false apply")
+        if kind == 'date' and not all(_is_date(v) for v in values):
+            raise FilterError(f"{column} holds dates, '{op}' needs ISO date strings")
+        if kind == 'string' and not all(isinstance(v, str) for v in values):
+            raise FilterError(f"{column} is text, '{op}' needs strings")
+
+
+# Zone maps
+
+def zones_path(file_path):
+    return f"{file_path}.zones.npz"
+
+
+def build_zone_maps(file_path):
+    # Only the numerical columns of the schema are read
+    numerical = [
+        column for column, dtype in load_schema(file_path)["dtypes"].items() if dtype.startswith(('int', 'float'))
+    ]
+    df = read_dataset(file_path, numerical) if numerical else pd.DataFrame(index=range(read_shape(file_path)[0]))
+    starts = np.arange(0, max(len(df), 1), ZONE_ROWS)
+    columns, mins, maxs = [], [], []
+    for column in df.columns:
+        series = df[column]
+        if series.dtype == bool or series.dtype.kind not in 'iuf':
+            continue
+        values = series.to_numpy(dtype=np.float64, na_value=np.nan)
+        columns.append(column)
+        if len(values):
+            # fmin/fmax skip NaN, a block of nulls only stays NaN
+            mins.append(np.fmin.reduceat(values, starts))
+            maxs.append(np.fmax.reduceat(values, starts))
+        else:
+            mins.append(np.full(len(starts), np.nan))
+            maxs.append(np.full(len(starts), np.nan))
+
+    zones = {
+        "source_version": np.array(file_version(file_path)),
+        "rows": np.array(len(df)),
+        "zone_rows": np.array(ZONE_ROWS),
+        "columns": np.array(columns, dtype=str),
+        "mins": np.array(mins).reshape(len(columns), len(starts)),
+        "maxs": np.array(maxs).reshape(len(columns), len(starts)),
+    }
+    with atomic_write(zones_path(file_path), suffix='.npz') as tmp_path:
+        np.savez(tmp_path, **zones)
+    return zones
+
+
+def load_zone_maps(file_path):
+    path = zones_path(file_path)
+    if os.path.exists(path):
+        with np.load(path) as stored:
+            if tuple(stored["source_version"]) == file_version(file_path):
+                return {name: stored[name] for name in stored.files}
+
+    return single_flight.do(('zone_maps', file_path, file_version(file_path)), build_zone_maps, file_path)
+
+
+def _candidate_zones(spec, zones, n_zones):
+    everything = np.ones(n_zones, dtype=bool)
+    if 'and' in spec:
+        return np.logical_and.reduce([_candidate_zones(child, zones, n_zones) for child in spec['and']])
+    if 'or' in spec:
+        return np.logical_or.reduce([_candidate_zones(child, zones, n_zones) for child in spec['or']])
+    if 'not' in spec:
+        return everything
+
+    columns = zones["columns"].tolist()
+    if spec['column'] not in columns or spec['op'] not in COMPARISONS | {'in', 'between'}:
+        return everything
+
+    position = columns.index(spec['column'])
+    low, high = zones["mins"][position], zones["maxs"][position]
+    op, value = spec['op'], spec['value']
+    # Comparisons with NaN are false, so blocks holding only nulls are skipped
+    with np.errstate(invalid='ignore'):
+        if op == 'eq':
+            return (low <= value) & (high >= value)
+        if op == 'lt':
+            return low < value
+        if op == 'le':
+            return low <= value
+        if op == 'gt':
+            return high > value
+        if op == 'ge':
+            return high >= value
+        if op == 'between':
+            return (high >= value[0]) & (low <= value[1])
+        if op == 'in':
+            return np.logical_or.reduce([(low <= v) & (high >= v) for v in value])
+    # ne can match anywhere
+    return everything
+
+
+def _runs(candidates, zone_rows, rows):
+    # Consecutive candidate blocks as [start, stop) row ranges
+    edges = np.diff(np.concatenate([[0], candidates.astype(np.int8), [0]]))
+    for first, last in zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)):
+        yield first * zone_rows, min(last * zone_rows, rows)
+
+
+# Mask evaluation
+
+def _as_timestamps(series, value):
+    if isinstance(value, list):
+        return [_as_timestamps(series, v) for v in value]
+    timestamp = pd.Timestamp(value)
+    if series.dt.tz is not None and timestamp.tz is None:
+        timestamp = timestamp.tz_localize(series.dt.tz)
+    elif series.dt.tz is None and timestamp.tz is not None:
+        timestamp = timestamp.tz_convert(None)
+    return timestamp
+
+
+def _evaluate(spec, df):
+    if 'and' in spec:
+        return np.logical_and.reduce([_evaluate(child, df) for child in spec['and']])
+    if 'or' in spec:
+        return np.logical_or.reduce([_evaluate(child, df) for child in spec['or']])
+    if 'not' in spec:
+        return ~_evaluate(spec['not'], df)
+
+    series, op, value = df[spec['column']], spec['op'], spec.get('value')
+    if pd.api.types.is_datetime64_any_dtype(series) and value is not None:
+        value = _as_timestamps(series, value)
+    elif isinstance(series.dtype, pd.CategoricalDtype) and op in ('lt', 'le', 'gt', 'ge', 'between'):
+        # Categories are unordered, order comparisons need the values themselves
+        series = series.astype(series.cat.categories.dtype)
+    elif series.dtype == np.float32:
+        # Compare in float64, like the zone maps, so values aren't rounded to float32
+        series = series.astype(np.float64)
+
+    if op == 'is_null':
+        result = series.isna()
+    elif op == 'not_null':
+        result = series.notna()
+    elif op == 'eq':
+        result = series == value
+    elif op == 'ne':
+        result = (series != value) & series.notna()
+    elif op == 'lt':
+        result = series < value
+    elif op == 'le':
+        result = series <= value
+    elif op == 'gt':
+        result = series > value
+    elif op == 'ge':
+        result = series >= value
+    elif op == 'between':
+        result = (series >= value[0]) & (series <= value[1])
+    elif op == 'in':
+        result = series.isin(value)
+    elif op == 'not_in':
+        result = ~series.isin(value) & series.notna()
+    elif op == 'contains':
+        result = series.str.contains(value, regex=False, na=False)
+    elif op == 'startswith':
+        result = series.str.startswith(value, na=False)
+    else:
+        result = series.str.endswith(value, na=False)
+    return result.to_numpy(dtype=bool, na_value=False)
+
+
+def masks_dir(file_path):
+    return f"{file_path}.masks"
+
+
+def _mask_cache_path(file_path, spec):
+    key = hashlib.sha256(f"{file_version(file_path)}:{filter_key(spec)}".encode()).hexdigest()
+    return os.path.join(masks_dir(file_path), f"{key}.npy")
+
+
+def _store_mask(path, mask):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    with atomic_write(path, suffix='.npy') as tmp_path:
+        np.save(tmp_path, np.packbits(mask))
+
+    # Keep the most recently used masks of this dataset
+    entries = sorted(
+        (entry.stat().st_mtime, entry.path) for entry in os.scandir(directory)
+        if not entry.name.endswith('.tmp.npy')
+    )
+    for _, stale_path in entries[:-MAX_CACHED_MASKS]:
+        try:
+            os.remove(stale_path)
+        except FileNotFoundError:
+            pass
+
+
+def filter_mask(file_path, spec):
+    """
+    Boolean mask of the rows matching a validated filter.
+    """
+    zones = load_zone_maps(file_path)
+    rows = int(zones["rows"])
+
+    path = _mask_cache_path(file_path, spec)
+    try:
+        mask = np.unpackbits(np.load(path), count=rows).astype(bool)
+        os.utime(path)
+        return mask
+    except (FileNotFoundError, ValueError):
+        pass
+
+    columns = referenced_columns(spec)
+    if ensure_columnar(file_path) is None:
+        # Without the columnar sidecar there is nothing to skip
+        mask = _evaluate(spec, read_dataset(file_path, columns))
+    else:
+        zone_rows = int(zones["zone_rows"])
+        mask = np.zeros(rows, dtype=bool)
+        candidates = _candidate_zones(spec, zones, zones["mins"].shape[1])
+        for start, stop in _runs(candidates, zone_rows, rows):
+            mask[start:stop] = _evaluate(spec, read_dataset_slice(file_path, start, stop, columns))
+
+    _store_mask(path, mask)
+    return mask
+
+
+def filtered_dataset(file_path, spec, columns=None):
+    # Matching rows, indexed by their position in the dataset
+    positions = np.flatnonzero(filter_mask(file_path, spec))
+    return read_dataset_rows(file_path, positions, columns)
+
+
+def remove_filter_files(file_path):
+    path = zones_path(file_path)
+    if os.path.exists(path):
+        os.remove(path)
+    shutil.rmtree(masks_dir(file_path), ignore_errors=True)
@@ -0,0 +1,113 @@
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+from django.http import QueryDict
+from django.utils.datastructures import MultiValueDict
+
+from .compression import CompressionError, StreamDecompressor, detect_codec
+
+
+class StreamedUploadedFile(UploadedFile):
+    """An upload already written to disk, with its size and SHA-256."""
+
+    def __init__(self, file, name, content_type, size, charset, sha256, content_type_extra=None):
+        super().__init__(file, name, content_type, size, charset, content_type_extra)
+        self.sha256 = sha256
+
+    def temporary_file_path(self):
+        return self.file.name
+
+    def close(self):
+        try:
+            return self.file.close()
+        except FileNotFoundError:
+            # The file was moved to its final location
+            pass
+
+
+class StreamingUploadHandler(FileUploadHandler):
+    """
+    Writes uploaded chunks straight to a temporary file in the upload directory,
+    hashing them and enforcing MAX_UPLOAD_SIZE as they arrive, so memory use
+    doesn't grow with the size of the upload. Compressed uploads (gzip, bz2,
+    zstd) are decompressed on the way; the size limit applies to the CSV.
+    """
+
+    def __init__(self, request=None, upload_dir="uploaded_files"):
+        super().__init__(request)
+        self.upload_dir = upload_dir
+        self.max_size = getattr(settings, 'MAX_UPLOAD_SIZE', None)
+        self.too_large = False
+        self.invalid = None  # Why a compressed upload couldn't be decompressed
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        # Skip parsing entirely when the client announces an oversized body
+        if self.max_size is not None and content_length > self.max_size:
+            self.too_large = True
+            return QueryDict(encoding=encoding), MultiValueDict()
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.file = tempfile.NamedTemporaryFile(dir=self.upload_dir, prefix='.upload-', delete=False)
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        self.decompressor = None
+
+    def receive_data_chunk(self, raw_data, start):
+        try:
+            if start == 0:
+                codec = detect_codec(raw_data)
+                self.decompressor = StreamDecompressor(codec, self._write) if codec else None
+            if self.decompressor is not None:
+                self.decompressor.decompress(raw_data)
+        except CompressionError as e:
+            self._reject(str(e))
+        if self.decompressor is None:
+            self._write(raw_data)
+
+    def _write(self, data):
+        # Checked piece by piece, so a compressed upload stops as soon as it's too large
+        self.size += len(data)
+        if self.max_size is not None and self.size > self.max_size:
+            self.too_large = True
+            self._discard()
+            raise StopUpload(connection_reset=True)
+
+        self.sha256.update(data)
+        self.file.write(data)
+
+    def file_complete(self, file_size):
+        if self.decompressor is not None:
+            try:
+                self.decompressor.finish()
+            except CompressionError as e:
+                self._reject(str(e))
+        self.file.flush()
+        self.file.seek(0)
+        return StreamedUploadedFile(
+            file=self.file,
+            name=self.file_name,
+            content_type=self.content_type,
+            size=self.size,
+            charset=self.charset,
+            sha256=self.sha256.hexdigest(),
+            content_type_extra=self.content_type_extra,
+        )
+
+    def _reject(self, reason):
+        self.invalid = reason
+        self._discard()
+        raise StopUpload(connection_reset=True)
+
+    def upload_interrupted(self):
+        if hasattr(self, 'file'):
+            self._discard()
+
+    def _discard(self):
+        self.file.close()
+        if os.path.exists(self.file.name):
+            os.remove(self.file.name)
@@ -0,0 +1,26 @@
+# Generated by Django 5.1.4 on 2026-10-18 00:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('random_name', models.CharField(max_length=12, unique=True)),
+                ('owner_token', models.CharField(db_index=True, max_length=255)),
+                ('original_name', models.CharField(max_length=255)),
+                ('size', models.BigIntegerField(null=True)),
+                ('sha256', models.CharField(blank=True, default='', max_length=64)),
+                ('uploaded_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,54 @@
+import json
+import os
+
+from django.db import migrations
+
+UPLOAD_DIR = "uploaded_files"
+USER_FILES_PATH = os.path.join(UPLOAD_DIR, "user_files.json")
+
+
+# One-time import of the legacy uploaded_files/user_files.json registry.
+# The JSON file is left in place so the migration can be inspected or re-run.
+def import_user_files(apps, schema_editor):
+    UserFile = apps.get_model('file_upload', 'UserFile')
+
+    if not os.path.exists(USER_FILES_PATH):
+        return
+
+    with open(USER_FILES_PATH, 'r') as user_files_file:
+        user_files = json.load(user_files_file)
+
+    rows = []
+    for token, file_names in user_files.items():
+        for file_name in file_names:
+            file_path = os.path.join(UPLOAD_DIR, file_name)
+            meta_data = {}
+            meta_path = f"{file_path}.meta.json"
+            if os.path.exists(meta_path):
+                with open(meta_path, 'r') as meta_file:
+                    meta_data = json.load(meta_file)
+
+            size = meta_data.get("size")
+            if size is None and os.path.exists(file_path):
+                size = os.path.getsize(file_path)
+
+            rows.append(UserFile(
+                random_name=file_name,
+                owner_token=token,
+                original_name=meta_data.get("original_name", file_name),
+                size=size,
+                sha256=meta_data.get("sha256", ""),
+            ))
+
+    UserFile.objects.bulk_create(rows, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_upload', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(import_user_files, migrations.RunPython.noop),
+    ]
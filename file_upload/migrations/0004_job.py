@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_upload', '0003_upload_session'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('job_id', models.CharField(max_length=32, unique=True)),
+                ('key', models.CharField(db_index=True, max_length=64)),
+                ('kind', models.CharField(max_length=32)),
+                ('params', models.JSONField()),
+                ('owner_token', models.CharField(db_index=True, max_length=255)),
+                ('priority', models.SmallIntegerField(default=1)),
+                ('status', models.CharField(db_index=True, default='queued', max_length=8)),
+                ('progress', models.FloatField(default=0)),
+                ('result', models.JSONField(null=True)),
+                ('error', models.TextField(blank=True, default='')),
+                ('error_status', models.SmallIntegerField(null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(null=True)),
+                ('finished_at', models.DateTimeField(null=True)),
+            ],
+        ),
+    ]
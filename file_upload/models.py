@@ -1,3 +1,111 @@
+import hashlib
+import os
+
 from django.db import models
 
-# Create your models here.
+UPLOAD_DIR = "uploaded_files"
+BLOB_DIR = os.path.join(UPLOAD_DIR, "blobs")
+
+
+# Uploaded content, stored once under its SHA-256 however many uploads share it.
+# `ref_count` counts the UserFile rows pointing at it (see blobs.py).
+class Blob(models.Model):
+    sha256 = models.CharField(max_length=64, unique=True)
+    size = models.BigIntegerField()
+    ref_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.sha256} ({self.ref_count} refs)"
+
+    @property
+    def path(self):
+        return os.path.join(BLOB_DIR, self.sha256)
+
+
+# One row per stored upload, replacing the uploaded_files/user_files.json registry.
+# `random_name` is the owner's handle on the upload's blob.
+class UserFile(models.Model):
+    random_name = models.CharField(max_length=12, unique=True)
+    owner_token = models.CharField(max_length=255, db_index=True)
+    original_name = models.CharField(max_length=255)
+    size = models.BigIntegerField(null=True)
+    sha256 = models.CharField(max_length=64, blank=True, default='')
+    uploaded_at = models.DateTimeField(auto_now_add=True)
+    blob = models.ForeignKey(Blob, null=True, on_delete=models.PROTECT, related_name='user_files')
+
+    def __str__(self):
+        return f"{self.random_name} ({self.original_name})"
+
+    @property
+    def path(self):
+        # Uploads stored before deduplication keep their own file under their name
+        if self.blob_id is None:
+            return os.path.join(UPLOAD_DIR, self.random_name)
+        return self.blob.path
+
+    def ensure_sha256(self, file_path):
+        # Files imported from user_files.json have no digest until first needed
+        if not self.sha256:
+            digest = hashlib.sha256()
+            with open(file_path, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(block)
+            self.sha256 = digest.hexdigest()
+            self.save(update_fields=['sha256'])
+        return self.sha256
+
+    def to_meta(self):
+        # Same shape as the .meta.json files returned by the file endpoints
+        return {
+            "owner_token": self.owner_token,
+            "original_name": self.original_name,
+            "size": self.size,
+            "sha256": self.sha256,
+            "random_name": self.random_name,
+        }
+
+
+# An in-progress resumable upload; its chunks are staged under uploaded_files/.staging/<session_id>/
+class UploadSession(models.Model):
+    session_id = models.CharField(max_length=32, unique=True)
+    owner_token = models.CharField(max_length=255, db_index=True)
+    original_name = models.CharField(max_length=255)
+    total_size = models.BigIntegerField()
+    chunk_size = models.BigIntegerField()
+    sha256 = models.CharField(max_length=64, blank=True, default='')  # Optional digest of the whole file
+    assembling = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.session_id} ({self.original_name})"
+
+    @property
+    def chunk_count(self):
+        return max(1, -(-self.total_size // self.chunk_size))
+
+    def expected_chunk_size(self, index):
+        if index == self.chunk_count - 1:
+            return self.total_size - self.chunk_size * index
+        return self.chunk_size
+
+
+# A background job (see AVD/jobs.py), when JOB_BACKEND is 'database'
+class Job(models.Model):
+    job_id = models.CharField(max_length=32, unique=True)
+    key = models.CharField(max_length=64, db_index=True)  # Identical jobs share a key and are coalesced
+    kind = models.CharField(max_length=32)
+    params = models.JSONField()
+    owner_token = models.CharField(max_length=255, db_index=True)
+    priority = models.SmallIntegerField(default=1)  # Lower runs first
+    status = models.CharField(max_length=8, default='queued', db_index=True)  # queued/running/done/failed
+    progress = models.FloatField(default=0)
+    result = models.JSONField(null=True)
+    error = models.TextField(blank=True, default='')
+    error_status = models.SmallIntegerField(null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True)
+    finished_at = models.DateTimeField(null=True)
+
+    def __str__(self):
+        return f"{self.job_id} ({self.kind}, {self.status})"
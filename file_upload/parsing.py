@@ -0,0 +1,148 @@
+import threading
+
+import pandas as pd
+from django.conf import settings
+from pandas._libs.parsers import STR_NA_VALUES
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    from pyarrow import csv as pa_csv
+except ImportError:  # pyarrow is optional, CSVs are then parsed by pandas' C engine
+    pa = None
+
+from .schema import apply_dtype, csv_read_options
+
+# Input read by each parsing thread at a time
+BLOCK_SIZE = 4 * 1024 * 1024
+
+# Text pandas parses as an integer, and hexadecimal integers, which pyarrow parses but pandas doesn't
+INTEGER_TEXT = r'^\s*[+-]?[0-9]+\s*$'
+HEX_TEXT = r'^\s*0[xX]'
+
+_threads_configured = False
+_threads_lock = threading.Lock()
+
+
+# Whole-file CSV parses (the conversion to the columnar sidecar, and the CSV
+# fallback loads) use pyarrow's multi-threaded reader when CSV_ENGINE is
+# 'pyarrow', with CSV_PARSE_THREADS threads. It is set up to read the file the
+# way pd.read_csv does by default: the same missing-value and boolean markers,
+# newlines allowed in quoted fields, dates, times and hexadecimal numbers left
+# as text and empty columns as floats. Files it reads differently (duplicate
+# or blank header names, ragged rows, a column whose type changes after the
+# first block, integers it reads as floats) are parsed by pandas instead.
+def _configure_threads():
+    global _threads_configured
+    with _threads_lock:
+        if not _threads_configured:
+            threads = getattr(settings, 'CSV_PARSE_THREADS', None)
+            if threads:
+                # pyarrow's CPU pool is process-wide, it also runs the other Arrow kernels
+                pa.set_cpu_count(threads)
+            _threads_configured = True
+
+
+def _convert_options(columns, column_types=None):
+    return pa_csv.ConvertOptions(
+        include_columns=columns,
+        column_types=column_types,
+        null_values=sorted(STR_NA_VALUES),
+        strings_can_be_null=True,
+        true_values=['True', 'TRUE', 'true'],
+        false_values=['False', 'FALSE', 'false'],
+    )
+
+
+def _read_table(f, columns, column_types=None):
+    return pa_csv.read_csv(
+        f,
+        read_options=pa_csv.ReadOptions(use_threads=True, block_size=BLOCK_SIZE),
+        parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+        convert_options=_convert_options(columns, column_types),
+    )
+
+
+def _contains_hex(f):
+    # Whether "0x" or "0X" appears anywhere in the file
+    f.seek(0)
+    last = b''
+    for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+        data = last + block
+        if b'0x' in data or b'0X' in data:
+            return True
+        last = block[-1:]
+    return False
+
+
+def _as_pandas_default(f, table):
+    """
+    The DataFrame pd.read_csv would have given for `table`, or None when only
+    pandas can give it. Columns pyarrow may have typed differently are read
+    again as text to decide: dates, times and timestamps, and hexadecimal
+    integers, are text to pandas and keep the text as written; floats that are
+    all written as integers (beyond int64, or signed with '+') are integers
+    to pandas, so the file is left to pandas.
+    """
+    suspects = []
+    has_hex = None
+    for field in table.schema:
+        column = table.column(field.name)
+        if pa.types.is_temporal(field.type):
+            suspects.append(field.name)
+        elif pa.types.is_integer(field.type):
+            if has_hex is None:
+                has_hex = _contains_hex(f)
+            if has_hex:
+                suspects.append(field.name)
+        elif pa.types.is_floating(field.type) and pc.all(pc.equal(pc.floor(column), column)).as_py():
+            suspects.append(field.name)
+
+    if suspects:
+        f.seek(0)
+        text = _read_table(f, suspects, {name: pa.string() for name in suspects})
+    for index, field in enumerate(table.schema):
+        if pa.types.is_null(field.type):
+            table = table.set_column(index, field.name, table.column(index).cast(pa.float64()))
+        elif field.name in suspects:
+            column = text.column(field.name)
+            if pa.types.is_floating(field.type):
+                if pc.all(pc.match_substring_regex(column, INTEGER_TEXT)).as_py():
+                    return None
+            elif pa.types.is_temporal(field.type) or pc.any(pc.match_substring_regex(column, HEX_TEXT)).as_py():
+                table = table.set_column(index, field.name, column)
+    return table.to_pandas()
+
+
+def _read_arrow(f, columns):
+    _configure_threads()
+    table = _read_table(f, columns)
+    names = table.column_names
+    if '' in names or len(set(names)) != len(names):
+        return None
+    # Values that aren't valid UTF-8 come back as bytes, where pandas fails to decode them
+    if any(pa.types.is_binary(field.type) or pa.types.is_large_binary(field.type) for field in table.schema):
+        return None
+    return _as_pandas_default(f, table)
+
+
+def parse_csv(f, columns=None, schema=None):
+    """
+    Parse the CSV in the binary file `f`, only `columns` when given (in file
+    order), typed like pd.read_csv's defaults or with the dataset's `schema`
+    (see schema.py).
+    """
+    if pa is not None and getattr(settings, 'CSV_ENGINE', 'pyarrow') == 'pyarrow':
+        try:
+            df = _read_arrow(f, columns)
+        except (pa.ArrowInvalid, pa.ArrowKeyError):
+            df = None
+        if df is not None:
+            if schema is not None:
+                dtypes = schema["dtypes"]
+                df = pd.DataFrame({column: apply_dtype(df[column], dtypes[column]) for column in df.columns})
+            return df
+        f.seek(0)
+
+    options = csv_read_options(schema, columns) if schema is not None else {"float_precision": "round_trip"}
+    return pd.read_csv(f, usecols=columns, **options)
@@ -0,0 +1,96 @@
+import json
+import os
+
+from pandas.api.types import is_numeric_dtype
+
+from AVD.files import atomic_write
+from AVD.responses import dumps
+from AVD.singleflight import single_flight
+from .cache import file_version
+from .columnar import read_dataset
+
+TOP_VALUES = 10
+HEAD_ROWS = 5
+
+
+# Dataset profiles live next to the metadata as "<random_name>.profile.json".
+# They hold everything describe/head/columns/shape/aggregate_info need, and
+# are tagged with the data file's mtime/size so a changed file is re-profiled.
+def profile_path(file_path):
+    return f"{file_path}.profile.json"
+
+
+def column_profile(column_data):
+    profile = {
+        "dtype": str(column_data.dtype),
+        "count": int(column_data.count()),
+        "nulls": int(column_data.isna().sum()),
+    }
+
+    if is_numeric_dtype(column_data) and column_data.dtype != bool:
+        # In float64 whatever width the column is stored with
+        column_data = column_data.astype('float64')
+        quantiles = column_data.quantile([0.25, 0.5, 0.75])
+        profile.update({
+            "min": float(column_data.min()),
+            "max": float(column_data.max()),
+            "mean": float(column_data.mean()),
+            "std": float(column_data.std()),
+            "quantiles": {f"{int(q * 100)}%": float(v) for q, v in quantiles.items()},
+        })
+    else:
+        value_counts = column_data.value_counts()
+        profile.update({
+            "unique": int(len(value_counts)),
+            "top": value_counts.index[0] if len(value_counts) else None,
+            "freq": int(value_counts.iloc[0]) if len(value_counts) else 0,
+            "top_values": [[value, int(count)] for value, count in value_counts.head(TOP_VALUES).items()],
+        })
+
+    return profile
+
+
+def describe_frame(df):
+    # Same as describe() on the file parsed with pandas' defaults: floats in float64
+    # and dates as their ISO text, so only numerical columns are described
+    wide = df.astype({column: 'float64' for column in df.select_dtypes('float32').columns})
+    for column in wide.select_dtypes(['datetime', 'datetimetz']).columns:
+        wide[column] = wide[column].map(lambda value: value.isoformat(), na_action='ignore').astype(object)
+    return wide.describe()
+
+
+def build_profile(file_path):
+    df = read_dataset(file_path)
+    profile = {
+        "source_version": list(file_version(file_path)),
+        "shape": list(df.shape),
+        "columns": df.columns.tolist(),
+        "describe": describe_frame(df).to_dict(),
+        "head": df.head(HEAD_ROWS).to_dict(orient='records'),
+        "column_profiles": {column: column_profile(df[column]) for column in df.columns},
+    }
+
+    # Encoded like the responses, so dates read back the way every endpoint writes them.
+    # The decoded copy is returned, identical to what later loads get.
+    encoded = dumps(profile)
+    with atomic_write(profile_path(file_path)) as tmp_path:
+        with open(tmp_path, 'wb') as profile_file:
+            profile_file.write(encoded)
+    return json.loads(encoded)
+
+
+def load_profile(file_path):
+    path = profile_path(file_path)
+    if os.path.exists(path):
+        with open(path, 'r') as profile_file:
+            profile = json.load(profile_file)
+        if profile.get("source_version") == list(file_version(file_path)):
+            return profile
+
+    return single_flight.do(('profile', file_path, file_version(file_path)), build_profile, file_path)
+
+
+def remove_profile(file_path):
+    path = profile_path(file_path)
+    if os.path.exists(path):
+        os.remove(path)
@@ -0,0 +1,160 @@
+import os
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+from AVD.files import atomic_write
+from AVD.singleflight import single_flight
+from .cache import file_version
+from .compression import open_data
+
+BLOCK_SIZE = 16 * 1024 * 1024
+DEFAULT_STRIDE = 1000
+NEWLINE = 10
+CARRIAGE_RETURN = 13
+QUOTE = 34
+
+
+# Row-offset indexes live next to the CSV as "<random_name>.rowidx.npz".
+# They hold the byte offset of every STRIDE-th data row, so a page of rows can
+# be parsed by seeking close to it instead of reading the file from the start.
+# Rows are counted the way pandas does: the first non-blank record is the
+# header, blank lines are skipped and newlines inside quotes don't end a row.
+# Offsets are positions in the CSV content, also when the file is stored compressed.
+def index_path(file_path):
+    return f"{file_path}.rowidx.npz"
+
+
+def build_row_index(file_path, stride=None):
+    stride = stride or getattr(settings, 'ROW_INDEX_STRIDE', DEFAULT_STRIDE)
+    offsets = []
+    row_count = 0
+    header_seen = False
+    record_start = 0  # Start of the record currently being read
+    previous_byte = NEWLINE
+    quotes = 0  # Quote characters seen so far, their parity tells if we're inside a field
+
+    def add_records(starts, ends, last_bytes):
+        nonlocal row_count, header_seen
+        lengths = ends - starts
+        blank = (lengths == 0) | ((lengths == 1) & (last_bytes == CARRIAGE_RETURN))
+        starts = starts[~blank]
+        if not header_seen and len(starts):
+            header_seen = True
+            starts = starts[1:]
+        positions = row_count + np.arange(len(starts))
+        offsets.append(starts[positions % stride == 0])
+        row_count += len(starts)
+
+    with open_data(file_path) as f:
+        base = 0
+        while True:
+            block = f.read(BLOCK_SIZE)
+            if not block:
+                break
+            buf = np.frombuffer(block, dtype=np.uint8)
+
+            newlines = np.flatnonzero(buf == NEWLINE)
+            is_quote = buf == QUOTE
+            if quotes or is_quote.any():
+                inside = (np.cumsum(is_quote)[newlines] + quotes) & 1
+                newlines = newlines[inside == 0]
+                quotes += int(is_quote.sum())
+
+            if len(newlines):
+                ends = base + newlines
+                starts = np.concatenate(([record_start], ends[:-1] + 1))
+                # Byte before each terminator, to recognise "\r\n" blank lines
+                before = np.where(newlines > 0, buf[np.maximum(newlines - 1, 0)], previous_byte)
+                add_records(starts, ends, before)
+                record_start = int(ends[-1]) + 1
+
+            previous_byte = int(buf[-1])
+            base += len(block)
+
+        # Last record when the file doesn't end with a newline
+        if record_start < base:
+            add_records(np.array([record_start]), np.array([base]), np.array([previous_byte]))
+
+    index = {
+        "offsets": np.concatenate(offsets) if offsets else np.array([], dtype=np.int64),
+        "row_count": row_count,
+        "stride": stride,
+        "source_version": np.array(file_version(file_path)),
+    }
+
+    with atomic_write(index_path(file_path), suffix='.npz') as tmp_path:
+        np.savez(tmp_path, **index)
+    return index
+
+
+def load_row_index(file_path):
+    path = index_path(file_path)
+    if os.path.exists(path):
+        with np.load(path) as stored:
+            if tuple(stored["source_version"]) == file_version(file_path):
+                return {
+                    "offsets": stored["offsets"],
+                    "row_count": int(stored["row_count"]),
+                    "stride": int(stored["stride"]),
+                }
+
+    return single_flight.do(('row_index', file_path, file_version(file_path)), build_row_index, file_path)
+
+
+def remove_row_index(file_path):
+    path = index_path(file_path)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def read_rows(file_path, start, stop, columns, read_options=None):
+    """
+    Parse rows [start, stop) of the CSV by seeking to the nearest indexed offset.
+    `columns` are the header names and `read_options` the pd.read_csv dtype
+    arguments of the dataset's schema, so a page is typed like the whole dataset.
+    """
+    index = load_row_index(file_path)
+    start, stop, _ = slice(start, stop).indices(index["row_count"])
+    if stop <= start:
+        return pd.DataFrame(columns=columns, index=pd.RangeIndex(start, start))
+
+    stride = index["stride"]
+    anchor = start // stride
+    skip = start - anchor * stride
+
+    with open_data(file_path) as f:
+        f.seek(int(index["offsets"][anchor]))
+        df = pd.read_csv(f, header=None, names=columns, nrows=skip + stop - start, **(read_options or {}))
+
+    df = df.iloc[skip:]
+    df.index = pd.RangeIndex(start, stop)
+    return df
+
+
+def iter_rows(file_path, start, stop, columns, read_options=None, chunk_rows=10000):
+    """
+    Like read_rows, but yields rows [start, stop) in DataFrames of at most
+    `chunk_rows` rows, parsing as it goes so memory doesn't grow with the range.
+    """
+    index = load_row_index(file_path)
+    start, stop, _ = slice(start, stop).indices(index["row_count"])
+    if stop <= start:
+        return
+
+    stride = index["stride"]
+    anchor = start // stride
+    row = anchor * stride
+
+    with open_data(file_path) as f:
+        f.seek(int(index["offsets"][anchor]))
+        reader = pd.read_csv(
+            f, header=None, names=columns, nrows=stop - row, chunksize=chunk_rows, **(read_options or {})
+        )
+        for chunk in reader:
+            chunk.index = pd.RangeIndex(row, row + len(chunk))
+            row += len(chunk)
+            chunk = chunk.loc[start:]
+            if len(chunk):
+                yield chunk
@@ -0,0 +1,153 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_bool_dtype, is_float_dtype, is_integer_dtype
+
+from AVD.files import atomic_write
+
+# Columns with at most this many distinct values, making up at most this share
+# of the non-null values, are stored as categories
+CATEGORY_MAX_UNIQUE = 10000
+CATEGORY_MAX_RATIO = 0.5
+
+INTEGER_DTYPES = ('int8', 'int16', 'int32', 'int64')
+
+# pandas 3's default string dtype is already Arrow-backed
+STRING_DTYPE = 'str' if int(pd.__version__.split('.')[0]) >= 3 else 'string[pyarrow]'
+
+
+# Dataset schemas live next to the data as "<random_name>.schema.json". They are
+# inferred once from pandas' default parse and record a compact dtype per column:
+# the smallest integer type that holds the values, float32 when it's lossless,
+# 'category' for low-cardinality text, parsed ISO dates and Arrow-backed strings.
+# The columnar sidecar is written with these types, so loads apply them directly,
+# and the CSV fallback paths parse with them. They also hold the memory each
+# column takes with the default and the compact types.
+def schema_path(file_path):
+    return f"{file_path}.schema.json"
+
+
+def _integer_dtype(values):
+    low, high = values.min(), values.max()
+    for dtype in INTEGER_DTYPES:
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return dtype
+    return 'int64'
+
+
+def _float_dtype(values):
+    values = values.to_numpy()
+    with np.errstate(over='ignore'):
+        narrowed = values.astype(np.float32).astype(np.float64)
+    # Only when every value survives the round trip, so results don't change
+    return 'float32' if np.array_equal(narrowed, values, equal_nan=True) else 'float64'
+
+
+def _text_dtype(values):
+    present = values.dropna()
+    if not len(present):
+        return 'string'
+
+    try:
+        pd.to_datetime(present, format='ISO8601')
+        return 'datetime'
+    except (ValueError, TypeError, OverflowError):
+        pass
+
+    unique = present.nunique()
+    if unique <= CATEGORY_MAX_UNIQUE and unique <= CATEGORY_MAX_RATIO * len(present):
+        return 'category'
+    return 'string'
+
+
+def infer_dtype(values):
+    if is_bool_dtype(values):
+        return 'bool'
+    if is_integer_dtype(values):
+        return _integer_dtype(values) if len(values) else 'int64'
+    if is_float_dtype(values):
+        return _float_dtype(values)
+    return _text_dtype(values)
+
+
+def apply_dtype(values, dtype):
+    if dtype == 'datetime':
+        return pd.to_datetime(values, format='ISO8601')
+    if dtype == 'string':
+        return values.astype(STRING_DTYPE)
+    return values.astype(dtype)
+
+
+def infer_schema(df, source_version):
+    """
+    Compact dtypes for a DataFrame parsed with pandas' defaults.
+    Returns the schema and the DataFrame converted to it.
+    """
+    dtypes, memory, compact = {}, {}, {}
+    for column in df.columns:
+        dtype = infer_dtype(df[column])
+        compact[column] = apply_dtype(df[column], dtype)
+        dtypes[column] = dtype
+        memory[column] = {
+            "default_bytes": int(df[column].memory_usage(index=False, deep=True)),
+            "bytes": int(compact[column].memory_usage(index=False, deep=True)),
+        }
+
+    schema = {
+        "source_version": list(source_version),
+        "dtypes": dtypes,
+        "memory": memory,
+    }
+    return schema, pd.DataFrame(compact, columns=df.columns)
+
+
+def write_schema(file_path, schema):
+    with atomic_write(schema_path(file_path)) as tmp_path:
+        with open(tmp_path, 'w') as schema_file:
+            json.dump(schema, schema_file)
+
+
+def read_schema(file_path):
+    path = schema_path(file_path)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as schema_file:
+        return json.load(schema_file)
+
+
+def remove_schema(file_path):
+    path = schema_path(file_path)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def csv_read_options(schema, columns=None):
+    # pd.read_csv arguments that parse (part of) the CSV straight into the schema's types
+    dtypes, parse_dates = {}, []
+    for column, dtype in schema["dtypes"].items():
+        if columns is not None and column not in columns:
+            continue
+        if dtype == 'datetime':
+            parse_dates.append(column)
+        else:
+            dtypes[column] = STRING_DTYPE if dtype == 'string' else dtype
+    # Floats are parsed exactly, like pyarrow parses them for the columnar copy (see parsing.py)
+    options = {"dtype": dtypes, "float_precision": "round_trip"}
+    if parse_dates:
+        options.update(parse_dates=parse_dates, date_format='ISO8601')
+    return options
+
+
+def memory_report(schema):
+    columns = {
+        column: {"dtype": schema["dtypes"][column], **usage}
+        for column, usage in schema["memory"].items()
+    }
+    return {
+        "columns": columns,
+        "bytes": sum(usage["bytes"] for usage in columns.values()),
+        "default_bytes": sum(usage["default_bytes"] for usage in columns.values()),
+    }
@@ -0,0 +1,167 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+
+from .compression import CompressionError, StreamDecompressor, detect_codec
+
+UPLOAD_DIR = "uploaded_files"
+STAGING_DIR = os.path.join(UPLOAD_DIR, ".staging")
+READ_SIZE = 1024 * 1024
+TOO_LARGE = "File exceeds the maximum upload size once decompressed"
+
+
+class ChunkError(Exception):
+    pass
+
+
+# Chunks of a resumable upload are stored as separate files named by their index,
+# so they can be written concurrently and re-sent independently.
+def session_dir(session_id):
+    return os.path.join(STAGING_DIR, session_id)
+
+
+def chunk_path(session_id, index):
+    return os.path.join(session_dir(session_id), str(index))
+
+
+def write_chunk(session_id, index, stream, expected_size, expected_sha256=None):
+    directory = session_dir(session_id)
+    os.makedirs(directory, exist_ok=True)
+
+    digest = hashlib.sha256()
+    size = 0
+    with tempfile.NamedTemporaryFile(dir=directory, prefix=f".{index}-", delete=False) as part:
+        try:
+            while True:
+                block = stream.read(min(READ_SIZE, expected_size + 1 - size))
+                if not block:
+                    break
+                size += len(block)
+                if size > expected_size:
+                    raise ChunkError(f"Chunk {index} is larger than {expected_size} bytes")
+                digest.update(block)
+                part.write(block)
+
+            if size != expected_size:
+                raise ChunkError(f"Chunk {index} has {size} bytes, expected {expected_size}")
+            if expected_sha256 and digest.hexdigest() != expected_sha256.lower():
+                raise ChunkError(f"Checksum mismatch for chunk {index}")
+        except BaseException:
+            part.close()
+            os.remove(part.name)
+            raise
+
+    # Publish atomically so a concurrent status call never sees a partial chunk
+    os.replace(part.name, chunk_path(session_id, index))
+    return digest.hexdigest()
+
+
+def received_chunks(session_id):
+    directory = session_dir(session_id)
+    if not os.path.isdir(directory):
+        return []
+    return sorted(int(name) for name in os.listdir(directory) if name.isdigit())
+
+
+def received_ranges(session):
+    # Merge received chunks into [start, end) byte ranges
+    ranges = []
+    for index in received_chunks(session.session_id):
+        start = index * session.chunk_size
+        end = start + session.expected_chunk_size(index)
+        if ranges and ranges[-1][1] == start:
+            ranges[-1][1] = end
+        else:
+            ranges.append([start, end])
+    return ranges
+
+
+def _copy_range(source, target, size):
+    # Kernel-side copy where available, avoiding a round trip through user space
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while size > 0:
+                copied = os.copy_file_range(source.fileno(), target.fileno(), size)
+                if copied == 0:
+                    break
+                size -= copied
+            return
+        except OSError:
+            # Not supported for these files, finish with a buffered copy
+            pass
+    shutil.copyfileobj(source, target, READ_SIZE)
+    target.flush()
+
+
+def assemble(session):
+    """
+    Concatenate the staged chunks into a temporary file inside UPLOAD_DIR and
+    return its path together with the SHA-256 and size of the CSV. Compressed
+    uploads (see compression.py) are decompressed on the way; the session's
+    digest is checked against the bytes as they were sent.
+    """
+    missing = sorted(set(range(session.chunk_count)) - set(received_chunks(session.session_id)))
+    if missing:
+        raise ChunkError(f"Missing chunks: {missing}")
+
+    with open(chunk_path(session.session_id, 0), 'rb') as first:
+        codec = detect_codec(first.read(4))
+    max_size = getattr(settings, 'MAX_UPLOAD_SIZE', None)
+    size = 0
+
+    def write_content(block):
+        # Decompressed output, checked against the limit as it's drained
+        nonlocal size
+        size += len(block)
+        if max_size is not None and size > max_size:
+            raise ChunkError(TOO_LARGE)
+        content_digest.update(block)
+        target.write(block)
+
+    try:
+        decompressor = StreamDecompressor(codec, write_content) if codec else None
+    except CompressionError as e:
+        raise ChunkError(str(e))
+
+    digest = hashlib.sha256()
+    content_digest = hashlib.sha256() if decompressor else digest
+    with tempfile.NamedTemporaryFile(dir=UPLOAD_DIR, prefix='.upload-', delete=False) as target:
+        try:
+            for index in range(session.chunk_count):
+                path = chunk_path(session.session_id, index)
+                with open(path, 'rb') as source:
+                    # The data goes through the page cache once for the digest
+                    for block in iter(lambda: source.read(READ_SIZE), b''):
+                        digest.update(block)
+                        if decompressor is not None:
+                            decompressor.decompress(block)
+                    if decompressor is None:
+                        chunk_size = os.path.getsize(path)
+                        source.seek(0)
+                        _copy_range(source, target, chunk_size)
+                        size += chunk_size
+                        if max_size is not None and size > max_size:
+                            raise ChunkError(TOO_LARGE)
+            if decompressor is not None:
+                decompressor.finish()
+        except CompressionError as e:
+            target.close()
+            os.remove(target.name)
+            raise ChunkError(str(e))
+        except BaseException:
+            target.close()
+            os.remove(target.name)
+            raise
+
+    if session.sha256 and digest.hexdigest() != session.sha256.lower():
+        os.remove(target.name)
+        raise ChunkError("Checksum mismatch for the assembled file")
+
+    return target.name, content_digest.hexdigest(), size
+
+
+def discard(session_id):
+    shutil.rmtree(session_dir(session_id), ignore_errors=True)
@@ -1,3 +1,646 @@
-from django.test import TestCase
+import bz2
+import gzip
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+from asgiref.sync import async_to_sync
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import include, path
+
+from AVD.singleflight import single_flight
+from . import async_views, compression, filters, staging, urls
+from .cache import DatasetCache
+from .columnar import open_table, write_columnar
+from .compression import CompressionError, StreamDecompressor, compress_file, open_data
+from .filters import FilterError, check_filter, column_kinds, filter_mask, masks_dir, parse_filter
+from .models import BLOB_DIR, Blob, UploadSession, UserFile
+from .parsing import parse_csv
+from .profile import load_profile
+from .rowindex import build_row_index, iter_rows, read_rows
+
+
+class UploadDirMixin:
+    # Runs each test in an empty directory, uploaded_files/ is relative to it
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        cwd = os.getcwd()
+        os.chdir(directory)
+        self.addCleanup(shutil.rmtree, directory)
+        self.addCleanup(os.chdir, cwd)
+        os.makedirs("uploaded_files")
+
+    def write_csv(self, name, text):
+        path = os.path.join("uploaded_files", name)
+        with open(path, "w") as f:
+            f.write(text)
+        return path
+
+    def upload(self, content, token="token", name="data.csv"):
+        # Uploads `content` (bytes) through the endpoint, returns the response
+        return self.client.post("/file/upload/", {"token": token, "file": SimpleUploadedFile(name, content)})
+
+
+class UploadDirTestCase(UploadDirMixin, TestCase):
+    pass
+
+
+def async_urlpatterns(prefix, app_urls, async_views):
+    # The app's URLs served by its async views, as with ASYNC_VIEWS = True
+    return [path(prefix, include([
+        path(str(pattern.pattern), getattr(async_views, pattern.callback.__name__), name=pattern.name)
+        for pattern in app_urls.urlpatterns
+    ]))]
+
+
+# Served in place of the project's URLs by AsyncViewTests
+urlpatterns = async_urlpatterns("file/", urls, async_views)
+
+
+async def _join(chunks):
+    return b"".join([chunk async for chunk in chunks])
+
+
+def response_body(response):
+    # The body of a response, streamed or not, from the sync or the async client
+    if not response.streaming:
+        return response.content
+    if response.is_async:
+        return async_to_sync(_join)(response.streaming_content)
+    return b"".join(response.streaming_content)
+
+
+class AsyncViewTestCase(UploadDirMixin, TransactionTestCase):
+    # The async views run their work in the executor pools, whose threads have
+    # their own database connections and only see committed data
+    ASYNC_URLCONF = None  # Module with the urlpatterns of async_urlpatterns()
+
+    def assert_async_matches(self, method, url, data=None, status=None, **extra):
+        # Sends the request to the sync view and then to its async twin; both must answer the same
+        expected = getattr(self.client, method)(url, data, **extra)
+        with self.settings(ROOT_URLCONF=self.ASYNC_URLCONF):
+            response = async_to_sync(getattr(self.async_client, method))(url, data, **extra)
+        self.assertEqual(response.status_code, expected.status_code, url)
+        if status is not None:
+            self.assertEqual(response.status_code, status, url)
+        if response.get("Content-Type") == "application/json":
+            self.assertEqual(response.json(), expected.json(), url)
+        else:
+            self.assertEqual(response_body(response), response_body(expected), url)
+        return response
+
+
+class AsyncViewTests(AsyncViewTestCase):
+    ASYNC_URLCONF = __name__
+
+    def test_matches_sync_views(self):
+        file_name = self.upload(b"a,b\n1,2\n").json()["random_name"]
+        self.assert_async_matches("get", "/file/", {"token": "token"}, status=200)
+        self.assert_async_matches("get", "/file/", {"token": "other"}, status=403)
+        self.assert_async_matches("get", "/file/", status=400)
+        self.assert_async_matches("get", "/file/meta/", {"token": "token", "file_name": file_name}, status=200)
+        self.assert_async_matches("get", "/file/meta/", {"token": "other", "file_name": file_name}, status=403)
+        self.assert_async_matches("get", "/file/meta/", {"token": "token"}, status=400)
+        self.assert_async_matches("post", "/file/remove/", {"token": "other", "file_name": file_name}, status=403)
+        self.assert_async_matches("post", "/file/remove/", {"token": "token"}, status=400)
+        self.assert_async_matches("post", "/file/upload/sessions/", {
+            "token": "token", "file_name": "data.csv", "total_size": 0,
+        }, status=400)
+        self.assert_async_matches("put", "/file/upload/sessions/missing/chunks/0/?token=token", b"", status=403)
+        self.assert_async_matches("get", "/file/upload/", status=405)
+
+    def test_upload_and_remove(self):
+        with self.settings(ROOT_URLCONF=__name__):
+            response = async_to_sync(self.async_client.post)(
+                "/file/upload/", {"token": "token", "file": SimpleUploadedFile("data.csv", b"a,b\n1,2\n")}
+            )
+            self.assertEqual(response.status_code, 200)
+            file_name = response.json()["random_name"]
+            self.assertTrue(UserFile.objects.filter(random_name=file_name).exists())
+
+            response = async_to_sync(self.async_client.post)("/file/remove/", {"token": "token", "file_name": file_name})
+            self.assertEqual(response.status_code, 200)
+        self.assertFalse(UserFile.objects.exists())
+
+
+class BlobTests(UploadDirTestCase):
+    CSV = b"a,b\n1,x\n2,y\n"
+
+    def remove(self, file_name, token="token"):
+        return self.client.post("/file/remove/", {"token": token, "file_name": file_name})
+
+    def blob_files(self):
+        return sorted(os.listdir(BLOB_DIR)) if os.path.exists(BLOB_DIR) else []
+
+    def test_identical_uploads_share_a_blob(self):
+        first = self.upload(self.CSV).json()["random_name"]
+        second = self.upload(self.CSV, token="other").json()["random_name"]
+        self.assertNotEqual(first, second)
+        blob = Blob.objects.get()
+        self.assertEqual(blob.ref_count, 2)
+        self.assertEqual(UserFile.objects.filter(blob=blob).count(), 2)
+        self.assertIn(blob.sha256, self.blob_files())
+        files = self.blob_files()
+
+        self.assertEqual(self.remove(first).status_code, 200)
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+        self.assertEqual(self.blob_files(), files)  # Still used by the other upload
+
+        self.assertEqual(self.remove(second, token="other").status_code, 200)
+        self.assertFalse(Blob.objects.exists())
+        self.assertEqual(self.blob_files(), [])  # With the derived files
+
+    def test_removal_needs_the_owner(self):
+        name = self.upload(self.CSV).json()["random_name"]
+        self.assertEqual(self.remove(name, token="other").status_code, 403)
+        self.assertEqual(self.remove(name).status_code, 200)
+        self.assertEqual(self.remove(name).status_code, 403)
+
+    def test_different_content_gets_its_own_blob(self):
+        self.upload(self.CSV)
+        self.upload(self.CSV + b"3,z\n")
+        self.assertEqual(sorted(Blob.objects.values_list("ref_count", flat=True)), [1, 1])
+
+    def test_failed_build_unregisters_the_upload(self):
+        with mock.patch("file_upload.views.build_row_index", side_effect=OSError("disk full")):
+            response = self.upload(self.CSV)
+        self.assertEqual(response.status_code, 500)
+        self.assertFalse(UserFile.objects.exists())
+        self.assertFalse(Blob.objects.exists())
+        self.assertEqual(self.blob_files(), [])
+
+        # Nothing is left behind to prevent storing it again
+        self.assertEqual(self.upload(self.CSV).status_code, 200)
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+
+    def test_failed_build_keeps_a_blob_shared_meanwhile(self):
+        shared = []
+
+        def build_and_share(file_path):
+            # An identical upload arriving while the derived files are built
+            shared.append(self.upload(self.CSV, token="other").json()["random_name"])
+            raise OSError("disk full")
+
+        with mock.patch("file_upload.views.build_row_index", side_effect=build_and_share):
+            self.assertEqual(self.upload(self.CSV).status_code, 500)
+        blob = Blob.objects.get()
+        self.assertEqual(blob.ref_count, 1)
+        self.assertEqual(UserFile.objects.get().random_name, shared[0])
+        self.assertTrue(os.path.exists(blob.path))
+
+
+class CompressedUploadTests(UploadDirTestCase):
+    CSV = b"x,y\n" + b"".join(b"%d,%d\n" % (i, i % 7) for i in range(50000))
+    BOMB = gzip.compress(b"0,0\n" * (2 * 1024 * 1024))  # 8 MiB of CSV in a few KiB
+
+    def decompress(self, codec, data, limit=None):
+        # The pieces written, stopping once they add up to more than `limit`
+        pieces = []
+
+        def write(piece):
+            pieces.append(len(piece))
+            if limit is not None and sum(pieces) > limit:
+                raise OverflowError
+
+        decompressor = StreamDecompressor(codec, write)
+        try:
+            for start in range(0, len(data), 4096):
+                decompressor.decompress(data[start:start + 4096])
+            decompressor.finish()
+        except OverflowError:
+            pass
+        return pieces
+
+    @mock.patch.object(compression, "OUTPUT_SIZE", 64 * 1024)
+    def test_output_drained_in_bounded_pieces(self):
+        for codec, compress in (("gzip", gzip.compress), ("bz2", bz2.compress)):
+            with self.subTest(codec=codec):
+                data = compress(self.CSV[:100000]) + compress(self.CSV[100000:])  # Two members
+                pieces = self.decompress(codec, data)
+                self.assertEqual(sum(pieces), len(self.CSV))
+                self.assertLessEqual(max(pieces), 64 * 1024)
+
+                pieces = self.decompress(codec, compress(b"0,0\n" * (2 * 1024 * 1024)), limit=100000)
+                self.assertLessEqual(sum(pieces), 100000 + 64 * 1024)
+
+    def test_truncated_stream(self):
+        with self.assertRaises(CompressionError):
+            self.decompress("gzip", gzip.compress(self.CSV)[:-100])
+
+    def test_compressed_upload_stored_decompressed(self):
+        response = self.upload(gzip.compress(self.CSV))
+        self.assertEqual(response.status_code, 200)
+        user_file = UserFile.objects.get(random_name=response.json()["random_name"])
+        with open_data(user_file.path) as f:
+            self.assertEqual(f.read(), self.CSV)
+
+    @override_settings(MAX_UPLOAD_SIZE=1024 * 1024)
+    def test_size_limit_applies_to_decompressed_upload(self):
+        response = self.upload(self.BOMB)
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(os.listdir("uploaded_files"), [])
+        self.assertFalse(UserFile.objects.exists())
+
+    @override_settings(MAX_UPLOAD_SIZE=1024 * 1024)
+    def test_size_limit_applies_to_decompressed_session(self):
+        session = self.client.post("/file/upload/sessions/", {
+            "token": "token", "file_name": "data.csv", "total_size": len(self.BOMB),
+        }).json()
+        response = self.client.put(
+            f"/file/upload/sessions/{session['session_id']}/chunks/0/?token=token", self.BOMB,
+            content_type="application/octet-stream",
+        )
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.post(f"/file/upload/sessions/{session['session_id']}/complete/", {"token": "token"})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("maximum upload size", response.json()["error"])
+        self.assertFalse(any(name.startswith(".upload-") for name in os.listdir("uploaded_files")))
+
+    def test_unknown_storage_codec(self):
+        with override_settings(STORAGE_COMPRESSION="lz4"):
+            with self.assertRaises(ImproperlyConfigured):
+                compression.storage_codec()
+        with override_settings(STORAGE_COMPRESSION=None):
+            self.assertIsNone(compression.storage_codec())
+
+        # A failed compression leaves the file as it was, without temporary files
+        path = self.write_csv("data", "a\n1\n")
+        with self.assertRaises(ValueError):
+            compress_file(path, "lz4")
+        self.assertEqual(os.listdir("uploaded_files"), ["data"])
+        with open(path) as f:
+            self.assertEqual(f.read(), "a\n1\n")
+
+
+class UploadSessionTests(UploadDirTestCase):
+    CSV = b"x,y\n" + b"".join(b"%d,%d\n" % (i, i % 7) for i in range(100))
+
+    def create(self, content, **fields):
+        return self.client.post("/file/upload/sessions/", {
+            "token": "token", "file_name": "data.csv", "total_size": len(content), "chunk_size": 100, **fields,
+        })
+
+    def put(self, session_id, index, data, **headers):
+        return self.client.put(
+            f"/file/upload/sessions/{session_id}/chunks/{index}/?token=token", data,
+            content_type="application/octet-stream", headers=headers,
+        )
+
+    def complete(self, session_id):
+        return self.client.post(f"/file/upload/sessions/{session_id}/complete/", {"token": "token"})
+
+    def chunks(self, content):
+        return [content[start:start + 100] for start in range(0, len(content), 100)]
+
+    def test_chunks_in_any_order(self):
+        session = self.create(self.CSV, sha256=hashlib.sha256(self.CSV).hexdigest()).json()
+        chunks = self.chunks(self.CSV)
+        self.assertEqual(session["chunk_count"], len(chunks))
+        self.assertEqual(session["missing_chunks"], list(range(len(chunks))))
+
+        for index in [len(chunks) - 1, 0, 2]:
+            response = self.put(session["session_id"], index, chunks[index])
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()["sha256"], hashlib.sha256(chunks[index]).hexdigest())
+        status = self.client.get(f"/file/upload/sessions/{session['session_id']}/", {"token": "token"}).json()
+        self.assertEqual(status["received"], [[0, 100], [200, 300], [len(chunks) * 100 - 100, len(self.CSV)]])
+        self.assertEqual(self.complete(session["session_id"]).status_code, 400)  # Missing chunks
+
+        for index in set(range(len(chunks))) - {len(chunks) - 1, 0, 2}:
+            self.assertEqual(self.put(session["session_id"], index, chunks[index]).status_code, 200)
+        response = self.complete(session["session_id"])
+        self.assertEqual(response.status_code, 200)
+        user_file = UserFile.objects.get(random_name=response.json()["random_name"])
+        with open_data(user_file.path) as f:
+            self.assertEqual(f.read(), self.CSV)
+        self.assertFalse(os.path.exists(staging.session_dir(session["session_id"])))
+
+    def test_checksum_mismatch(self):
+        session_id = self.create(self.CSV, sha256="0" * 64).json()["session_id"]
+        chunks = self.chunks(self.CSV)
+        response = self.put(session_id, 0, chunks[0], X_Chunk_SHA256="0" * 64)
+        self.assertEqual(response.status_code, 400)
+        self.assertNotIn(0, staging.received_chunks(session_id))
+
+        for index, chunk in enumerate(chunks):
+            self.assertEqual(self.put(session_id, index, chunk).status_code, 200)
+        response = self.complete(session_id)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Checksum mismatch", response.json()["error"])
+        self.assertFalse(UserFile.objects.exists())
+
+    def test_wrong_chunk_sizes(self):
+        session_id = self.create(self.CSV).json()["session_id"]
+        self.assertEqual(self.put(session_id, 0, self.CSV[:99]).status_code, 400)
+        self.assertEqual(self.put(session_id, 0, self.CSV[:101]).status_code, 400)
+        self.assertEqual(self.put(session_id, 100, self.CSV[:100]).status_code, 400)
+
+    def test_empty_file_rejected(self):
+        self.assertEqual(self.create(b"").status_code, 400)
+
+    def test_no_writes_while_assembling(self):
+        session_id = self.create(self.CSV).json()["session_id"]
+        UploadSession.objects.filter(session_id=session_id).update(assembling=True)
+        self.assertEqual(self.put(session_id, 0, self.CSV[:100]).status_code, 409)
+        self.assertEqual(self.complete(session_id).status_code, 409)
+
+    def test_other_token_refused(self):
+        session_id = self.create(self.CSV).json()["session_id"]
+        response = self.client.put(
+            f"/file/upload/sessions/{session_id}/chunks/0/?token=other", self.CSV[:100],
+            content_type="application/octet-stream",
+        )
+        self.assertEqual(response.status_code, 403)
+
+
+class ParsingTests(TestCase):
+    # Text pyarrow parses but pandas doesn't: hexadecimal numbers, integers
+    # beyond int64, times of day and ISO timestamps
+    CSV = (
+        "hex,big,time,when,plus,x\n"
+        "0x10,12345678901234567890,12:00,2024-01-02T03:04:05,+5,1.0\n"
+        "0x1f,22345678901234567890,13:30:00,2024-01-03T03:04:05.5,6,\n"
+    ).encode()
+
+    def assert_parsed_like_pandas(self, csv):
+        expected = pd.read_csv(io.BytesIO(csv), float_precision="round_trip")
+        pd.testing.assert_frame_equal(parse_csv(io.BytesIO(csv)), expected)
+
+    def test_types_match_pandas(self):
+        self.assert_parsed_like_pandas(self.CSV)
+        # Without the integer columns pandas reads, pyarrow's parse is used
+        self.assert_parsed_like_pandas(self.CSV.replace(b"+5", b"5.5").replace(b"2345678901234567890", b"0"))
+        with mock.patch("file_upload.parsing.pd.read_csv", side_effect=AssertionError):
+            df = parse_csv(io.BytesIO(b"hex,time,when\n0x10,12:00,2024-01-02T03:04:05\n"))
+        self.assertEqual(df.iloc[0].tolist(), ["0x10", "12:00", "2024-01-02T03:04:05"])
+
+    def test_invalid_utf8_fails_like_pandas(self):
+        csv = "name,n\ncaf\xe9,1\n".encode("latin-1")
+        with self.assertRaises(UnicodeDecodeError):
+            pd.read_csv(io.BytesIO(csv))
+        with self.assertRaises(UnicodeDecodeError):
+            parse_csv(io.BytesIO(csv))
+
+
+class DatasetCacheTests(UploadDirTestCase):
+    def test_hit_after_miss_and_reload_after_rewrite(self):
+        path = self.write_csv("data", "a,b\n1,x\n2,y\n")
+        cache = DatasetCache()
+        first = cache.get(path)
+        self.assertIs(cache.get(path), first)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        self.write_csv("data", "a,b\n1,x\n2,y\n3,z\n")
+        later = os.stat(path).st_mtime_ns + 10 ** 9  # Newer than the sidecars even within the clock's resolution
+        os.utime(path, ns=(later, later))
+        self.assertEqual(len(cache.get(path)), 3)
+
+    def test_column_projections_are_cached_separately(self):
+        path = self.write_csv("data", "a,b\n1,x\n")
+        cache = DatasetCache()
+        self.assertEqual(list(cache.get(path, ["b"]).columns), ["b"])
+        self.assertEqual(list(cache.get(path).columns), ["a", "b"])
+        self.assertEqual(cache.stats()["entries"], 2)
+
+    def test_evicts_least_recently_used_over_budget(self):
+        first = self.write_csv("first", "a\n" + "1\n" * 1000)
+        second = self.write_csv("second", "a\n" + "2\n" * 1000)
+        cache = DatasetCache()
+        cache.max_bytes = int(cache.get(first).memory_usage(deep=True).sum()) + 1
+        cache.get(second)
+        self.assertEqual(cache.evictions, 1)
+        cache.get(second)
+        self.assertEqual(cache.hits, 1)
+
+    def test_stats_hold_no_file_names(self):
+        path = self.write_csv("data", "a\n1\n")
+        cache = DatasetCache()
+        cache.get(path)
+        stats = cache.stats()
+        self.assertEqual(set(stats), {"hits", "misses", "evictions", "entries", "bytes", "max_bytes"})
+        self.assertNotIn("data", str(stats))
+
+
+class SidecarTests(UploadDirTestCase):
+    def test_concurrent_builds_dont_collide(self):
+        path = self.write_csv("data", "a,b\n" + "".join(f"{i},{i % 7}\n" for i in range(20000)))
+        with ThreadPoolExecutor(4) as pool:
+            results = list(pool.map(lambda _: write_columnar(path), range(8)))
+        self.assertEqual(open_table(results[0]).num_rows, 20000)
+        self.assertEqual(sorted(os.listdir("uploaded_files")), ["data", "data.arrow", "data.schema.json"])
+
+
+class FilterValidationTests(TestCase):
+    def test_invalid_filters(self):
+        invalid = [
+            'not json',
+            '[]',
+            '{"column": "a", "op": "like", "value": 1}',
+            '{"op": "eq", "value": 1}',
+            '{"and": []}',
+            '{"and": {"column": "a", "op": "eq", "value": 1}}',
+            '{"not": {"column": "a", "op": "eq", "value": 1}, "or": []}',
+            '{"column": "a", "op": "in", "value": []}',
+            '{"column": "a", "op": "in", "value": [[1]]}',
+            '{"column": "a", "op": "between", "value": [1]}',
+            '{"column": "a", "op": "contains", "value": 1}',
+            '{"column": "a", "op": "eq", "value": {"x": 1}}',
+            '{"or": [' + ", ".join(['{"column": "a", "op": "eq", "value": 1}'] * 64) + ']}',
+        ]
+        for text in invalid:
+            with self.subTest(text=text):
+                with self.assertRaises(FilterError):
+                    parse_filter(text)
+
+    def test_normalized(self):
+        spec = parse_filter('{"not": {"column": "a", "op": "is_null", "value": "ignored"}}')
+        self.assertEqual(spec, {"not": {"column": "a", "op": "is_null"}})
+
+    def test_values_checked_against_column_kinds(self):
+        kinds = {"n": "number", "s": "string", "b": "bool", "d": "date"}
+        invalid = [
+            {"column": "missing", "op": "is_null"},
+            {"column": "n", "op": "eq", "value": "1"},
+            {"column": "n", "op": "eq", "value": True},
+            {"column": "n", "op": "contains", "value": "1"},
+            {"column": "s", "op": "gt", "value": 1},
+            {"column": "b", "op": "lt", "value": True},
+            {"column": "b", "op": "eq", "value": 1},
+            {"column": "d", "op": "gt", "value": "yesterday-ish"},
+            {"and": [{"column": "n", "op": "gt", "value": 1}, {"column": "s", "op": "in", "value": ["a", 2]}]},
+        ]
+        for spec in invalid:
+            with self.subTest(spec=spec):
+                with self.assertRaises(FilterError):
+                    check_filter(spec, kinds)
+        check_filter({"or": [
+            {"column": "n", "op": "between", "value": [1, 2.5]},
+            {"column": "b", "op": "in", "value": [True]},
+            {"column": "d", "op": "ge", "value": "2024-01-31"},
+            {"column": "s", "op": "is_null"},
+        ]}, kinds)
+
+
+@mock.patch.object(filters, "ZONE_ROWS", 100)
+class FilterEvaluationTests(UploadDirTestCase):
+    def setUp(self):
+        super().setUp()
+        rng = np.random.default_rng(0)
+        rows = 1000
+        n = rng.integers(0, 100, rows).astype(float)
+        n[rng.random(rows) < 0.1] = np.nan
+        n[300:400] = np.nan  # A whole zone of nulls
+        s = rng.choice(["alpha", "beta", "gamma", ""], rows)
+        self.expected = pd.DataFrame({
+            "n": n,
+            "x": np.arange(rows),  # Sorted, most zones can be skipped
+            "s": s,
+            "b": rng.random(rows) < 0.5,
+            "d": pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 60, rows), unit="D"),
+        })
+        self.expected["s"] = self.expected["s"].replace("", None)
+        self.path = os.path.join("uploaded_files", "data")
+        self.expected.to_csv(self.path, index=False)
+
+    def check(self, spec, expected):
+        with self.subTest(spec=spec):
+            check_filter(spec, column_kinds(load_profile(self.path)))
+            np.testing.assert_array_equal(filter_mask(self.path, spec), expected.to_numpy(dtype=bool))
+
+    def test_masks_match_pandas(self):
+        df = self.expected
+        self.check({"column": "n", "op": "gt", "value": 50}, df.n > 50)
+        self.check({"column": "n", "op": "ne", "value": 3}, (df.n != 3) & df.n.notna())
+        self.check({"column": "n", "op": "is_null"}, df.n.isna())
+        self.check({"column": "x", "op": "between", "value": [120, 250]}, df.x.between(120, 250))
+        self.check({"column": "x", "op": "eq", "value": 999}, df.x == 999)
+        self.check({"column": "x", "op": "in", "value": [5, 505, 2000]}, df.x.isin([5, 505]))
+        self.check({"column": "s", "op": "not_in", "value": ["alpha"]}, (df.s != "alpha") & df.s.notna())
+        self.check({"column": "s", "op": "lt", "value": "beta"}, df.s < "beta")
+        self.check({"column": "s", "op": "startswith", "value": "g"}, df.s.str.startswith("g").fillna(False))
+        self.check({"column": "b", "op": "eq", "value": True}, df.b)
+        self.check({"column": "d", "op": "ge", "value": "2024-02-15"}, df.d >= "2024-02-15")
+        self.check(
+            {"or": [{"column": "x", "op": "lt", "value": 10}, {"not": {"column": "n", "op": "le", "value": 90}}]},
+            (df.x < 10) | ~(df.n <= 90),
+        )
+        self.check(
+            {"and": [{"column": "n", "op": "ge", "value": 20}, {"column": "s", "op": "eq", "value": "beta"}]},
+            (df.n >= 20) & (df.s == "beta"),
+        )
+
+    def test_masks_are_cached(self):
+        spec = {"column": "x", "op": "lt", "value": 10}
+        first = filter_mask(self.path, spec)
+        self.assertEqual(len(os.listdir(masks_dir(self.path))), 1)
+        with mock.patch.object(filters, "_evaluate") as evaluate:
+            np.testing.assert_array_equal(filter_mask(self.path, spec), first)
+        evaluate.assert_not_called()
+
+    def test_concurrent_mask_writes_use_their_own_files(self):
+        path = os.path.join(masks_dir(self.path), "mask.npy")
+        mask = np.arange(100) % 3 == 0
+        with mock.patch.object(filters.np, "save", wraps=np.save) as save:
+            with ThreadPoolExecutor(4) as pool:
+                list(pool.map(lambda _: filters._store_mask(path, mask), range(8)))
+        self.assertEqual(len({call.args[0] for call in save.call_args_list}), 8)
+        self.assertEqual(os.listdir(masks_dir(self.path)), ["mask.npy"])
+        np.testing.assert_array_equal(np.unpackbits(np.load(path))[:100].astype(bool), mask)
+
+
+class ZoneMapTests(UploadDirTestCase):
+    def test_concurrent_loads_build_once(self):
+        path = self.write_csv("data", "a\n" + "".join(f"{i}\n" for i in range(1000)))
+        started, release = threading.Event(), threading.Event()
+        build = filters.build_zone_maps
+
+        def slow_build(file_path):
+            started.set()
+            release.wait(5)
+            return build(file_path)
+
+        with mock.patch.object(filters, "build_zone_maps", side_effect=slow_build) as patched:
+            with ThreadPoolExecutor(4) as pool:
+                first = pool.submit(filters.load_zone_maps, path)
+                started.wait(5)
+                shared = single_flight.stats()["shared"]
+                others = [pool.submit(filters.load_zone_maps, path) for _ in range(3)]
+                while single_flight.stats()["shared"] < shared + 3:  # Wait for them to join the build
+                    time.sleep(0.001)
+                release.set()
+                results = [first.result()] + [other.result() for other in others]
+        self.assertEqual(patched.call_count, 1)
+        self.assertTrue(all(result is results[0] for result in results))
+        self.assertEqual(float(results[0]["maxs"][0][0]), 999)
+
+    @mock.patch.object(filters, "ZONE_ROWS", 100)
+    def test_only_numerical_columns_read(self):
+        path = self.write_csv("data", "a,b,c\n" + "".join(f"{i},x{i},{i / 2}\n" for i in range(250)))
+        with mock.patch.object(filters, "read_dataset", wraps=filters.read_dataset) as read_dataset:
+            zones = filters.build_zone_maps(path)
+        read_dataset.assert_called_once_with(path, ["a", "c"])
+        self.assertEqual(zones["columns"].tolist(), ["a", "c"])
+        self.assertEqual(zones["maxs"].tolist(), [[99, 199, 249], [49.5, 99.5, 124.5]])
+
+        path = self.write_csv("text", "b\n" + "".join(f"x{i}\n" for i in range(250)))
+        zones = filters.build_zone_maps(path)
+        self.assertEqual((int(zones["rows"]), zones["mins"].shape), (250, (0, 3)))
+
+
+class RowIndexTests(UploadDirTestCase):
+    CSV = (
+        'a,b\n'
+        '\n'
+        '0,"multi\nline"\n'
+        '1,x\r\n'
+        '\r\n'
+        '2,"quoted ""comma"", here"\n'
+        '3,y\n'
+        '4,z\n'
+        '5,w\n'
+        '6,v'  # No trailing newline
+    )
+
+    def assert_pages_match_pandas(self, path):
+        with open_data(path) as f:
+            expected = pd.read_csv(f)
+        columns = expected.columns.tolist()
+        for start, stop in [(0, 7), (2, 5), (3, 4), (6, 7), (-3, -1), (-2, 7), (0, -5), (5, 2), (7, 9), (-20, 2)]:
+            with self.subTest(start=start, stop=stop):
+                page = read_rows(path, start, stop, columns)
+                chunks = list(iter_rows(path, start, stop, columns, chunk_rows=2))
+                if expected.iloc[start:stop].empty:
+                    self.assertTrue(page.empty)
+                    self.assertEqual(chunks, [])
+                    continue
+                pd.testing.assert_frame_equal(page, expected.iloc[start:stop], check_index_type=False)
+                pd.testing.assert_frame_equal(pd.concat(chunks), expected.iloc[start:stop], check_index_type=False)
+
+    def test_pages_match_pandas(self):
+        path = self.write_csv("data", self.CSV)
+        index = build_row_index(path, stride=3)
+        self.assertEqual(index["row_count"], 7)
+        self.assert_pages_match_pandas(path)
+
+    def test_pages_of_compressed_file(self):
+        path = self.write_csv("data", self.CSV)
+        compress_file(path, "gzip")
+        build_row_index(path, stride=2)
+        self.assert_pages_match_pandas(path)
+
+    def test_stale_index_is_rebuilt(self):
+        path = self.write_csv("data", "a\n1\n2\n")
+        build_row_index(path, stride=1)
+        self.write_csv("data", "a\n1\n2\n3\n4\n")
+        self.assertEqual(read_rows(path, -1, None, ["a"])["a"].tolist(), [4])
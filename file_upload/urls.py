@@ -1,9 +1,17 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views as sync_views
+
+# Async versions of the views are used when running under ASGI
+views = async_views if settings.ASYNC_VIEWS else sync_views
 
 urlpatterns = [
     path('upload/', views.upload_file, name='upload_file'),
     path('remove/', views.remove_file, name='remove_file'),
     path('', views.retreive_files, name='retreive_files'),
-    path('meta/', views.get_file_info, name='get_file_info')
+    path('meta/', views.get_file_info, name='get_file_info'),
+    path('upload/sessions/', views.create_upload_session, name='create_upload_session'),
+    path('upload/sessions/<str:session_id>/', views.upload_session_status, name='upload_session_status'),
+    path('upload/sessions/<str:session_id>/chunks/<int:index>/', views.upload_chunk, name='upload_chunk'),
+    path('upload/sessions/<str:session_id>/complete/', views.complete_upload_session, name='complete_upload_session'),
 ]
\ No newline at end of file
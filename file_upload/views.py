@@ -1,65 +1,132 @@
 import os
-import json
 import random
 import string
+import uuid
+from datetime import timedelta
+from typing import Optional
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
 from django.http import JsonResponse
 from pydantic import BaseModel, ValidationError
 from django.views.decorators.csrf import csrf_exempt
+from .models import Blob, UserFile, UploadSession
+from data_analytics.aggregates import build_aggregates, remove_aggregates
+from data_analytics.plot_cache import plot_cache
+from file_info.statistics import remove_statistics
+from .blobs import acquire_blob, release_blob
+from .cache import dataset_cache
+from .columnar import ensure_columnar, remove_columnar
+from .compression import compress_file, storage_codec
+from .filters import remove_filter_files
+from .handlers import StreamingUploadHandler
+from .profile import build_profile, remove_profile
+from .rowindex import build_row_index, remove_row_index
+from .schema import remove_schema
+from .staging import ChunkError, assemble, discard, received_chunks, received_ranges, write_chunk
 
 UPLOAD_DIR = "uploaded_files"
-USER_FILES_PATH = os.path.join(UPLOAD_DIR, "user_files.json")
 
-# Ensure directories and the tracking file exist
+# Ensure the upload directory exists
 os.makedirs(UPLOAD_DIR, exist_ok=True)
-if not os.path.exists(USER_FILES_PATH):
-    with open(USER_FILES_PATH, 'w') as f:
-        json.dump({}, f) 
 
 class FileUploadRequest(BaseModel):
-    file: bytes  # The uploaded file in bytes
     token: str  # User token (custom token generated in the front)
 
+# Build the derived files of newly stored content
+def build_derived_files(file_path):
+    # Convert to the columnar sidecar used by file_info/data_analytics
+    ensure_columnar(file_path)
+
+    # Precompute the profile served by describe/head/columns/shape.
+    # Files pandas can't parse are still stored, the analytics
+    # endpoints report the parse error when they are used.
+    try:
+        build_profile(file_path)
+        # Histogram bins and correlations used by the plots
+        build_aggregates(file_path)
+    except ValueError:
+        pass
+
+    # Index row offsets so pages of rows can be read without parsing the whole file
+    build_row_index(file_path)
+
+
+# Store a fully written upload as its content's blob, register it under a new
+# name and build the blob's derived files. Content that is already stored is
+# only referenced, its derived files are reused. New content is stored
+# compressed with STORAGE_COMPRESSION (see compression.py).
+# Shared by the single-request and the resumable upload paths.
+def store_file(temp_path, token, original_name, size, sha256):
+    # Generate a random filename
+    random_name = ''.join(random.choices(string.ascii_letters + string.digits, k=12))
+
+    # Compressed before the blob is locked; the file is dropped if the content turns out to be stored already
+    codec = storage_codec()
+    if codec and not Blob.objects.filter(sha256=sha256).exists():
+        compress_file(temp_path, codec)
+
+    # Register the file for its owner
+    with transaction.atomic():
+        blob, stored = acquire_blob(temp_path, sha256, size)
+        user_file = UserFile.objects.create(
+            random_name=random_name,
+            owner_token=token,
+            original_name=original_name,
+            size=size,
+            sha256=sha256,
+            blob=blob,
+        )
+
+    if stored:
+        # Built outside the transaction, which would hold the database's write lock meanwhile.
+        # If it fails the upload fails: unregister it like a removal would.
+        try:
+            build_derived_files(blob.path)
+        except BaseException:
+            with transaction.atomic():
+                user_file.delete()
+                if release_blob(blob):
+                    remove_stored_file(blob.path)
+            raise
+
+    return user_file
+
 @csrf_exempt
 def upload_file(request):
     if request.method == 'POST':
+        # Stream the file to disk instead of buffering it in memory
+        handler = StreamingUploadHandler(request, UPLOAD_DIR)
+        request.upload_handlers = [handler]
+        uploaded = None
         try:
+            uploaded = request.FILES.get('file')
+            if handler.too_large:
+                return JsonResponse({'error': 'File exceeds the maximum upload size'}, status=413)
+            if handler.invalid:
+                return JsonResponse({'error': handler.invalid}, status=400)
+
             # Validate incoming data
             data = FileUploadRequest(
-                file=request.FILES['file'].read(),
                 token=request.POST['token']
             )
-
-            # Generate a random filename
-            random_name = ''.join(random.choices(string.ascii_letters + string.digits, k=12))
-            file_path = os.path.join(UPLOAD_DIR, random_name)
-
-            # Save the uploaded file
-            with open(file_path, 'wb') as f:
-                f.write(data.file)
-
-            # Save metadata
-            meta_data = {
-                "owner_token": data.token,
-                "original_name": request.FILES['file'].name,
-            }
-            meta_path = f"{file_path}.meta.json"
-            with open(meta_path, 'w') as meta_file:
-                json.dump(meta_data, meta_file)
-
-            # Update the user files tracking
-            with open(USER_FILES_PATH, 'r+') as user_files_file:
-                user_files = json.load(user_files_file)
-                if data.token not in user_files:
-                    user_files[data.token] = []
-                user_files[data.token].append(random_name)
-                user_files_file.seek(0)
-                json.dump(user_files, user_files_file, indent=4)
-                user_files_file.truncate()
+            if uploaded is None:
+                raise KeyError('file')
+
+            # Move the streamed file into place and register it
+            uploaded.close()
+            user_file = store_file(
+                uploaded.temporary_file_path(),
+                data.token,
+                uploaded.name,
+                uploaded.size,
+                uploaded.sha256
+            )
 
             return JsonResponse({
                 "message": "File uploaded successfully",
-                "random_name": random_name,
-                "original_name": meta_data["original_name"]
+                "random_name": user_file.random_name,
+                "original_name": user_file.original_name
             })
         except ValidationError as e:
             return JsonResponse({'error': e.errors()}, status=400)
@@ -67,9 +134,35 @@ def upload_file(request):
             return JsonResponse({'error': 'Missing file or token'}, status=400)
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=500)
+        finally:
+            # Drop the temporary file if the upload wasn't stored
+            if uploaded is not None and os.path.exists(uploaded.temporary_file_path()):
+                uploaded.close()
+                os.remove(uploaded.temporary_file_path())
 
     return JsonResponse({'error': 'Invalid request method'}, status=405)
 
+# Remove a stored file with its derived files and cached copies
+def remove_stored_file(file_path):
+    if os.path.exists(file_path):
+        os.remove(file_path)
+
+    remove_columnar(file_path)
+    remove_schema(file_path)
+    remove_profile(file_path)
+    remove_aggregates(file_path)
+    remove_filter_files(file_path)
+    remove_row_index(file_path)
+    remove_statistics(file_path)
+
+    # Uploads stored before the UserFile model also have a metadata file
+    meta_path = f"{file_path}.meta.json"
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+    # Drop the parsed copy from the dataset cache
+    dataset_cache.invalidate(os.path.basename(file_path))
+
 class FileRemovalRequest(BaseModel):
     token: str 
     file_name: str  
@@ -84,33 +177,26 @@ def remove_file(request):
                 file_name=request.POST['file_name']
             )
 
-            # Load the user files mapping
-            with open(USER_FILES_PATH, 'r+') as user_files_file:
-                user_files = json.load(user_files_file)
-
-                # Check if the token exists and owns the file
-                if data.token not in user_files or data.file_name not in user_files[data.token]:
-                    return JsonResponse({'error': 'File not found or unauthorized access'}, status=403)
-
-                # Remove the file
-                file_path = os.path.join(UPLOAD_DIR, data.file_name)
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-
-                # Remove metadata
-                meta_path = f"{file_path}.meta.json"
-                if os.path.exists(meta_path):
-                    os.remove(meta_path)
-
-                # Update the user files mapping
-                user_files[data.token].remove(data.file_name)
-                if not user_files[data.token]:  # If no files are left for the user, remove the key
-                    del user_files[data.token]
-
-                # Save the updated user files mapping
-                user_files_file.seek(0)
-                json.dump(user_files, user_files_file, indent=4)
-                user_files_file.truncate()
+            # Unregister the file; only the request that deletes the row removes it from disk.
+            # A blob is removed with its last reference, in the same transaction so a
+            # concurrent upload of the same content stores it again instead of reusing it.
+            with transaction.atomic():
+                user_file = UserFile.objects.filter(
+                    owner_token=data.token,
+                    random_name=data.file_name
+                ).select_related('blob').first()
+                deleted = user_file.delete()[0] if user_file else 0
+                if deleted and user_file.blob is not None and release_blob(user_file.blob):
+                    remove_stored_file(user_file.path)
+            if not deleted:
+                return JsonResponse({'error': 'File not found or unauthorized access'}, status=403)
+
+            if user_file.blob is None:
+                remove_stored_file(user_file.path)
+
+            # Drop its rendered plots unless another upload has the same content
+            if user_file.sha256 and not UserFile.objects.filter(sha256=user_file.sha256).exists():
+                plot_cache.purge(user_file.sha256)
 
             return JsonResponse({"message": "File removed successfully"})
         except ValidationError as e:
@@ -131,24 +217,13 @@ def retreive_files(request):
             # Validate incoming data
             token=request.GET['token']
 
-            # Load the user files mapping
-            with open(USER_FILES_PATH, 'r') as user_files_file:
-                user_files = json.load(user_files_file)
-
-                # Check if the token exists and owns the file
-                if token not in user_files:
-                    return JsonResponse({'error': 'User not found'}, status=403)
-                
-            files = []
-                
-            for file in user_files[token]:
-                file_path = os.path.join(UPLOAD_DIR, file)
-                meta_path = f"{file_path}.meta.json"
-                with open(meta_path, 'r') as meta_file:
-                    meta_data = json.load(meta_file)
-                    meta_data['random_name'] = file
-                
-                files.append(meta_data)
+            # Look up the user's files
+            files = [user_file.to_meta() for user_file in UserFile.objects.filter(owner_token=token).order_by('id')]
+
+            # Check if the token owns any file
+            if not files:
+                return JsonResponse({'error': 'User not found'}, status=403)
+
             return JsonResponse({'files': files})
 
         except KeyError:
@@ -169,21 +244,12 @@ def get_file_info(request):
             token=request.GET['token']
             file_name=request.GET['file_name']
 
-            # Load the user files mapping
-            with open(USER_FILES_PATH, 'r') as user_files_file:
-                user_files = json.load(user_files_file)
-
-                # Check if the token exists and owns the file
-                if token not in user_files or file_name not in user_files[token]:
-                    return JsonResponse({'error': 'File not found or unauthorized access'}, status=403)
-                
-            file_path = os.path.join(UPLOAD_DIR, file_name)
-            meta_path = f"{file_path}.meta.json"
-            with open(meta_path, 'r') as meta_file:
-                meta_data = json.load(meta_file)
-                meta_data['random_name'] = file_name
+            # Check that the token owns the file
+            user_file = UserFile.objects.filter(owner_token=token, random_name=file_name).first()
+            if user_file is None:
+                return JsonResponse({'error': 'File not found or unauthorized access'}, status=403)
 
-            return JsonResponse({'file_info': meta_data})
+            return JsonResponse({'file_info': user_file.to_meta()})
 
         except KeyError:
             return JsonResponse({'error': 'Missing token or file_name'}, status=400)
@@ -192,4 +258,182 @@ def get_file_info(request):
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=500)
 
-    return JsonResponse({'error': 'Invalid request method'}, status=405)
\ No newline at end of file
+    return JsonResponse({'error': 'Invalid request method'}, status=405)
+
+
+# Resumable uploads: create a session, PUT numbered chunks (in any order,
+# possibly in parallel), poll the status to find what is missing, then complete.
+class UploadSessionRequest(BaseModel):
+    token: str
+    file_name: str  # Original file name
+    total_size: int
+    chunk_size: Optional[int] = None
+    sha256: Optional[str] = None  # Optional digest of the whole file, checked on completion
+
+
+def get_upload_session(token, session_id):
+    session = UploadSession.objects.filter(session_id=session_id, owner_token=token).first()
+    if session is None:
+        return None, JsonResponse({'error': 'Upload session not found or unauthorized access'}, status=403)
+    return session, None
+
+
+def upload_session_info(session):
+    received = set(received_chunks(session.session_id))
+    return {
+        "session_id": session.session_id,
+        "original_name": session.original_name,
+        "total_size": session.total_size,
+        "chunk_size": session.chunk_size,
+        "chunk_count": session.chunk_count,
+        "received": received_ranges(session),
+        "missing_chunks": [index for index in range(session.chunk_count) if index not in received],
+    }
+
+
+@csrf_exempt
+def create_upload_session(request):
+    if request.method == 'POST':
+        try:
+            chunk_size = request.POST.get('chunk_size', '').strip()
+            data = UploadSessionRequest(
+                token=request.POST['token'],
+                file_name=request.POST['file_name'],
+                total_size=int(request.POST['total_size']),
+                chunk_size=int(chunk_size) if chunk_size else None,
+                sha256=request.POST.get('sha256') or None
+            )
+
+            max_size = getattr(settings, 'MAX_UPLOAD_SIZE', None)
+            if max_size is not None and data.total_size > max_size:
+                return JsonResponse({'error': 'File exceeds the maximum upload size'}, status=413)
+
+            chunk_size = data.chunk_size or settings.UPLOAD_CHUNK_SIZE
+            # An empty file has nothing to upload in chunks (and no CSV header)
+            if data.total_size <= 0 or not 0 < chunk_size <= settings.MAX_UPLOAD_CHUNK_SIZE:
+                return JsonResponse({'error': 'Invalid total_size or chunk_size'}, status=400)
+
+            # Drop sessions that were abandoned
+            expired = timezone.now() - timedelta(seconds=settings.UPLOAD_SESSION_TTL)
+            for stale in UploadSession.objects.filter(created_at__lt=expired):
+                discard(stale.session_id)
+                stale.delete()
+
+            session = UploadSession.objects.create(
+                session_id=uuid.uuid4().hex,
+                owner_token=data.token,
+                original_name=data.file_name,
+                total_size=data.total_size,
+                chunk_size=chunk_size,
+                sha256=data.sha256 or ''
+            )
+
+            return JsonResponse(upload_session_info(session), status=201)
+        except ValidationError as e:
+            return JsonResponse({'error': e.errors()}, status=400)
+        except KeyError:
+            return JsonResponse({'error': 'Missing token, file_name or total_size'}, status=400)
+        except ValueError:
+            return JsonResponse({'error': 'total_size and chunk_size must be integers'}, status=400)
+        except Exception as e:
+            return JsonResponse({'error': str(e)}, status=500)
+
+    return JsonResponse({'error': 'Invalid request method'}, status=405)
+
+
+@csrf_exempt
+def upload_session_status(request, session_id):
+    if request.method == 'GET':
+        try:
+            session, error = get_upload_session(request.GET['token'], session_id)
+            if error:
+                return error
+
+            return JsonResponse(upload_session_info(session))
+        except KeyError:
+            return JsonResponse({'error': 'Missing token'}, status=400)
+        except Exception as e:
+            return JsonResponse({'error': str(e)}, status=500)
+
+    return JsonResponse({'error': 'Invalid request method'}, status=405)
+
+
+@csrf_exempt
+def upload_chunk(request, session_id, index):
+    if request.method == 'PUT':
+        try:
+            session, error = get_upload_session(request.GET['token'], session_id)
+            if error:
+                return error
+
+            if index >= session.chunk_count:
+                return JsonResponse({'error': 'Invalid chunk index'}, status=400)
+            # The staged chunks are being read into the file
+            if session.assembling:
+                return JsonResponse({'error': 'Upload is already being completed'}, status=409)
+
+            # The body is streamed to the staging area, verified against X-Chunk-SHA256 if sent
+            sha256 = write_chunk(
+                session.session_id,
+                index,
+                request,
+                session.expected_chunk_size(index),
+                request.headers.get('X-Chunk-SHA256')
+            )
+
+            return JsonResponse({"index": index, "sha256": sha256})
+        except ChunkError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        except KeyError:
+            return JsonResponse({'error': 'Missing token'}, status=400)
+        except Exception as e:
+            return JsonResponse({'error': str(e)}, status=500)
+
+    return JsonResponse({'error': 'Invalid request method'}, status=405)
+
+
+@csrf_exempt
+def complete_upload_session(request, session_id):
+    if request.method == 'POST':
+        try:
+            session, error = get_upload_session(request.POST['token'], session_id)
+            if error:
+                return error
+
+            # Only one completion request may assemble the file
+            if not UploadSession.objects.filter(pk=session.pk, assembling=False).update(assembling=True):
+                return JsonResponse({'error': 'Upload is already being completed'}, status=409)
+
+            try:
+                temp_path, sha256, size = assemble(session)
+            except ChunkError as e:
+                UploadSession.objects.filter(pk=session.pk).update(assembling=False)
+                return JsonResponse({'error': str(e)}, status=400)
+
+            try:
+                user_file = store_file(
+                    temp_path,
+                    session.owner_token,
+                    session.original_name,
+                    size,
+                    sha256
+                )
+            except Exception:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                UploadSession.objects.filter(pk=session.pk).update(assembling=False)
+                raise
+            discard(session.session_id)
+            session.delete()
+
+            return JsonResponse({
+                "message": "File uploaded successfully",
+                "random_name": user_file.random_name,
+                "original_name": user_file.original_name
+            })
+        except KeyError:
+            return JsonResponse({'error': 'Missing token'}, status=400)
+        except Exception as e:
+            return JsonResponse({'error': str(e)}, status=500)
+
+    return JsonResponse({'error': 'Invalid request method'}, status=405)